@@ -0,0 +1,47 @@
+import argparse
+import logging
+import sys
+
+from optimization.pipeline import load_job, run_job
+from optimization.sweep import run_sweep
+from utils.profiling import profiler
+
+
+def main(argv=None):
+    """ Run mesh -> FEA -> optimization jobs from JSON job files without the GUI """
+    parser = argparse.ArgumentParser(description="Run topology optimization jobs headless.")
+    parser.add_argument("jobs", nargs="+", help="JSON job files")
+    parser.add_argument("-w", "--workers", type=int, help="Processes for jobs with a sweep (default: all cores)")
+    parser.add_argument("-r", "--resume", action="store_true", help="Continue jobs from their last checkpoint")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every optimization iteration")
+    parser.add_argument("--profile", help="Write stage timings and counters of the whole run to this JSON file")
+    parser.add_argument("--trace", help="Write a Chrome trace (chrome://tracing, Perfetto) to this JSON file")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    failed = 0
+    for path in args.jobs:
+        try:
+            job = load_job(path)
+            if "sweep" in job:
+                rows = run_sweep(job, job["sweep"], workers=args.workers)
+                failed += any(row["error"] for row in rows)
+                logging.info(f"Sweep {path} finished: {len(rows)} runs, results in {job['output']}")
+                continue
+            summary = run_job(job, resume=args.resume)
+        except Exception as e:
+            logging.error(f"Job {path} failed: {e}")
+            failed += 1
+            continue
+        logging.info(f"Job {path} finished: compliance {summary['compliance']:.6g}, results in {job['output']}")
+
+    if args.profile:
+        profiler.write_json(args.profile)
+    if args.trace:
+        profiler.write_chrome_trace(args.trace)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import scipy
+import trimesh
+
+from fea.mesh_generation import voxelize
+from optimization.algorithms import simp_interpolation
+from optimization.filters import DensityFilter
+from optimization.pipeline import DEFAULT_MATERIAL, DEFAULT_OPTIMIZATION, build_problem, element_dtype, material_from
+from utils.file_utils import read_stl
+from utils.profiling import PeakMemory
+
+STAGES = ("load", "mesh", "assemble", "solve", "filter", "render")
+# Stages faster than this are dominated by timer noise and never flagged as regressions
+MIN_COMPARE_SECONDS = 0.05
+MIN_COMPARE_MB = 16.0
+
+
+def measure(stages, name, function, *args):
+    """ Run function(*args), record its time and peak memory under stages[name] and return its result """
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+    stages[name] = {"seconds": seconds, **memory.as_dict()}
+    return result
+
+
+def benchmark_cases(names, work_dir):
+    """ {case: STL path}; "box" is a synthetic 100 x 40 x 20 cantilever written to work_dir """
+    cases = {}
+    for name in names:
+        if name == "box":
+            path = os.path.join(work_dir, "box.stl")
+            box = trimesh.creation.box(extents=(100.0, 40.0, 20.0))
+            box.apply_translation(-box.bounds[0])
+            box.export(path)
+            cases[name] = path
+        elif name == "extruder":
+            cases[name] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extruder_body.stl")
+        elif os.path.isfile(name):
+            cases[os.path.splitext(os.path.basename(name))[0]] = name
+        else:
+            raise ValueError(f"Unknown benchmark case: {name}")
+    return cases
+
+
+def solve(solver, forces, scale):
+    u = solver.solve(forces, scale)
+    return solver.compliance(forces, u)
+
+
+def apply_filter(voxel_mesh, settings, densities):
+    design_filter = DensityFilter(settings["filter_radius"] * min(voxel_mesh.spacing), shape=voxel_mesh.shape,
+                                  spacing=voxel_mesh.spacing, active=voxel_mesh.occupancy, mode=settings["filter_mode"],
+                                  dtype=element_dtype(settings))
+    physical = design_filter.filter_densities(densities)
+    design_filter.filter_sensitivities(-physical, densities)
+    return physical
+
+
+def render_offscreen(voxel_mesh, surface, densities, frames=10, size=(800, 600)):
+    """
+    Render the STL surface and the thresholded density grid the way the GUI's
+    Renderer does, in an offscreen window. Returns the first-frame time and the mean
+    time of frames that only rewrite the density buffer (the live optimization view).
+    """
+    # VTK stays out of the other stages so they can be benchmarked without a GL stack
+    import vtkmodules.vtkRenderingOpenGL2  # noqa: F401 Registers the render window implementation
+    from vtkmodules.vtkCommonDataModel import vtkDataObject, vtkImageData
+    from vtkmodules.vtkFiltersCore import vtkThreshold
+    from vtkmodules.vtkRenderingCore import (vtkActor, vtkDataSetMapper, vtkPolyDataMapper, vtkRenderer,
+                                             vtkRenderWindow)
+    from vtk_components.vtk_utilities import numpy_to_polydata, numpy_to_vtk_scalars
+
+    window = vtkRenderWindow()
+    window.SetOffScreenRendering(1)
+    window.SetSize(*size)
+    renderer = vtkRenderer()
+    window.AddRenderer(renderer)
+
+    stl_mapper = vtkPolyDataMapper()
+    stl_mapper.SetInputData(numpy_to_polydata(*surface))
+    stl_actor = vtkActor()
+    stl_actor.SetMapper(stl_mapper)
+    stl_actor.GetProperty().SetOpacity(0.3)
+    renderer.AddActor(stl_actor)
+
+    nx, ny, nz = voxel_mesh.shape
+    grid = vtkImageData()
+    grid.SetDimensions(nx + 1, ny + 1, nz + 1)
+    grid.SetSpacing(*voxel_mesh.spacing)
+    grid.SetOrigin(*voxel_mesh.origin)
+    values = np.full(nx * ny * nz, -1.0, dtype=np.float32)
+    array = numpy_to_vtk_scalars(values, "density")
+    grid.GetCellData().SetScalars(array)
+    view = values.reshape(nz, ny, nx).transpose(2, 1, 0)
+    active = voxel_mesh.occupancy
+    threshold = vtkThreshold()
+    threshold.SetInputData(grid)
+    threshold.SetThresholdFunction(vtkThreshold.THRESHOLD_UPPER)
+    threshold.SetInputArrayToProcess(0, 0, 0, vtkDataObject.FIELD_ASSOCIATION_CELLS, "density")
+    threshold.SetUpperThreshold(0.5)
+    density_mapper = vtkDataSetMapper()
+    density_mapper.SetInputConnection(threshold.GetOutputPort())
+    density_mapper.SetScalarModeToUseCellData()
+    density_mapper.SetScalarRange(0.0, 1.0)
+    density_actor = vtkActor()
+    density_actor.SetMapper(density_mapper)
+    renderer.AddActor(density_actor)
+
+    densities = densities.reshape(voxel_mesh.shape)
+    np.copyto(view, np.where(active, densities, -1.0))
+    start = time.perf_counter()
+    renderer.ResetCamera()
+    window.Render()
+    first_frame = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for frame in range(frames):
+        np.copyto(view, np.where(active, np.roll(densities, frame + 1, axis=0), -1.0))
+        array.Modified()
+        window.Render()
+    update_frame = (time.perf_counter() - start) / frames
+    window.Finalize()
+    return {"first_frame_seconds": first_frame, "update_frame_seconds": update_frame}
+
+
+def run_case(stl_path, resolution, settings, render=True):
+    """ Time every pipeline stage once for one STL and voxel resolution """
+    stages = {}
+    vertices, faces = measure(stages, "load", read_stl, stl_path)
+    voxel_mesh = measure(stages, "mesh", lambda: voxelize(vertices, faces, resolution, lean=settings["lean_memory"]))
+    material = material_from(DEFAULT_MATERIAL)
+    constraints = [{"region": {"face": "x_min"}}]
+    loads = [{"region": {"face": "x_max"}, "magnitude": 100.0, "direction": [0, 0, -1]}]
+
+    # A smooth, deterministic density field near the volume fraction, as mid-optimization
+    cells = np.indices(voxel_mesh.shape).reshape(3, -1).T
+    waves = np.sin(6 * np.pi * (cells + 0.5) / np.array(voxel_mesh.shape)).sum(axis=1)
+    densities = np.where(voxel_mesh.occupancy.ravel(),
+                         settings["volume_fraction"] * (1.0 + waves / 6.0), 0.0).astype(element_dtype(settings))
+    scale, _ = simp_interpolation(densities, settings["penalty"])
+
+    def assemble():
+        solver, forces = build_problem(voxel_mesh, material, constraints, loads, settings)
+        solver.prepare(scale)
+        return solver, forces
+
+    solver, forces = measure(stages, "assemble", assemble)
+    compliance = measure(stages, "solve", solve, solver, forces, scale)
+    stages["solve"]["iterations"] = solver.last_iterations
+    physical = measure(stages, "filter", apply_filter, voxel_mesh, settings, densities)
+    if render:
+        try:
+            frames = measure(stages, "render", render_offscreen, voxel_mesh, (vertices, faces), physical)
+            stages["render"].update(frames)
+        except Exception as e:
+            logging.warning(f"Render benchmark failed: {e}")
+            stages["render"] = {"error": str(e)}
+    return {"elements": int(voxel_mesh.n_elements), "dofs": int(solver.n_dofs), "compliance": float(compliance),
+            "stages": stages}
+
+
+def merge_repeats(runs):
+    """ Fastest time and largest peak memory of each stage over repeated runs """
+    merged = runs[0]
+    for run in runs[1:]:
+        for stage, values in run["stages"].items():
+            best = merged["stages"].get(stage, {})
+            if "error" in values or "error" in best:
+                continue
+            for key, value in values.items():
+                if key.endswith("seconds"):
+                    best[key] = min(best[key], value)
+                elif key.endswith("_mb"):
+                    best[key] = max(best[key], value)
+    return merged
+
+
+def environment():
+    versions = {"python": platform.python_version(), "numpy": np.__version__, "scipy": scipy.__version__}
+    try:
+        from vtkmodules.vtkCommonCore import vtkVersion
+        versions["vtk"] = vtkVersion.GetVTKVersion()
+    except ImportError:
+        pass
+    return {"platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count(), **versions}
+
+
+def run_benchmarks(case_names, resolutions, settings=None, repeat=1, render=True):
+    """
+    Benchmark the load, mesh, assemble, solve, filter and render stages for every
+    case and resolution. "assemble" is the one-off solver setup (boundary conditions,
+    operator and preconditioner or sparse pattern), "solve" the per-iteration cost of
+    an optimization step at a mid-optimization density field. An untimed warm-up run
+    goes first.
+    Returns a JSON-ready dict with the environment and one result per case and resolution.
+    """
+    settings = {**DEFAULT_OPTIMIZATION, **(settings or {})}
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        cases = benchmark_cases(case_names, work_dir)
+        # Library start-up (solver threads, GL context) would otherwise land on the first case
+        run_case(next(iter(cases.values())), min(resolutions), settings, render)
+        for case, path in cases.items():
+            for resolution in resolutions:
+                logging.info(f"Benchmarking {case} at resolution {resolution}")
+                runs = [run_case(path, resolution, settings, render) for _ in range(repeat)]
+                results.append({"case": case, "resolution": resolution, **merge_repeats(runs)})
+    return {"environment": environment(), "settings": settings, "repeat": repeat, "results": results}
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Stage timings and memory peaks that grew by more than tolerance (a fraction) over
+    the matching baseline entry. Returns a list of (case, resolution, stage, metric,
+    baseline value, new value) regressions.
+    """
+    previous = {(entry["case"], entry["resolution"]): entry["stages"] for entry in baseline["results"]}
+    regressions = []
+    for entry in results["results"]:
+        old_stages = previous.get((entry["case"], entry["resolution"]))
+        if old_stages is None:
+            continue
+        for stage, values in entry["stages"].items():
+            old = old_stages.get(stage, {})
+            for metric, floor in (("seconds", MIN_COMPARE_SECONDS), ("peak_delta_mb", MIN_COMPARE_MB)):
+                if metric not in values or metric not in old:
+                    continue
+                if values[metric] > max(old[metric], floor) * (1.0 + tolerance):
+                    regressions.append((entry["case"], entry["resolution"], stage, metric, old[metric], values[metric]))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    previous = {}
+    if baseline is not None:
+        previous = {(entry["case"], entry["resolution"]): entry["stages"] for entry in baseline["results"]}
+    print(f"{'case':<12}{'res':>5}{'elements':>10}  {'stage':<10}{'seconds':>10}{'peak MB':>10}{'vs base':>9}")
+    for entry in results["results"]:
+        old_stages = previous.get((entry["case"], entry["resolution"]), {})
+        for stage in STAGES:
+            values = entry["stages"].get(stage)
+            if values is None:
+                continue
+            if "error" in values:
+                print(f"{entry['case']:<12}{entry['resolution']:>5}{entry['elements']:>10}  {stage:<10}  failed")
+                continue
+            old = old_stages.get(stage, {})
+            ratio = f"{values['seconds'] / old['seconds']:>8.2f}x" if old.get("seconds") else ""
+            print(f"{entry['case']:<12}{entry['resolution']:>5}{entry['elements']:>10}  {stage:<10}"
+                  f"{values['seconds']:>10.3f}{values['peak_delta_mb']:>10.1f}{ratio}")
+
+
+def main(argv=None):
+    """ Benchmark the pipeline stages and optionally compare against a stored baseline """
+    parser = argparse.ArgumentParser(description="Benchmark mesh, FEA, filter and render stages.")
+    parser.add_argument("-c", "--cases", default="box,extruder",
+                        help="Comma-separated cases: box, extruder or STL paths (default: box,extruder)")
+    parser.add_argument("-r", "--resolutions", default="20,40,60", help="Comma-separated voxel resolutions")
+    parser.add_argument("-s", "--solver", default=DEFAULT_OPTIMIZATION["solver"], help="FEA solver method")
+    parser.add_argument("-n", "--repeat", type=int, default=3,
+                        help="Runs per case; the fastest time and largest memory peak are kept (default 3)")
+    parser.add_argument("-o", "--output", help="Write results to this JSON file")
+    parser.add_argument("-b", "--baseline", help="Compare against a JSON file written by an earlier run")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.25,
+                        help="Allowed growth over the baseline before a stage counts as regressed (default 0.25)")
+    parser.add_argument("--no-render", action="store_true", help="Skip the offscreen render stage")
+    parser.add_argument("--lean", action="store_true",
+                        help="Benchmark the lean_memory mode (float32 densities, compact mesh dtypes)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    results = run_benchmarks(args.cases.split(","), [int(r) for r in args.resolutions.split(",")],
+                             {"solver": args.solver, "lean_memory": args.lean}, repeat=args.repeat,
+                             render=not args.no_render)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if baseline is None:
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for case, resolution, stage, metric, old, new in regressions:
+        logging.error(f"Regression in {case} at resolution {resolution}, {stage} {metric}: {old:.4g} -> {new:.4g}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import argparse
+import logging
+import sys
+import tempfile
+import numpy as np
+
+from benchmark import benchmark_cases
+from fea.mesh_generation import symmetric_voxelize
+from optimization.pipeline import DEFAULT_MATERIAL, material_from, optimize, optimize_symmetric
+from utils.file_utils import read_stl
+
+CONSTRAINTS = [{"region": {"face": "x_min"}}]
+# Bending is symmetric about the y mid-plane only, axial tension about both the y and z ones
+LOADS = {
+    "bending": [{"region": {"face": "x_max"}, "magnitude": 100.0, "direction": [0, 0, -1]}],
+    "tension": [{"region": {"face": "x_max"}, "magnitude": 100.0, "direction": [1, 0, 0]}],
+}
+
+
+def compare_runs(name, reference, result, tolerance):
+    """ Log the largest density and relative compliance differences; returns True if both are within tolerance """
+    density_error = float(np.abs(reference["physical_densities"] - result["physical_densities"]).max())
+    compliance_error = abs(result["compliance"] - reference["compliance"]) / abs(reference["compliance"])
+    passed = density_error <= tolerance and compliance_error <= tolerance
+    log = logging.info if passed else logging.error
+    log(f"{name}: compliance {reference['compliance']:.6g} vs {result['compliance']:.6g}, "
+        f"max density difference {density_error:.2e}, relative compliance difference {compliance_error:.2e}")
+    return passed
+
+
+def check_symmetry(surface, voxel_mesh, resolution, settings, tolerance):
+    """ Fundamental-region runs against full runs on the same grid """
+    passed = True
+    material = material_from(DEFAULT_MATERIAL)
+    for name, loads in LOADS.items():
+        full = optimize(voxel_mesh, material, CONSTRAINTS, loads, settings, surface=surface)
+        region = optimize_symmetric(voxel_mesh, surface, resolution, material, CONSTRAINTS, loads, settings)
+        passed &= compare_runs(f"{name}, symmetry {region.get('symmetry', [])}", full, region, tolerance)
+    return passed
+
+
+def check_pruning(surface, voxel_mesh, settings, tolerance):
+    """
+    A run that freezes void elements out of the FE system against one that keeps them. Frozen
+    void no longer adds its e_min stiffness, so the two only agree to about 1e-7. The run is
+    longer and sparser than the symmetry checks, so that void has time to freeze.
+    """
+    material = material_from(DEFAULT_MATERIAL)
+    settings = {**settings, "max_iterations": 2 * settings["max_iterations"], "volume_fraction": 0.2}
+    full = optimize(voxel_mesh, material, CONSTRAINTS, LOADS["bending"], settings, surface=surface)
+    pruned = optimize(voxel_mesh, material, CONSTRAINTS, LOADS["bending"], {**settings, "prune_void": True},
+                      surface=surface)
+    live = min(entry["live_elements"] for entry in pruned["history"])
+    return compare_runs(f"bending, void pruned (down to {live} of {voxel_mesh.n_elements} live elements)",
+                        full, pruned, tolerance)
+
+
+def main(argv=None):
+    """ Check that the exact shortcuts of the optimizer reproduce the plain runs on the box cantilever """
+    parser = argparse.ArgumentParser(description="Compare optimizer shortcuts against plain runs.")
+    parser.add_argument("-r", "--resolution", type=int, default=30, help="Voxel resolution (default 30)")
+    parser.add_argument("-i", "--iterations", type=int, default=20, help="Optimizer iterations (default 20)")
+    parser.add_argument("-t", "--tolerance", type=float, default=1e-6,
+                        help="Allowed density and relative compliance difference (default 1e-6)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        surface = read_stl(benchmark_cases(["box"], work_dir)["box"])
+    voxel_mesh = symmetric_voxelize(*surface, args.resolution)
+    # A fixed iteration count and tight solves, so differences come from the shortcut and not the stopping rule
+    settings = {"max_iterations": args.iterations, "tolerance": 0.0, "rtol": 1e-10}
+    passed = check_symmetry(surface, voxel_mesh, args.resolution, settings, args.tolerance)
+    passed &= check_pruning(surface, voxel_mesh, settings, args.tolerance)
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
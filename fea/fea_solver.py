@@ -0,0 +1,731 @@
+import logging
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+from scipy import ndimage
+
+from utils.profiling import profiler
+
+try:
+    from sksparse.cholmod import cholesky as cholmod_cholesky
+except ImportError:
+    cholmod_cholesky = None
+
+try:
+    import pypardiso
+except ImportError:
+    pypardiso = None
+
+# Natural coordinates of the 8 hexahedron nodes in VTK_HEXAHEDRON order
+HEX8_NODE_SIGNS = np.array([
+    [-1, -1, -1], [1, -1, -1], [1, 1, -1], [-1, 1, -1],
+    [-1, -1, 1], [1, -1, 1], [1, 1, 1], [-1, 1, 1],
+], dtype=float)
+
+
+def elastic_constants(material):
+    """ Return (E, nu) from a MaterialProperties instance """
+    youngs_modulus = material.youngs_modulus
+    poissons_ratio = material.poissons_ratio
+    if youngs_modulus is None or poissons_ratio is None:
+        raise ValueError("Material needs Young's modulus and Poisson's ratio set before analysis")
+    youngs_modulus = float(youngs_modulus)
+    poissons_ratio = float(poissons_ratio)
+    if youngs_modulus <= 0 or not -1.0 < poissons_ratio < 0.5:
+        raise ValueError(f"Invalid elastic constants: E={youngs_modulus}, nu={poissons_ratio}")
+    return youngs_modulus, poissons_ratio
+
+
+def elasticity_matrix(youngs_modulus, poissons_ratio):
+    """ Isotropic 6x6 constitutive matrix in Voigt order (xx, yy, zz, yz, xz, xy) """
+    e, nu = youngs_modulus, poissons_ratio
+    lam = e * nu / ((1 + nu) * (1 - 2 * nu))
+    mu = e / (2 * (1 + nu))
+    d = np.zeros((6, 6))
+    d[:3, :3] = lam
+    d[np.arange(3), np.arange(3)] = lam + 2 * mu
+    d[np.arange(3, 6), np.arange(3, 6)] = mu
+    return d
+
+
+def _strain_displacement(grads):
+    """
+    Build batched B matrices from shape function gradients.
+    Parameters:
+    - grads: (..., 3, n_nodes) derivatives dN/dx, dN/dy, dN/dz.
+    """
+    n_nodes = grads.shape[-1]
+    b = np.zeros(grads.shape[:-2] + (6, 3 * n_nodes))
+    dx, dy, dz = grads[..., 0, :], grads[..., 1, :], grads[..., 2, :]
+    b[..., 0, 0::3] = dx
+    b[..., 1, 1::3] = dy
+    b[..., 2, 2::3] = dz
+    b[..., 3, 1::3] = dz
+    b[..., 3, 2::3] = dy
+    b[..., 4, 0::3] = dz
+    b[..., 4, 2::3] = dx
+    b[..., 5, 0::3] = dy
+    b[..., 5, 1::3] = dx
+    return b
+
+
+def hex8_stiffness(youngs_modulus, poissons_ratio, spacing=(1.0, 1.0, 1.0)):
+    """ 24x24 stiffness matrix of an axis-aligned brick element (2x2x2 Gauss quadrature) """
+    half = 0.5 * np.asarray(spacing, dtype=float)
+    d = elasticity_matrix(youngs_modulus, poissons_ratio)
+    gauss = HEX8_NODE_SIGNS / np.sqrt(3.0)
+    # dN_a/dxi_k = s_ak / 8 * prod_{m != k} (1 + s_am xi_m), evaluated at all 8 points at once
+    factors = 1.0 + gauss[:, None, :] * HEX8_NODE_SIGNS[None, :, :]
+    grads = np.empty((8, 3, 8))
+    for k in range(3):
+        others = [m for m in range(3) if m != k]
+        grads[:, k, :] = HEX8_NODE_SIGNS[:, k] / 8.0 * factors[:, :, others].prod(axis=2) / half[k]
+    b = _strain_displacement(grads)
+    ke = np.einsum('gik,ij,gjl->kl', b, d, b) * np.prod(half)
+    return 0.5 * (ke + ke.T)
+
+
+def tet4_stiffness(nodes, elements, youngs_modulus, poissons_ratio):
+    """ Batched 12x12 stiffness matrices and volumes for linear tetrahedra """
+    coords = nodes[elements]
+    m = np.ones((len(elements), 4, 4))
+    m[:, :, 1:] = coords
+    det = np.linalg.det(m)
+    if np.any(np.abs(det) < 1e-300):
+        raise ValueError("Mesh contains degenerate tetrahedra")
+    grads = np.linalg.inv(m)[:, 1:, :]
+    volumes = np.abs(det) / 6.0
+    b = _strain_displacement(grads)
+    d = elasticity_matrix(youngs_modulus, poissons_ratio)
+    ke = np.einsum('eik,ij,ejl->ekl', b, d, b) * volumes[:, None, None]
+    return ke, volumes
+
+
+def element_dofs(elements):
+    """ Global DOF indices per element, (n_elements, 3 * nodes_per_element) """
+    elements = np.asarray(elements)
+    return (3 * elements[:, :, None] + np.arange(3)).reshape(len(elements), -1)
+
+
+def dofs_for_nodes(node_ids, components=(0, 1, 2)):
+    """ DOF indices for the given nodes and displacement components """
+    node_ids = np.asarray(node_ids).ravel()
+    return (3 * node_ids[:, None] + np.asarray(components)).ravel()
+
+
+class StiffnessPattern:
+    """
+    Precomputed COO -> CSR scatter for a fixed mesh and set of free DOFs.
+    Re-assembling with new element scale factors is then a single bincount.
+    """
+
+    def __init__(self, edofs, free_map, n_free):
+        self.n_free = n_free
+        local = free_map[edofs]
+        n_local = edofs.shape[1]
+        rows = np.repeat(local, n_local, axis=1)
+        cols = np.tile(local, (1, n_local))
+        self.entries = (rows >= 0) & (cols >= 0)
+        rows = rows[self.entries]
+        cols = cols[self.entries]
+        keys = rows.astype(np.int64) * n_free + cols
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        index_dtype = np.int32 if len(unique_keys) < np.iinfo(np.int32).max else np.int64
+        self.inverse = inverse.astype(index_dtype)
+        self.indices = (unique_keys % n_free).astype(index_dtype)
+        row_of_key = unique_keys // n_free
+        self.indptr = np.searchsorted(row_of_key, np.arange(n_free + 1)).astype(index_dtype)
+        self.nnz = len(unique_keys)
+        profiler.gauge("nnz", self.nnz)
+        profiler.gauge("stiffness_pattern_bytes", self.inverse.nbytes + self.indices.nbytes + self.indptr.nbytes)
+
+    @profiler.timed("assemble")
+    def assemble(self, ke, scale=None):
+        """
+        Assemble a CSR matrix from shared (k, k) or per-element (n, k, k) stiffness.
+        """
+        n_elements = self.entries.shape[0]
+        if ke.ndim == 2:
+            if scale is None:
+                scale = np.ones(n_elements)
+            values = scale[:, None] * ke.ravel()[None, :]
+        elif scale is None:
+            values = ke.reshape(n_elements, -1)
+        else:
+            values = scale[:, None] * ke.reshape(n_elements, -1)
+        data = np.bincount(self.inverse, weights=values[self.entries], minlength=self.nnz)
+        return sp.csr_matrix((data, self.indices, self.indptr), shape=(self.n_free, self.n_free))
+
+
+@profiler.timed("assemble")
+def assemble_stiffness(elements, n_nodes, ke, scale=None):
+    """
+    Assemble the full global stiffness matrix in one batched COO -> CSR pass.
+    Parameters:
+    - elements: (n_elements, nodes_per_element) connectivity.
+    - n_nodes: Number of mesh nodes.
+    - ke: Shared (k, k) element matrix or per-element (n_elements, k, k) matrices.
+    - scale: Optional per-element stiffness factors (e.g. SIMP interpolation).
+    """
+    edofs = element_dofs(elements)
+    n_elements, n_local = edofs.shape
+    n_dofs = 3 * n_nodes
+    rows = np.repeat(edofs, n_local, axis=1).ravel()
+    cols = np.tile(edofs, (1, n_local)).ravel()
+    values = np.broadcast_to(ke, (n_elements, n_local, n_local)).reshape(n_elements, -1)
+    if scale is not None:
+        values = values * np.asarray(scale)[:, None]
+    return sp.coo_matrix((values.ravel(), (rows, cols)), shape=(n_dofs, n_dofs)).tocsr()
+
+
+def pcg(matvec, b, precondition=None, x0=None, rtol=1e-8, max_iterations=None):
+    """
+    Preconditioned conjugate gradient.
+    An initial guess x0 is first rescaled to minimize the energy error along it, so
+    a displacement field from a previous, differently stiff design is still a good start.
+    b may hold one load case per column; the cases are solved in turn with the same
+    operator and preconditioner.
+    Returns the solution and the number of iterations used (summed over load cases).
+    """
+    if b.ndim == 2:
+        x = np.empty_like(b)
+        total = 0
+        for case in range(b.shape[1]):
+            guess = None if x0 is None else x0[:, case]
+            x[:, case], iterations = pcg(matvec, b[:, case], precondition, guess, rtol, max_iterations)
+            total += iterations
+        return x, total
+    b_norm = np.linalg.norm(b)
+    if b_norm == 0.0:
+        return np.zeros_like(b), 0
+    if max_iterations is None:
+        max_iterations = max(10 * int(np.sqrt(len(b))), 100)
+
+    if x0 is None:
+        x = np.zeros_like(b)
+        r = b.copy()
+    else:
+        x = np.array(x0, dtype=float)
+        ax = matvec(x)
+        energy = x @ ax
+        if energy > 0.0:
+            scale = (x @ b) / energy
+            x *= scale
+            ax *= scale
+        r = b - ax
+    if np.linalg.norm(r) <= rtol * b_norm:
+        return x, 0
+
+    z = precondition(r) if precondition is not None else r.copy()
+    p = z.copy()
+    rz = r @ z
+    for iteration in range(1, max_iterations + 1):
+        ap = matvec(p)
+        alpha = rz / (p @ ap)
+        x += alpha * p
+        r -= alpha * ap
+        if np.linalg.norm(r) <= rtol * b_norm:
+            return x, iteration
+        z = precondition(r) if precondition is not None else r.copy()
+        rz_new = r @ z
+        p *= rz_new / rz
+        p += z
+        rz = rz_new
+
+    logging.warning(f"PCG did not converge in {max_iterations} iterations "
+                    f"(relative residual {np.linalg.norm(r) / b_norm:.2e})")
+    return x, max_iterations
+
+
+@profiler.timed("factorize")
+def factorize(k):
+    """ Return a callable solving k x = b, using CHOLMOD or PARDISO when available """
+    if cholmod_cholesky is not None:
+        return cholmod_cholesky(k.tocsc())
+    if pypardiso is not None:
+        return pypardiso.factorized(k.tocsr())
+    # Symmetric minimum-degree ordering; SuperLU's default COLAMD fills in badly on 3D meshes
+    lu = spla.splu(k.tocsc(), permc_spec="MMD_AT_PLUS_A", diag_pivot_thresh=0.0,
+                   options={"SymmetricMode": True})
+    return lu.solve
+
+
+class FEASolver:
+    """
+    Linear-elastic finite element solver for tetrahedral (4-node) or voxel
+    (8-node axis-aligned brick) meshes.
+
+    Elements carry an optional stiffness scale factor so the same solver can be
+    reused by density-based topology optimization.
+    """
+
+    METHODS = ("direct", "cg")
+
+    def __init__(self, nodes, elements, material, method="direct", rtol=1e-8, max_iterations=None):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown solver method: {method}")
+        self.nodes = np.asarray(nodes, dtype=float)
+        self.elements = np.asarray(elements)
+        self.method = method
+        self.rtol = rtol
+        self.max_iterations = max_iterations
+        self.youngs_modulus, self.poissons_ratio = elastic_constants(material)
+
+        nodes_per_element = self.elements.shape[1]
+        if nodes_per_element == 4:
+            self.ke, self.volumes = tet4_stiffness(self.nodes, self.elements,
+                                                   self.youngs_modulus, self.poissons_ratio)
+        elif nodes_per_element == 8:
+            first = self.nodes[self.elements[0]]
+            spacing = first.max(axis=0) - first.min(axis=0)
+            self.ke = hex8_stiffness(self.youngs_modulus, self.poissons_ratio, spacing)
+            self.volumes = np.full(len(self.elements), np.prod(spacing))
+        else:
+            raise ValueError(f"Unsupported element with {nodes_per_element} nodes")
+
+        self.edofs = element_dofs(self.elements)
+        self.fixed_dofs = np.empty(0, dtype=np.intp)
+        self.last_iterations = 0
+        self._pattern = None
+        self._free = None
+        logging.debug(f"FEASolver set up with {self.n_elements} elements and {self.n_dofs} DOFs")
+
+    @property
+    def n_nodes(self):
+        return len(self.nodes)
+
+    @property
+    def n_dofs(self):
+        return 3 * len(self.nodes)
+
+    @property
+    def n_elements(self):
+        return len(self.elements)
+
+    def set_fixed_dofs(self, fixed_dofs):
+        self.fixed_dofs = np.unique(np.asarray(fixed_dofs, dtype=np.intp))
+        self._pattern = None
+
+    @profiler.timed("stiffness_pattern")
+    def _build_pattern(self):
+        fixed = np.ones(self.n_dofs, dtype=bool)
+        fixed[self.edofs.ravel()] = False  # DOFs not attached to any element stay fixed
+        fixed[self.fixed_dofs] = True
+        self._free = np.flatnonzero(~fixed)
+        free_map = np.full(self.n_dofs, -1, dtype=np.intp)
+        free_map[self._free] = np.arange(len(self._free))
+        self._pattern = StiffnessPattern(self.edofs, free_map, len(self._free))
+        logging.debug(f"Stiffness pattern built: {len(self._free)} free DOFs, nnz={self._pattern.nnz}")
+
+    def assemble(self, scale=None):
+        """ Assemble the free-DOF stiffness matrix for the given element scale factors """
+        if self._pattern is None:
+            self._build_pattern()
+        return self._pattern.assemble(self.ke, scale)
+
+    @profiler.timed("solve")
+    def solve(self, forces, scale=None, x0=None):
+        """
+        Solve K u = f with the fixed DOFs held at zero.
+        forces is a vector or an (n_dofs, n_cases) matrix with one load case per column;
+        all cases share one assembly and factorization.
+        Returns the full displacement vector (or matrix).
+        """
+        forces = np.asarray(forces, dtype=float)
+        k = self.assemble(scale)
+        f = forces[self._free]
+        u = np.zeros(forces.shape)
+
+        if self.method == "direct":
+            u[self._free] = factorize(k)(f)
+            self.last_iterations = 0
+        else:
+            diagonal = k.diagonal()
+            guess = None if x0 is None else np.asarray(x0)[self._free]
+            u[self._free], self.last_iterations = pcg(
+                k.dot, f, precondition=lambda r: r / diagonal, x0=guess,
+                rtol=self.rtol, max_iterations=self.max_iterations)
+        profiler.gauge("dofs", len(self._free))
+        profiler.count("cg_iterations", self.last_iterations)
+        return u
+
+    def element_energies(self, u):
+        """ Unscaled element strain energies u_e^T ke u_e for every element (one column per load case) """
+        if u.ndim == 2:
+            return np.column_stack([self.element_energies(column) for column in u.T])
+        ue = u[self.edofs]
+        if self.ke.ndim == 2:
+            return np.einsum('ij,ij->i', ue @ self.ke, ue)
+        return np.einsum('ei,eij,ej->e', ue, self.ke, ue)
+
+    def compliance(self, forces, u):
+        """ f . u, per load case for load matrices """
+        if np.ndim(forces) == 2:
+            return np.einsum('ij,ij->j', forces, u)
+        return float(np.dot(forces, u))
+
+
+# Index offsets of the 8 brick nodes relative to the element's lowest corner
+HEX8_NODE_OFFSETS = (HEX8_NODE_SIGNS > 0).astype(int)
+
+
+def structured_hex_elements(shape, element_ids=None, dtype=np.int64):
+    """
+    Connectivity of a (nx, ny, nz) brick grid, of all its elements or only element_ids.
+    Nodes and elements are numbered in C order over (nx + 1, ny + 1, nz + 1) and (nx, ny, nz).
+    """
+    nx, ny, nz = shape
+    if element_ids is None:
+        node_ids = np.arange((nx + 1) * (ny + 1) * (nz + 1), dtype=dtype).reshape(nx + 1, ny + 1, nz + 1)
+        return np.stack([node_ids[i:i + nx, j:j + ny, k:k + nz].ravel()
+                         for i, j, k in HEX8_NODE_OFFSETS], axis=1)
+    i, j, k = np.unravel_index(element_ids, shape)
+    first = ((i * (ny + 1) + j) * (nz + 1) + k).astype(dtype)
+    corners = (HEX8_NODE_OFFSETS @ np.array([(ny + 1) * (nz + 1), nz + 1, 1])).astype(dtype)
+    return first[:, None] + corners
+
+
+def structured_hex_nodes(shape, spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0)):
+    """ Node coordinates of a full brick grid, matching structured_hex_elements numbering """
+    axes = [origin[d] + spacing[d] * np.arange(shape[d] + 1) for d in range(3)]
+    return np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+
+class MatrixFreeStiffness:
+    """
+    Stiffness operator of a regular brick grid that never stores the global matrix.
+
+    Only the 24x24 reference element matrix and one scale factor per element are
+    kept; connectivity is implicit in the grid, so K.u is a gather of the 8 node
+    blocks of each element, one batched product with ke and a scatter back.
+    The grid is processed in x-slabs of about chunk_elements elements to bound
+    temporary memory. Float32 scale factors are kept as float32; products and
+    sums are still formed in float64.
+    Fixed DOFs, and DOFs attached only to zero-stiffness elements, act as identity rows.
+
+    When at most sparse_fraction of the elements carry stiffness (a design space
+    filling little of its bounding grid, or pruned void), only those elements are
+    visited: their DOFs are gathered by index in chunks of chunk_elements, so the
+    cost follows the live elements instead of the grid.
+    """
+
+    def __init__(self, shape, ke, scale=None, fixed=None, chunk_elements=1 << 17, sparse_fraction=0.5):
+        self.shape = tuple(int(n) for n in shape)
+        self.node_shape = tuple(n + 1 for n in self.shape)
+        self.ke = np.asarray(ke, dtype=float)
+        self.n_elements = int(np.prod(self.shape))
+        self.n_dofs = 3 * int(np.prod(self.node_shape))
+        self.chunk_elements = chunk_elements
+        self.slab = max(1, chunk_elements // (self.shape[1] * self.shape[2]))
+        self.sparse_fraction = sparse_fraction
+        _, ny, nz = self.node_shape
+        corner_nodes = HEX8_NODE_OFFSETS @ np.array([ny * nz, nz, 1])
+        self._corner_dofs = (3 * corner_nodes[:, None] + np.arange(3)).ravel()
+        self.element_ids = None
+        self.fixed = np.zeros(self.n_dofs, dtype=bool) if fixed is None else np.asarray(fixed, dtype=bool)
+        self.set_scale(np.ones(self.n_elements) if scale is None else scale)
+        # A gauge per grid: multigrid rebuilds its coarse operators every update
+        profiler.gauge(f"matrix_free_bytes[{'x'.join(str(n) for n in self.shape)}]", self.nbytes)
+
+    @property
+    def nbytes(self):
+        element_bytes = 0 if self.element_ids is None else self.element_ids.nbytes + self._first_dofs.nbytes
+        return (self.ke.nbytes + self.scale.nbytes + self.fixed.nbytes + self.pinned.nbytes + self._diagonal.nbytes
+                + element_bytes)
+
+    def _select_elements(self):
+        """ Switch to element gathers if few elements are live; the index is rebuilt only when that set changes """
+        live = np.flatnonzero(self.scale.ravel() > 0.0)
+        if len(live) > self.sparse_fraction * self.n_elements:
+            self.element_ids = None
+            return
+        if self.element_ids is None or not np.array_equal(live, self.element_ids):
+            index_dtype = np.int32 if self.n_dofs < np.iinfo(np.int32).max else np.int64
+            self.element_ids = live.astype(index_dtype)
+            i, j, k = np.unravel_index(live, self.shape)
+            _, ny, nz = self.node_shape
+            self._first_dofs = (3 * ((i * ny + j) * nz + k)).astype(index_dtype)
+        self._element_scale = self.scale.ravel()[self.element_ids]
+
+    def _element_chunks(self):
+        """ (element slice, (n, 24) element DOFs, first and last DOF + 1) over the live elements """
+        for start in range(0, len(self.element_ids), self.chunk_elements):
+            chunk = slice(start, start + self.chunk_elements)
+            edofs = self._first_dofs[chunk, None] + self._corner_dofs
+            yield chunk, edofs, int(edofs[0, 0]), int(edofs[-1].max()) + 1
+
+    def _scatter(self, result, values):
+        """ Add per-element DOF values (n_live, 24) into result, chunk by chunk """
+        for chunk, edofs, lo, hi in self._element_chunks():
+            result[lo:hi] += np.bincount((edofs - lo).ravel(), values(chunk, edofs).ravel(), minlength=hi - lo)
+        return result
+
+    def _slabs(self):
+        for start in range(0, self.shape[0], self.slab):
+            yield start, min(start + self.slab, self.shape[0])
+
+    def _gather(self, field, start, stop):
+        """ Element DOF values (n_slab_elements, 24) for x-slab [start, stop) """
+        _, ny, nz = self.shape
+        ue = np.empty((stop - start, ny, nz, 8, 3))
+        for a, (i, j, k) in enumerate(HEX8_NODE_OFFSETS):
+            ue[..., a, :] = field[start + i:stop + i, j:j + ny, k:k + nz]
+        return ue.reshape(-1, 24)
+
+    def set_scale(self, scale):
+        """ Set per-element stiffness factors and refresh the diagonal """
+        _, ny, nz = self.shape
+        self.scale = np.asarray(scale, dtype=np.result_type(scale, np.float32)).reshape(self.shape)
+        self._select_elements()
+        if self.element_ids is not None:
+            ke_diagonal = np.diag(self.ke)
+            diagonal = self._scatter(np.zeros(self.n_dofs),
+                                     lambda chunk, edofs: self._element_scale[chunk, None] * ke_diagonal)
+        else:
+            diagonal = np.zeros(self.node_shape + (3,))
+            ke_diagonal = np.diag(self.ke).reshape(8, 3)
+            for a, (i, j, k) in enumerate(HEX8_NODE_OFFSETS):
+                diagonal[i:i + self.shape[0], j:j + ny, k:k + nz] += self.scale[..., None] * ke_diagonal[a]
+            diagonal = diagonal.ravel()
+        self.pinned = self.fixed | (diagonal <= 0.0)
+        diagonal[self.pinned] = 1.0
+        self._diagonal = diagonal
+
+    def set_fixed(self, fixed):
+        self.fixed = np.asarray(fixed, dtype=bool)
+        self.set_scale(self.scale)
+
+    def diagonal(self):
+        return self._diagonal
+
+    def matvec(self, u):
+        _, ny, nz = self.shape
+        if self.element_ids is not None:
+            u_free = np.where(self.pinned, 0.0, u)
+            result = self._scatter(np.zeros(self.n_dofs),
+                                   lambda chunk, edofs: (u_free[edofs] @ self.ke) * self._element_scale[chunk, None])
+            result[self.pinned] = u[self.pinned]
+            return result
+        u_free = np.where(self.pinned, 0.0, u).reshape(self.node_shape + (3,))
+        result = np.zeros(self.node_shape + (3,))
+        for start, stop in self._slabs():
+            fe = self._gather(u_free, start, stop) @ self.ke
+            fe *= self.scale[start:stop].reshape(-1, 1)
+            fe = fe.reshape(stop - start, ny, nz, 8, 3)
+            for a, (i, j, k) in enumerate(HEX8_NODE_OFFSETS):
+                result[start + i:stop + i, j:j + ny, k:k + nz] += fe[..., a, :]
+        result = result.ravel()
+        result[self.pinned] = u[self.pinned]
+        return result
+
+    __matmul__ = matvec
+
+    def element_energies(self, u):
+        """ Unscaled element strain energies u_e^T ke u_e, in element order (zero for elements not visited) """
+        if self.element_ids is not None:
+            energies = np.zeros(self.n_elements)
+            for chunk, edofs, _, _ in self._element_chunks():
+                ue = u[edofs]
+                energies[self.element_ids[chunk]] = np.einsum('ij,ij->i', ue @ self.ke, ue)
+            return energies
+        field = u.reshape(self.node_shape + (3,))
+        energies = np.empty(self.shape)
+        for start, stop in self._slabs():
+            ue = self._gather(field, start, stop)
+            energies[start:stop] = np.einsum('ij,ij->i', ue @ self.ke, ue).reshape(stop - start, *self.shape[1:])
+        return energies.ravel()
+
+
+class VoxelFEASolver:
+    """
+    Linear-elastic solver for a regular brick grid of shape (nx, ny, nz).
+
+    The "matrix_free" method runs Jacobi-preconditioned CG on MatrixFreeStiffness,
+    "multigrid" preconditions the same operator with a geometric multigrid V-cycle
+    (see fea.multigrid), and "direct" and "cg" assemble the active elements through FEASolver.
+    Elements outside the optional active mask carry no stiffness, nor do elements
+    frozen as void by set_frozen(), so the DOFs they alone touch leave the system.
+    chunk_elements sets the slab size of the matrix-free operators (see MatrixFreeStiffness).
+    """
+
+    METHODS = ("matrix_free", "multigrid", "direct", "cg")
+
+    def __init__(self, shape, material, spacing=(1.0, 1.0, 1.0), active=None, method="matrix_free",
+                 rtol=1e-8, max_iterations=None, galerkin=False, chunk_elements=1 << 17):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown solver method: {method}")
+        self.shape = tuple(int(n) for n in shape)
+        self.spacing = tuple(float(h) for h in spacing)
+        self.material = material
+        self.method = method
+        self.rtol = rtol
+        self.max_iterations = max_iterations
+        self.galerkin = galerkin
+        self.chunk_elements = chunk_elements
+        youngs_modulus, poissons_ratio = elastic_constants(material)
+        self.ke = hex8_stiffness(youngs_modulus, poissons_ratio, self.spacing)
+        self.n_elements = int(np.prod(self.shape))
+        self.n_dofs = 3 * int(np.prod([n + 1 for n in self.shape]))
+        self.active = np.ones(self.n_elements, dtype=bool) if active is None else np.asarray(active, dtype=bool).ravel()
+        self.fixed_dofs = np.empty(0, dtype=np.intp)
+        self.frozen = np.zeros(self.n_elements, dtype=bool)
+        self.last_iterations = 0
+        self._operator = None
+        self._assembled = None
+        self._multigrid = None
+
+    def set_fixed_dofs(self, fixed_dofs):
+        self.fixed_dofs = np.unique(np.asarray(fixed_dofs, dtype=np.intp))
+        self._operator = None
+        self._assembled = None
+        self._multigrid = None
+
+    @property
+    def live(self):
+        """ Elements in the system: active and not frozen """
+        return self.active & ~self.frozen
+
+    def _touching(self, dofs):
+        """ Elements with a node among the given DOFs """
+        nodes = np.zeros(int(np.prod([n + 1 for n in self.shape])), dtype=bool)
+        nodes[np.asarray(dofs) // 3] = True
+        nodes = nodes.reshape([n + 1 for n in self.shape])
+        nx, ny, nz = self.shape
+        touching = np.zeros(self.shape, dtype=bool)
+        for i, j, k in HEX8_NODE_OFFSETS:
+            touching |= nodes[i:i + nx, j:j + ny, k:k + nz]
+        return touching.ravel()
+
+    def set_frozen(self, candidates, margin=1, forces=None):
+        """
+        Take void elements out of the system until the next call.
+        Parameters:
+        - candidates: Element mask of void elements that may be frozen, or None to unfreeze all.
+        - margin: Candidates within this many cells of a live element stay live, so the
+          design can still grow there.
+        - forces: Load vector or matrix; elements at loaded nodes are never frozen.
+        Live regions left without a support are frozen as well (they carry no load
+        path); if such a region is loaded, nothing is frozen. Returns the frozen mask.
+        """
+        frozen = np.zeros(self.n_elements, dtype=bool)
+        if candidates is not None and np.any(candidates):
+            cube = np.ones((3, 3, 3), dtype=bool)
+            candidates = np.asarray(candidates, dtype=bool).ravel() & self.active
+            frozen = candidates.copy()
+            if margin > 0:
+                near = ndimage.binary_dilation((self.active & ~candidates).reshape(self.shape), cube, iterations=margin)
+                frozen &= ~near.ravel()
+            loaded = np.zeros(self.n_elements, dtype=bool)
+            if forces is not None:
+                loaded = self._touching(np.flatnonzero(np.any(np.asarray(forces).reshape(self.n_dofs, -1), axis=1)))
+                frozen &= ~loaded
+            labels, count = ndimage.label((self.active & ~frozen).reshape(self.shape), cube)
+            labels = labels.ravel()
+            supported = np.zeros(count + 1, dtype=bool)
+            supported[labels[self._touching(self.fixed_dofs)]] = True
+            supported[0] = True
+            islands = ~supported[labels]
+            if np.any(islands & loaded):
+                logging.debug("Not freezing void: it would cut a loaded region off the supports")
+                frozen[:] = False
+            else:
+                frozen |= islands
+        if not np.array_equal(frozen, self.frozen):
+            self.frozen = frozen
+            self._assembled = None
+            logging.debug(f"{np.count_nonzero(frozen)} void elements frozen, {np.count_nonzero(self.live)} live")
+        return self.frozen
+
+    def _effective_scale(self, scale):
+        if scale is None:
+            scale = np.ones(self.n_elements)
+        scale = np.asarray(scale, dtype=np.result_type(scale, np.float32)).ravel()
+        return np.where(self.live, scale, 0.0)
+
+    def operator(self, scale=None):
+        """ Matrix-free stiffness operator for the given element scale factors """
+        if self._operator is None:
+            fixed = np.zeros(self.n_dofs, dtype=bool)
+            fixed[self.fixed_dofs] = True
+            self._operator = MatrixFreeStiffness(self.shape, self.ke, self._effective_scale(scale), fixed,
+                                                 chunk_elements=self.chunk_elements)
+        else:
+            self._operator.set_scale(self._effective_scale(scale))
+        return self._operator
+
+    def _assembled_solver(self):
+        if self._assembled is None:
+            elements = structured_hex_elements(self.shape, np.flatnonzero(self.live))
+            nodes = structured_hex_nodes(self.shape, self.spacing)
+            self._assembled = FEASolver(nodes, elements, self.material, method=self.method,
+                                        rtol=self.rtol, max_iterations=self.max_iterations)
+            self._assembled.set_fixed_dofs(self.fixed_dofs)
+        return self._assembled
+
+    def preconditioner(self, operator):
+        if self.method != "multigrid":
+            diagonal = operator.diagonal()
+            return lambda r: r / diagonal
+        if self._multigrid is None:
+            from fea.multigrid import MultigridPreconditioner
+            self._multigrid = MultigridPreconditioner(operator, galerkin=self.galerkin)
+        else:
+            self._multigrid.update(operator)
+        return self._multigrid
+
+    def prepare(self, scale=None):
+        """
+        One-off setup that later solves reuse: the matrix-free operator and its
+        preconditioner, or the sparsity pattern and matrix of the assembled methods
+        """
+        if self.method not in ("matrix_free", "multigrid"):
+            live_scale = None if scale is None else np.asarray(scale, dtype=float).ravel()[self.live]
+            self._assembled_solver().assemble(live_scale)
+            return
+        self.preconditioner(self.operator(scale))
+
+    def solve(self, forces, scale=None, x0=None):
+        """
+        Solve K u = f with the fixed DOFs held at zero; returns the full displacement vector.
+        Load cases in the columns of an (n_dofs, n_cases) forces matrix share the operator
+        and the preconditioner (or factorization) setup.
+        """
+        forces = np.asarray(forces, dtype=float)
+        if self.method not in ("matrix_free", "multigrid"):
+            solver = self._assembled_solver()
+            live_scale = None if scale is None else np.asarray(scale, dtype=float).ravel()[self.live]
+            u = solver.solve(forces, live_scale, x0)
+            self.last_iterations = solver.last_iterations
+            return u
+
+        with profiler.span("solve") as span:
+            operator = self.operator(scale)
+            f = forces.copy()
+            f[operator.pinned] = 0.0
+            if x0 is not None:
+                # Void DOFs frozen since the last solve would otherwise start far from their zero solution
+                x0 = np.array(x0, dtype=float)
+                x0[operator.pinned] = 0.0
+            u, self.last_iterations = pcg(operator.matvec, f, precondition=self.preconditioner(operator),
+                                          x0=x0, rtol=self.rtol, max_iterations=self.max_iterations)
+            span["iterations"] = self.last_iterations
+        profiler.gauge("dofs", self.n_dofs - np.count_nonzero(self._operator.pinned))
+        profiler.count("cg_iterations", self.last_iterations)
+        return u
+
+    def element_energies(self, u):
+        """ Unscaled element strain energies u_e^T ke u_e, zero outside the active mask """
+        if u.ndim == 2:
+            return np.column_stack([self.element_energies(column) for column in u.T])
+        if self.method not in ("matrix_free", "multigrid"):
+            energies = np.zeros(self.n_elements)
+            energies[self.live] = self._assembled_solver().element_energies(u)
+            return energies
+        operator = self._operator if self._operator is not None else self.operator()
+        return np.where(self.live, operator.element_energies(u), 0.0)
+
+    def compliance(self, forces, u):
+        """ f . u, per load case for load matrices """
+        if np.ndim(forces) == 2:
+            return np.einsum('ij,ij->j', forces, u)
+        return float(np.dot(forces, u))
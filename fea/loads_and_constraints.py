@@ -0,0 +1,291 @@
+import logging
+import weakref
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+from trimesh.triangles import closest_point
+
+from fea.fea_solver import dofs_for_nodes
+
+FACES = {"x_min": (0, np.min), "x_max": (0, np.max), "y_min": (1, np.min),
+         "y_max": (1, np.max), "z_min": (2, np.min), "z_max": (2, np.max)}
+
+
+def select_face(nodes, face, tolerance=1e-6):
+    """ Indices of the nodes on a bounding-box face ("x_min", ..., "z_max"), within tolerance * box size """
+    if face not in FACES:
+        raise ValueError(f"Unknown face: {face}")
+    if len(nodes) == 0:
+        return np.empty(0, dtype=np.intp)
+    index = node_index(nodes)
+    axis, extreme = FACES[face]
+    level = index.tree.mins[axis] if extreme is np.min else index.tree.maxes[axis]
+    band = tolerance * max(float((index.tree.maxes - index.tree.mins).max()), 1.0)
+    return index.slab(axis, level - band, level + band)
+
+
+def select_box(nodes, lower, upper):
+    """ Indices of the nodes inside the axis-aligned box [lower, upper] """
+    return node_index(nodes).box(lower, upper)
+
+
+class NodeIndex:
+    """
+    KD-tree over node coordinates for region queries that return sorted node index arrays.
+    The tree keeps its own copy of the coordinates.
+    """
+
+    def __init__(self, nodes, leafsize=32):
+        # Unbalanced, non-compact trees build several times faster and query about as fast
+        self.tree = cKDTree(np.asarray(nodes, dtype=float), leafsize=leafsize, balanced_tree=False,
+                            compact_nodes=False, copy_data=True)
+        self.nodes = self.tree.data
+        self._spacing = None
+        self._axis_orders = {}
+
+    @property
+    def spacing(self):
+        """ Typical distance between neighbouring nodes, estimated from a sample """
+        if self._spacing is None:
+            sample = self.nodes[::max(1, len(self.nodes) // 1000)]
+            distances, _ = self.tree.query(sample, k=2)
+            self._spacing = float(np.median(distances[:, 1])) if len(self.nodes) > 1 else 1.0
+        return self._spacing
+
+    def _ball(self, center, radius, p=2.0):
+        found = self.tree.query_ball_point(np.asarray(center, dtype=float), radius, p=p, return_sorted=False)
+        return np.sort(np.asarray(found, dtype=np.intp))
+
+    def box(self, lower, upper):
+        """ Nodes inside the axis-aligned box [lower, upper] """
+        lower, upper = np.asarray(lower, dtype=float), np.asarray(upper, dtype=float)
+        candidates = self._ball((lower + upper) / 2, float((upper - lower).max()) / 2, p=np.inf)
+        points = self.nodes[candidates]
+        return candidates[np.all((points >= lower) & (points <= upper), axis=1)]
+
+    def slab(self, axis, lower, upper):
+        """ Nodes with lower <= coordinate <= upper along axis; sorts that axis once """
+        if axis not in self._axis_orders:
+            order = np.argsort(self.nodes[:, axis], kind="stable")
+            self._axis_orders[axis] = (order, self.nodes[order, axis])
+        order, sorted_coordinates = self._axis_orders[axis]
+        start = np.searchsorted(sorted_coordinates, lower, side="left")
+        stop = np.searchsorted(sorted_coordinates, upper, side="right")
+        return np.sort(order[start:stop])
+
+    def sphere(self, center, radius):
+        """ Nodes within radius of center (e.g. around a bolt hole) """
+        return self._ball(center, radius)
+
+    def plane(self, point, normal, tolerance=None, radius=None):
+        """
+        Nodes within tolerance (default half the node spacing) of the plane through point
+        with the given normal, optionally only those within radius of point.
+        """
+        point, normal = np.asarray(point, dtype=float), np.asarray(normal, dtype=float)
+        norm = np.linalg.norm(normal)
+        if norm == 0.0:
+            raise ValueError("Plane normal must be non-zero")
+        normal = normal / norm
+        tolerance = 0.5 * self.spacing if tolerance is None else tolerance
+        offset = point @ normal
+        if radius is not None:
+            candidates = self._ball(point, float(np.hypot(radius, tolerance)))
+            return candidates[np.abs(self.nodes[candidates] @ normal - offset) <= tolerance]
+        axis = int(np.argmax(np.abs(normal)))
+        if abs(normal[axis]) == 1.0:
+            return self.slab(axis, point[axis] - tolerance, point[axis] + tolerance)
+        return np.flatnonzero(np.abs(self.nodes @ normal - offset) <= tolerance)
+
+    def near_triangles(self, triangles, tolerance=None):
+        """ Nodes within tolerance (default the node spacing) of any of the (n, 3, 3) triangles """
+        triangles = np.asarray(triangles, dtype=float).reshape(-1, 3, 3)
+        tolerance = self.spacing if tolerance is None else tolerance
+        if len(triangles) == 0:
+            return np.empty(0, dtype=np.intp)
+        # KD-tree candidates within each triangle's bounding sphere, then exact point-triangle distances
+        centroids = triangles.mean(axis=1)
+        radii = np.linalg.norm(triangles - centroids[:, None], axis=2).max(axis=1) + tolerance
+        found = self.tree.query_ball_point(centroids, radii, return_sorted=False)
+        counts = np.fromiter((len(f) for f in found), dtype=np.intp, count=len(found))
+        if counts.sum() == 0:
+            return np.empty(0, dtype=np.intp)
+        candidates = np.concatenate([np.asarray(f, dtype=np.intp) for f in found if f])
+        owners = np.repeat(np.arange(len(triangles)), counts)
+        closest = closest_point(triangles[owners], self.nodes[candidates])
+        near = np.linalg.norm(closest - self.nodes[candidates], axis=1) <= tolerance
+        return np.unique(candidates[near])
+
+
+class SurfaceIndex:
+    """
+    Triangle normals and edge adjacency of a surface, for growing a picked triangle
+    into the smooth face region around it (a flat mounting face, a bolt-hole bore).
+    """
+
+    def __init__(self, vertices, faces):
+        self.vertices = np.asarray(vertices, dtype=float)
+        self.faces = np.asarray(faces, dtype=np.intp)
+        a, b, c = (self.vertices[self.faces[:, i]] for i in range(3))
+        normals = np.cross(b - a, c - a)
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        self.normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+        # Faces sharing an edge are adjacent in sorted edge-key order
+        edges = np.sort(self.faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+        keys = edges[:, 0] * len(self.vertices) + edges[:, 1]
+        order = np.argsort(keys, kind="stable")
+        shared = keys[order[1:]] == keys[order[:-1]]
+        self.pairs = np.stack([order[:-1][shared] // 3, order[1:][shared] // 3], axis=1)
+        self.cosines = np.einsum('ij,ij->i', self.normals[self.pairs[:, 0]], self.normals[self.pairs[:, 1]])
+
+    def face_region(self, face, angle=20.0):
+        """ Triangles connected to face across edges whose dihedral angle is below angle degrees """
+        smooth = self.cosines >= np.cos(np.radians(angle))
+        pairs = self.pairs[smooth]
+        n = len(self.faces)
+        graph = sp.coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+        _, labels = connected_components(graph, directed=False)
+        return np.flatnonzero(labels == labels[face])
+
+    def triangles(self, face_ids):
+        return self.vertices[self.faces[face_ids]]
+
+
+# Indexes are built once per mesh. They are keyed by the identity of the node / face
+# array and dropped with it, so those arrays must not be modified in place.
+_indexes = {}
+
+
+def _cached(kind, array, build):
+    key = (kind, id(array))
+    index = _indexes.get(key)
+    if index is None:
+        index = build()
+        _indexes[key] = index
+        weakref.finalize(array, _indexes.pop, key, None)
+    return index
+
+
+def node_index(nodes):
+    """ NodeIndex of a node array, cached while the array is alive """
+    return _cached("nodes", nodes, lambda: NodeIndex(nodes))
+
+
+def surface_index(vertices, faces):
+    """ SurfaceIndex of a triangle surface, cached while its face array is alive """
+    return _cached("surface", faces, lambda: SurfaceIndex(vertices, faces))
+
+
+def select_nodes(nodes, region, surface=None):
+    """
+    Indices of the nodes in a region description.
+    Parameters:
+    - nodes: (n, 3) node coordinates.
+    - region: One of
+      {"face": "x_min"} (bounding box face),
+      {"box": [[x0, y0, z0], [x1, y1, z1]]},
+      {"sphere": [[x, y, z], radius]},
+      {"plane": {"point": [...], "normal": [...], "tolerance": t, "radius": r}},
+      {"surface_face": {"face": triangle id, "angle": 20, "tolerance": t}}, the smooth
+      region of the surface around a (picked) triangle.
+      Tolerances default to a fraction of the node spacing.
+    - surface: (vertices, faces) of the design surface, for "surface_face" regions.
+    """
+    if "face" in region:
+        selected = select_face(nodes, region["face"], region.get("tolerance", 1e-6))
+    elif "box" in region:
+        selected = node_index(nodes).box(*region["box"])
+    elif "sphere" in region:
+        selected = node_index(nodes).sphere(*region["sphere"])
+    elif "plane" in region:
+        plane = region["plane"]
+        selected = node_index(nodes).plane(plane["point"], plane["normal"], plane.get("tolerance"),
+                                           plane.get("radius"))
+    elif "surface_face" in region:
+        if surface is None:
+            raise ValueError("surface_face regions need the design surface")
+        picked = region["surface_face"]
+        index = surface_index(*surface)
+        faces = index.face_region(picked["face"], picked.get("angle", 20.0))
+        selected = node_index(nodes).near_triangles(index.triangles(faces), picked.get("tolerance"))
+        logging.debug(f"Surface region around triangle {picked['face']}: {len(faces)} triangles, "
+                      f"{len(selected)} nodes")
+    else:
+        raise ValueError(f"Unknown region: {region}")
+    if len(selected) == 0:
+        raise ValueError(f"Region selects no nodes: {region}")
+    return selected
+
+
+def force_vector(n_dofs, node_ids, magnitude, direction):
+    """ Global force vector with a total force of magnitude along direction spread evenly over the nodes """
+    direction = np.asarray(direction, dtype=float)
+    norm = np.linalg.norm(direction)
+    if norm == 0.0:
+        raise ValueError("Force direction must be non-zero")
+    forces = np.zeros(n_dofs)
+    forces[dofs_for_nodes(node_ids)] = np.tile(magnitude * direction / (norm * len(node_ids)), len(node_ids))
+    return forces
+
+
+def symmetry_constraints(point, axes, tolerance=None):
+    """
+    Constraints of mirror planes through point normal to each of axes. Nodes on a plane
+    keep their in-plane displacements and lose the one along its normal, as the two
+    mirrored halves of a symmetric part would.
+    """
+    constraints = []
+    for axis in axes:
+        normal = [0.0, 0.0, 0.0]
+        normal[axis] = 1.0
+        constraints.append({"region": {"plane": {"point": [float(x) for x in point], "normal": normal,
+                                                 "tolerance": tolerance}},
+                            "components": [axis]})
+    return constraints
+
+
+def _mirror_dof_field(field, node_shape, axis, vector=True):
+    """
+    A DOF field (n_dofs, ...) of a node grid mirrored across its mid-plane normal to axis;
+    for vector fields the component along axis changes sign.
+    """
+    grid = field.reshape(tuple(node_shape) + (3,) + field.shape[1:])
+    mirrored = np.flip(grid, axis).copy()
+    if vector:
+        mirrored[:, :, :, axis] *= -1
+    return mirrored.reshape(field.shape)
+
+
+def is_symmetric(fixed_dofs, forces, node_shape, axis, rtol=1e-6):
+    """
+    Whether the fixed DOFs and forces of a node grid are mirror images of themselves across
+    the grid's mid-plane normal to axis (force components along axis change sign).
+    """
+    n_dofs = 3 * int(np.prod(node_shape))
+    fixed = np.zeros(n_dofs, dtype=bool)
+    fixed[fixed_dofs] = True
+    if not np.array_equal(fixed, _mirror_dof_field(fixed, node_shape, axis, vector=False)):
+        return False
+    forces = np.asarray(forces, dtype=float)
+    tolerance = rtol * max(float(np.abs(forces).max(initial=0.0)), np.finfo(float).tiny)
+    return bool(np.all(np.abs(forces - _mirror_dof_field(forces, node_shape, axis)) <= tolerance))
+
+
+def fundamental_dofs(node_shape, axes):
+    """
+    DOFs of a node grid symmetric about its mid-planes normal to axes that lie in the
+    fundamental region (on or above every plane), in the C order of that region's own
+    node grid, and the share of their load the region carries: half per plane a node lies on.
+    """
+    nodes = np.arange(int(np.prod(node_shape))).reshape(node_shape)
+    share = np.ones(node_shape)
+    for axis in axes:
+        middle = (node_shape[axis] - 1) // 2
+        nodes = np.take(nodes, np.arange(middle, node_shape[axis]), axis=axis)
+        share = np.take(share, np.arange(middle, node_shape[axis]), axis=axis)
+        plane = [slice(None)] * 3
+        plane[axis] = 0
+        share[tuple(plane)] *= 0.5
+    return dofs_for_nodes(nodes.ravel()), np.repeat(share.ravel(), 3)
@@ -1,11 +1,33 @@
+import logging
+import numpy as np
+import scipy.sparse as sp
 import trimesh
+from scipy import ndimage
+from scipy.spatial import Delaunay, QhullError, cKDTree
+
+from fea.fea_solver import structured_hex_elements
+from utils.file_utils import read_stl, weld_vertices
+from utils.profiling import profiler
+
+# Fitted to tetrahedralize() output on a sphere, cube, bar, cylinder, annulus and the extruder body at resolutions
+# 3 to 48; the lattice has 2 nodes per h ** 3, and boundary elements are cut short by the surface. The fit holds
+# (elements within about 15%, nodes within about 20%) only where the part's mean thickness 2 * volume / area is at
+# least TET_MIN_THICKNESS edge lengths and its volume at least TET_MIN_VOLUME cubed ones: coarser meshes lose thin
+# regions to the carving and are too small to follow the fit, so estimate_tetrahedra() refuses them
+TET_NODES_PER_VOLUME = 1.92
+TET_NODES_PER_AREA = 0.13
+TET_ELEMENTS_PER_VOLUME = 11.35
+TET_ELEMENTS_PER_AREA = -2.53
+TET_MIN_THICKNESS = 0.8
+TET_MIN_VOLUME = 100.0
+# tetrahedralize() warns when the meshed volume differs from the enclosed one by more than this fraction
+TET_VOLUME_TOLERANCE = 0.1
 
 def load_stl(file_path):
-    """ Load an STL file using Trimesh """
+    """ Load an STL file as a Trimesh sharing the vertex and face arrays from utils.file_utils.read_stl """
     try:
-        # Trimesh can handle loading STL files directly
-        mesh = trimesh.load(file_path, force='mesh')
-        return mesh
+        vertices, faces = read_stl(file_path)
+        return trimesh.Trimesh(vertices, faces, process=False)
     except Exception as e:
         print(f"Error loading STL file: {str(e)}")
         return None
@@ -22,17 +44,177 @@ def generate_mesh(mesh, detail_level=1.0):
         return None
 
     try:
-        # Simplify the mesh based on detail level
-        # Adjust the simplification algorithm as needed
-        # Example: using the quadratic decimation to simplify the mesh
+        # Simplify the mesh based on detail level with quadric edge-collapse decimation
         target_number_of_faces = int(len(mesh.faces) * detail_level)
-        simplified_mesh = mesh.simplify_quadratic_decimation(target_number_of_faces)
-        
+        if target_number_of_faces >= len(mesh.faces):
+            return mesh
+        vertices, faces = decimate_surface(mesh.vertices, mesh.faces, target_number_of_faces)
+        simplified_mesh = trimesh.Trimesh(vertices, faces, process=False)
+
         return simplified_mesh
     except Exception as e:
         print(f"Failed to generate mesh: {str(e)}")
         return None
 
+def _decimate_slabs(vertices, faces, target_faces, slab_faces):
+    """
+    Reduce a large surface in x-slabs of about slab_faces triangles, keeping the slab
+    boundaries intact (vtkDecimatePro never deletes boundary vertices) so the pieces
+    weld back together exactly. Bounds decimation memory by the slab size.
+    """
+    from vtkmodules.vtkFiltersCore import vtkDecimatePro
+    from vtk_components.vtk_utilities import numpy_to_polydata, polydata_to_numpy
+
+    centers = vertices[faces].mean(axis=1)[:, 0]
+    n_slabs = int(np.ceil(len(faces) / slab_faces))
+    bounds = np.quantile(centers, np.linspace(0.0, 1.0, n_slabs + 1)[1:-1])
+    slab_ids = np.searchsorted(bounds, centers)
+    pieces_vertices, pieces_faces, n_vertices = [], [], 0
+    for slab in range(n_slabs):
+        slab_faces_ids = faces[slab_ids == slab]
+        used, local = np.unique(slab_faces_ids, return_inverse=True)
+        decimate = vtkDecimatePro()
+        decimate.SetInputData(numpy_to_polydata(vertices[used], local.reshape(-1, 3)))
+        decimate.SetTargetReduction(1.0 - target_faces / len(faces))
+        decimate.PreserveTopologyOff()
+        decimate.SplittingOff()
+        decimate.BoundaryVertexDeletionOff()
+        decimate.Update()
+        piece_vertices, piece_faces = polydata_to_numpy(decimate.GetOutput())
+        pieces_vertices.append(piece_vertices)
+        pieces_faces.append(piece_faces + n_vertices)
+        n_vertices += len(piece_vertices)
+    vertices, inverse = weld_vertices(np.concatenate(pieces_vertices))
+    return vertices, inverse[np.concatenate(pieces_faces)]
+
+
+@profiler.timed("decimate_surface")
+def decimate_surface(vertices, faces, target_faces, slab_faces=1 << 20):
+    """
+    Quadric edge-collapse decimation of a triangle surface to about target_faces triangles.
+    Uses VTK's vtkQuadricDecimation (trimesh's own needs the optional fast_simplification).
+    Surfaces above slab_faces triangles are first reduced slab by slab (see _decimate_slabs),
+    as global quadric decimation needs about 1 kB per triangle.
+    Returns (vertices, faces).
+    """
+    from vtkmodules.vtkFiltersCore import vtkQuadricDecimation
+    from vtk_components.vtk_utilities import numpy_to_polydata, polydata_to_numpy
+
+    vertices, faces = np.asarray(vertices, dtype=float), np.asarray(faces)
+    n_faces = len(faces)
+    if n_faces > slab_faces:
+        vertices, faces = _decimate_slabs(vertices, faces, target_faces, slab_faces)
+        logging.debug(f"Slab-wise decimation: {n_faces} -> {len(faces)} triangles")
+    if len(faces) > target_faces:
+        decimate = vtkQuadricDecimation()
+        decimate.SetInputData(numpy_to_polydata(vertices, faces))
+        decimate.SetTargetReduction(1.0 - target_faces / len(faces))
+        decimate.VolumePreservationOn()
+        decimate.Update()
+        vertices, faces = polydata_to_numpy(decimate.GetOutput())
+    logging.debug(f"Decimated surface from {n_faces} to {len(faces)} triangles")
+    return vertices, faces
+
+
+@profiler.timed("extract_surface")
+def extract_surface(values, origin, spacing, level=0.5, slab_cells=64):
+    """
+    Closed iso-surface of a cell-centred field (e.g. physical densities on a voxel grid)
+    by marching cubes (VTK flying edges).
+    Parameters:
+    - values: Field of shape (nx, ny, nz) sampled at the cell centers.
+    - origin, spacing: Grid placement.
+    - level: Iso-value.
+    - slab_cells: Cells per x-slab. Slabs are padded and contoured one at a time, so
+      temporary memory scales with the slab rather than the grid. Neighbouring slabs
+      share a plane of samples, and their seam vertices are welded.
+    Returns (vertices, faces) with outward-facing triangles.
+    """
+    from vtkmodules.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+    from vtkmodules.vtkCommonDataModel import vtkImageData
+    from vtkmodules.vtkFiltersCore import vtkFlyingEdges3D
+
+    values = np.asarray(values)
+    nx, ny, nz = values.shape
+    padded_nx = nx + 2  # A void layer on every side closes the surface at the grid boundary
+    all_vertices, all_faces, n_vertices = [], [], 0
+    for start in range(0, padded_nx - 1, slab_cells):
+        stop = min(start + slab_cells, padded_nx - 1)  # Sample planes start..stop inclusive
+        slab = np.zeros((stop - start + 1, ny + 2, nz + 2), dtype=np.float32)
+        lo, hi = max(start, 1), min(stop, nx)
+        if lo <= hi:
+            slab[lo - start:hi - start + 1, 1:-1, 1:-1] = values[lo - 1:hi]
+
+        # The C-ordered slab is an x-fastest VTK image with the axes reversed; unit spacing
+        # keeps seam coordinates exact so the two copies of a seam vertex weld
+        image = vtkImageData()
+        image.SetDimensions(nz + 2, ny + 2, stop - start + 1)
+        image.GetPointData().SetScalars(numpy_to_vtk(slab.ravel()))
+        contour = vtkFlyingEdges3D()
+        contour.SetInputData(image)
+        contour.SetValue(0, level)
+        contour.ComputeNormalsOff()
+        contour.ComputeGradientsOff()
+        contour.ComputeScalarsOff()
+        contour.Update()
+        output = contour.GetOutput()
+        if output.GetNumberOfPoints() == 0:
+            continue
+        points = vtk_to_numpy(output.GetPoints().GetData())[:, ::-1].astype(float)
+        points[:, 0] += start
+        # Reversing the axes mirrors the surface, so the winding is flipped back
+        faces = vtk_to_numpy(output.GetPolys().GetConnectivityArray()).reshape(-1, 3)[:, ::-1]
+        all_vertices.append(points)
+        all_faces.append(faces + n_vertices)
+        n_vertices += len(points)
+
+    if not all_vertices:
+        return np.empty((0, 3)), np.empty((0, 3), dtype=np.int64)
+    vertices, inverse = weld_vertices(np.concatenate(all_vertices))
+    faces = inverse[np.concatenate(all_faces)]
+    vertices = np.asarray(origin, dtype=float) + (vertices - 0.5) * np.asarray(spacing, dtype=float)
+    logging.debug(f"Extracted iso-surface at {level}: {len(vertices)} vertices, {len(faces)} triangles")
+    return vertices, faces
+
+
+@profiler.timed("smooth_surface")
+def smooth_surface(vertices, faces, iterations=10, lam=0.5, mu=-0.53):
+    """
+    Taubin lambda/mu smoothing: alternating shrinking and inflating umbrella steps remove
+    the voxel staircase without the shrinkage of plain Laplacian smoothing.
+    Each step is one sparse matrix product over all vertices.
+    """
+    n = len(vertices)
+    edges = np.asarray(faces)[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+    adjacency = sp.coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n, n)).tocsr()
+    adjacency = ((adjacency + adjacency.T) > 0).astype(float)
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    neighbour_mean = sp.diags(1.0 / np.maximum(degree, 1.0)) @ adjacency
+    vertices = np.array(vertices, dtype=float)
+    for _ in range(iterations):
+        vertices += lam * (neighbour_mean @ vertices - vertices)
+        vertices += mu * (neighbour_mean @ vertices - vertices)
+    return vertices
+
+
+def density_surface(densities, voxel_mesh, level=0.5, smoothing_iterations=10, max_faces=200000, slab_cells=64):
+    """
+    Printable surface of an optimized design: marching cubes on the density field,
+    Taubin smoothing, then decimate_surface() down to max_faces triangles.
+    Parameters:
+    - densities: Physical (filtered) densities over all cells of the voxel grid.
+    - voxel_mesh: The VoxelMesh (or anything with shape, origin and spacing) they live on.
+    Returns a trimesh.Trimesh.
+    """
+    values = np.asarray(densities).reshape(voxel_mesh.shape)
+    vertices, faces = extract_surface(values, voxel_mesh.origin, voxel_mesh.spacing, level, slab_cells)
+    if smoothing_iterations:
+        vertices = smooth_surface(vertices, faces, smoothing_iterations)
+    if max_faces and len(faces) > max_faces:
+        vertices, faces = decimate_surface(vertices, faces, max_faces)
+    return trimesh.Trimesh(vertices, faces, process=False)
+
+
 def export_mesh(mesh, output_file_path):
     """ Export the generated mesh to a file """
     try:
@@ -41,3 +223,760 @@ def export_mesh(mesh, output_file_path):
         print(f"Mesh successfully exported to {output_file_path}")
     except Exception as e:
         print(f"Error exporting mesh: {str(e)}")
+
+class VoxelMesh:
+    """
+    Hexahedral mesh of the occupied cells of a regular voxel grid.
+
+    Grid cells and grid nodes are numbered in C order over shape and shape + 1
+    (the numbering used by fea.fea_solver.VoxelFEASolver). The compact mesh only
+    keeps occupied elements and the nodes they use.
+
+    With lean, the numbering and connectivity are stored as int32 (when the grid
+    nodes fit) and the node coordinates as float32, about half the memory.
+    """
+
+    def __init__(self, occupancy, origin, spacing, lean=False):
+        self.occupancy = np.asarray(occupancy, dtype=bool)
+        self.shape = self.occupancy.shape
+        self.origin = np.asarray(origin, dtype=float)
+        self.spacing = np.asarray(spacing, dtype=float)
+
+        node_shape = tuple(n + 1 for n in self.shape)
+        n_grid_nodes = int(np.prod(node_shape))
+        index_dtype = np.int32 if lean and n_grid_nodes < np.iinfo(np.int32).max else np.int64
+        self.element_ids = np.flatnonzero(self.occupancy.ravel()).astype(index_dtype)
+        grid_elements = structured_hex_elements(self.shape, self.element_ids, dtype=index_dtype)
+        used = np.zeros(n_grid_nodes, dtype=bool)
+        used[grid_elements.ravel()] = True
+        self.grid_node_ids = np.flatnonzero(used).astype(index_dtype)
+        self.node_ids = np.full(len(used), -1, dtype=index_dtype)
+        self.node_ids[self.grid_node_ids] = np.arange(len(self.grid_node_ids), dtype=index_dtype)
+        self.elements = self.node_ids[grid_elements]
+        index = np.stack(np.unravel_index(self.grid_node_ids, node_shape), axis=1)
+        self.nodes = (self.origin + index * self.spacing).astype(np.float32 if lean else float)
+
+    ARRAYS = ("occupancy", "origin", "spacing", "element_ids", "grid_node_ids", "node_ids", "elements", "nodes")
+
+    def to_arrays(self):
+        """ The grid and its numbering as a dict of arrays (e.g. for utils.file_utils.MeshCache) """
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """ Rebuild from to_arrays() output without renumbering """
+        mesh = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(mesh, name, arrays[name])
+        mesh.shape = mesh.occupancy.shape
+        return mesh
+
+    @property
+    def n_elements(self):
+        return len(self.element_ids)
+
+    @property
+    def n_nodes(self):
+        return len(self.grid_node_ids)
+
+    def element_centroids(self):
+        index = np.stack(np.unravel_index(self.element_ids, self.shape), axis=1)
+        return self.origin + (index + 0.5) * self.spacing
+
+
+def resample_cells(values, source, target):
+    """
+    Trilinearly interpolate a per-cell field between voxel grids (e.g. coarse -> fine densities).
+    Parameters:
+    - values: Field over all cells of the source grid, in its C order.
+    - source, target: VoxelMesh-like objects with shape, origin, spacing and occupancy.
+    Empty source cells take the value of the nearest occupied cell first, so target cells
+    along the surface are not diluted by the empty space. The result is zero outside the
+    target occupancy.
+    """
+    field = np.asarray(values, dtype=float).reshape(source.shape)
+    occupancy = np.asarray(source.occupancy, dtype=bool)
+    if occupancy.any() and not occupancy.all():
+        nearest = ndimage.distance_transform_edt(~occupancy, return_distances=False, return_indices=True)
+        field = field[tuple(nearest)]
+    centers = [target.origin[axis] + (np.arange(n) + 0.5) * target.spacing[axis]
+               for axis, n in enumerate(target.shape)]
+    grid = np.meshgrid(*centers, indexing="ij")
+    coordinates = [(grid[axis] - source.origin[axis]) / source.spacing[axis] - 0.5 for axis in range(3)]
+    resampled = ndimage.map_coordinates(field, coordinates, order=1, mode="nearest")
+    return np.where(np.asarray(target.occupancy, dtype=bool), resampled, 0.0).ravel()
+
+
+def resample_nodes(values, source, target):
+    """
+    Trilinearly interpolate a per-node field between voxel grids (e.g. coarse -> fine displacements).
+    Parameters:
+    - values: Field over all grid nodes of the source, first axis in node C order; any trailing
+      axes (components, load cases) are interpolated independently. A DOF vector with
+      DOF = 3 * node + component reshapes to (n_nodes, 3).
+    - source, target: VoxelMesh-like objects with shape, origin, spacing and occupancy.
+    Nodes outside the source solid take the value of the nearest solid node first; the result
+    is zero at target nodes that touch no occupied cell. Returns (n_target_nodes, ...).
+    """
+    source_nodes = tuple(n + 1 for n in source.shape)
+    field = np.asarray(values, dtype=float).reshape(source_nodes + (-1,))
+    solid = _solid_nodes(source.occupancy)
+    if solid.any() and not solid.all():
+        nearest = ndimage.distance_transform_edt(~solid, return_distances=False, return_indices=True)
+        field = field[tuple(nearest)]
+    positions = [target.origin[axis] + np.arange(n + 1) * target.spacing[axis] for axis, n in enumerate(target.shape)]
+    grid = np.meshgrid(*positions, indexing="ij")
+    coordinates = [(grid[axis] - source.origin[axis]) / source.spacing[axis] for axis in range(3)]
+    target_solid = _solid_nodes(target.occupancy)
+    resampled = np.empty(target_solid.shape + field.shape[3:])
+    for column in range(field.shape[3]):
+        resampled[..., column] = ndimage.map_coordinates(field[..., column], coordinates, order=1, mode="nearest")
+    resampled[~target_solid] = 0.0
+    return resampled.reshape((target_solid.size,) + np.shape(values)[1:])
+
+
+def mirror_cells(values, shape, axes):
+    """
+    Per-cell field of a fundamental region (the upper side of mirror planes at the lower
+    face along each of axes) extended to the whole part by reflection. Returns the field
+    over the mirrored grid in C order.
+    """
+    field = np.asarray(values).reshape(shape)
+    for axis in axes:
+        field = np.concatenate([np.flip(field, axis), field], axis=axis)
+    return field.ravel()
+
+
+def mirror_nodes(values, shape, axes):
+    """
+    Per-node vector field (first axis in node C order over shape + 1, then 3 components and
+    any trailing axes) of a fundamental region, reflected like mirror_cells. The nodes on a
+    plane are kept once, and the component normal to the plane changes sign in the mirror
+    image. Returns (n_mirrored_nodes, 3, ...).
+    """
+    values = np.asarray(values)
+    field = values.reshape(tuple(n + 1 for n in shape) + values.shape[1:])
+    for axis in axes:
+        image = np.flip(np.delete(field, 0, axis=axis), axis)
+        image[:, :, :, axis] *= -1
+        field = np.concatenate([image, field], axis=axis)
+    return field.reshape((-1,) + values.shape[1:])
+
+
+def mirror_mesh(voxel_mesh, axes):
+    """ The VoxelMesh of a fundamental region (see mirror_cells) reflected across its planes """
+    origin = np.array(voxel_mesh.origin, dtype=float)
+    for axis in axes:
+        origin[axis] -= voxel_mesh.shape[axis] * voxel_mesh.spacing[axis]
+    occupancy = mirror_cells(voxel_mesh.occupancy, voxel_mesh.shape, axes)
+    return VoxelMesh(occupancy.reshape(mirrored_shape(voxel_mesh.shape, axes)), origin, voxel_mesh.spacing,
+                     lean=voxel_mesh.nodes.dtype == np.float32)
+
+
+def fundamental_mesh(voxel_mesh, axes):
+    """
+    Inverse of mirror_mesh: the upper half along each of axes of a VoxelMesh whose grid is
+    centered on the mirror planes (e.g. voxelized on a symmetric_grid mirrored about axes).
+    """
+    occupancy = np.asarray(voxel_mesh.occupancy).reshape(voxel_mesh.shape)
+    origin = np.array(voxel_mesh.origin, dtype=float)
+    for axis in axes:
+        n = voxel_mesh.shape[axis]
+        if n % 2:
+            raise ValueError(f"Grid has {n} cells along axis {axis}; a mirror plane needs an even count")
+        occupancy = np.take(occupancy, np.arange(n // 2, n), axis=axis)
+        origin[axis] += n // 2 * voxel_mesh.spacing[axis]
+    return VoxelMesh(occupancy, origin, voxel_mesh.spacing, lean=voxel_mesh.nodes.dtype == np.float32)
+
+
+def mirrored_shape(shape, axes):
+    """ Cell grid shape of a fundamental region of shape reflected across axes """
+    return tuple(2 * n if axis in axes else n for axis, n in enumerate(shape))
+
+
+def _solid_nodes(occupancy):
+    """ Node grid mask of nodes that are a corner of at least one occupied cell """
+    occupancy = np.asarray(occupancy, dtype=bool)
+    solid = np.zeros(tuple(n + 1 for n in occupancy.shape), dtype=bool)
+    for dx in (0, 1):
+        for dy in (0, 1):
+            for dz in (0, 1):
+                solid[dx:dx + occupancy.shape[0], dy:dy + occupancy.shape[1], dz:dz + occupancy.shape[2]] |= occupancy
+    return solid
+
+
+def _column_crossings(triangles, x_centers, y_centers):
+    """
+    Intersect vertical rays through the column centers with triangles.
+    Returns (column x index, column y index, z of crossing) for every hit.
+    """
+    x0, pitch_x = x_centers[0], x_centers[1] - x_centers[0] if len(x_centers) > 1 else 1.0
+    y0, pitch_y = y_centers[0], y_centers[1] - y_centers[0] if len(y_centers) > 1 else 1.0
+    lo = triangles.min(axis=1)
+    hi = triangles.max(axis=1)
+    i0 = np.maximum(np.ceil((lo[:, 0] - x0) / pitch_x), 0).astype(np.int64)
+    i1 = np.minimum(np.floor((hi[:, 0] - x0) / pitch_x), len(x_centers) - 1).astype(np.int64)
+    j0 = np.maximum(np.ceil((lo[:, 1] - y0) / pitch_y), 0).astype(np.int64)
+    j1 = np.minimum(np.floor((hi[:, 1] - y0) / pitch_y), len(y_centers) - 1).astype(np.int64)
+    span_j = np.maximum(j1 - j0 + 1, 0)
+    counts = np.maximum(i1 - i0 + 1, 0) * span_j
+    hit = counts > 0
+    triangles, i0, j0, span_j, counts = triangles[hit], i0[hit], j0[hit], span_j[hit], counts[hit]
+
+    # Expand every triangle into the columns under its bounding box
+    owner = np.repeat(np.arange(len(triangles)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    ci = i0[owner] + local // span_j[owner]
+    cj = j0[owner] + local % span_j[owner]
+
+    a, b, c = (triangles[owner, v] for v in range(3))
+    px, py = x_centers[ci], y_centers[cj]
+    w_a = (b[:, 0] - px) * (c[:, 1] - py) - (c[:, 0] - px) * (b[:, 1] - py)
+    w_b = (c[:, 0] - px) * (a[:, 1] - py) - (a[:, 0] - px) * (c[:, 1] - py)
+    w_c = (a[:, 0] - px) * (b[:, 1] - py) - (b[:, 0] - px) * (a[:, 1] - py)
+    area = w_a + w_b + w_c
+    inside = (area != 0) & (((w_a >= 0) & (w_b >= 0) & (w_c >= 0)) | ((w_a <= 0) & (w_b <= 0) & (w_c <= 0)))
+    z = (w_a * a[:, 2] + w_b * b[:, 2] + w_c * c[:, 2])[inside] / area[inside]
+    return ci[inside], cj[inside], z
+
+
+@profiler.timed("voxelize")
+def voxelize(vertices, faces, resolution=64, pitch=None, origin=None, shape=None, slab_columns=1 << 15,
+             largest_component=True, lean=False, symmetry=()):
+    """
+    Voxelize a closed triangle surface by ray parity along z.
+    Parameters:
+    - vertices, faces: Triangle surface (e.g. from an STL).
+    - resolution: Number of cells along the longest bounding box axis (ignored if pitch is given).
+    - pitch: Cell size.
+    - origin, shape: Optional grid placement; defaults to the surface bounding box.
+    - slab_columns: Ray columns processed per x-slab, bounds temporary memory.
+    - largest_component: Keep only the largest face-connected set of cells. Cells joined
+      to it by an edge or corner alone are mechanisms that make the stiffness singular.
+    - lean: Store the mesh in compact dtypes (see VoxelMesh).
+    - symmetry: Axes of mirror planes through the bounding box center. Only the fundamental
+      region on their upper side is voxelized, on a symmetric_grid at resolution, so pitch,
+      origin and shape cannot be given as well.
+    Returns a VoxelMesh.
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    faces = np.asarray(faces)
+    if symmetry:
+        if pitch is not None or origin is not None or shape is not None:
+            raise ValueError("A symmetric voxelization places its own grid; pitch, origin and shape must be None")
+        pitch, origin, shape = symmetric_grid(vertices, resolution, mirrored=symmetry, halved=symmetry)
+    lower, upper = vertices.min(axis=0), vertices.max(axis=0)
+    if pitch is None:
+        pitch = float((upper - lower).max()) / resolution
+    origin = lower if origin is None else np.asarray(origin, dtype=float)
+    if shape is None:
+        shape = tuple(int(n) for n in np.maximum(np.ceil((upper - origin) / pitch - 1e-9), 1))
+    nx, ny, nz = shape
+
+    # Nudge the rays off the cell centers so they do not run exactly through shared edges or vertices
+    nudge = pitch * np.array([1.31e-7, 1.73e-7])
+    x_centers = origin[0] + (np.arange(nx) + 0.5) * pitch + nudge[0]
+    y_centers = origin[1] + (np.arange(ny) + 0.5) * pitch + nudge[1]
+    triangles = vertices[faces]
+    tri_x_lo = triangles[:, :, 0].min(axis=1)
+    tri_x_hi = triangles[:, :, 0].max(axis=1)
+
+    occupancy = np.zeros(shape, dtype=bool)
+    slab = max(1, slab_columns // ny)
+    open_columns = 0
+    for start in range(0, nx, slab):
+        stop = min(start + slab, nx)
+        in_slab = (tri_x_hi >= x_centers[start]) & (tri_x_lo <= x_centers[stop - 1])
+        ci, cj, z = _column_crossings(triangles[in_slab], x_centers[start:stop], y_centers)
+        # Each crossing flips inside/outside for all cell centers above it
+        k = np.clip(np.ceil((z - origin[2]) / pitch - 0.5), 0, nz).astype(np.int64)
+        flips = np.bincount((ci * ny + cj) * (nz + 1) + k, minlength=(stop - start) * ny * (nz + 1))
+        flips = flips.astype(np.uint8).reshape(stop - start, ny, nz + 1)
+        parity = np.cumsum(flips, axis=2, dtype=np.uint8) & 1
+        open_columns += int(np.count_nonzero(parity[:, :, -1]))
+        occupancy[start:stop] = parity[:, :, :nz].astype(bool)
+
+    if open_columns:
+        logging.warning(f"Voxelization found {open_columns} columns with an odd number of crossings; "
+                        "the surface is probably not closed")
+    if largest_component and occupancy.any():
+        labels, n_components = ndimage.label(occupancy)  # Face (6-)connectivity
+        if n_components > 1:
+            sizes = np.bincount(labels.ravel())
+            sizes[0] = 0
+            occupancy = labels == np.argmax(sizes)
+            logging.warning(f"Dropped {int(sizes.sum() - sizes.max())} cells outside the largest of "
+                            f"{n_components} face-connected components")
+    logging.debug(f"Voxelized surface into {shape} grid with {int(occupancy.sum())} occupied cells")
+    profiler.gauge("elements", int(np.count_nonzero(occupancy)))
+    return VoxelMesh(occupancy, origin, (pitch, pitch, pitch), lean=lean)
+
+
+def symmetric_grid(vertices, resolution, mirrored=(0, 1, 2), halved=()):
+    """
+    Voxel grid placement (pitch, origin, shape) whose cells mirror about the bounding-box
+    mid-planes normal to the mirrored axes: those get an even number of cells centered on
+    the box, the others start at the box as in voxelize. Along the halved axes only the
+    upper half is kept, the fundamental region of a part symmetric about that mid-plane,
+    which then lies on the grid's lower face.
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    lower, upper = vertices.min(axis=0), vertices.max(axis=0)
+    pitch = float((upper - lower).max()) / resolution
+    origin = lower.copy()
+    shape = np.maximum(np.ceil((upper - lower) / pitch - 1e-9), 1).astype(int)
+    center = 0.5 * (lower + upper)
+    half = np.maximum(np.ceil((upper - center) / pitch - 1e-9), 1).astype(int)
+    for axis in mirrored:
+        origin[axis] = center[axis] if axis in halved else center[axis] - half[axis] * pitch
+        shape[axis] = half[axis] if axis in halved else 2 * half[axis]
+    return pitch, origin, tuple(int(n) for n in shape)
+
+
+def detect_symmetry(vertices, faces, resolution=64, tolerance=1e-3):
+    """
+    Axes (0, 1, 2) whose bounding-box mid-plane the solid is mirror-symmetric about.
+    The solid is voxelized on a symmetric_grid; an axis qualifies if at most tolerance of
+    the occupied cells differ from their mirror image.
+    """
+    pitch, origin, shape = symmetric_grid(vertices, resolution)
+    occupancy = voxelize(vertices, faces, pitch=pitch, origin=origin, shape=shape).occupancy
+    allowed = tolerance * np.count_nonzero(occupancy)
+    axes = tuple(axis for axis in range(3)
+                 if np.count_nonzero(occupancy != np.flip(occupancy, axis)) <= allowed)
+    logging.debug(f"Surface is mirror-symmetric about axes {axes}")
+    return axes
+
+
+def symmetric_voxelize(vertices, faces, resolution, lean=False):
+    """
+    Whole-part voxelization on the symmetric_grid of the part's mirror planes (detect_symmetry),
+    so that fundamental_mesh can cut it at any of them and mirror_mesh restores the same grid
+    (see optimization.pipeline.optimize_symmetric).
+    """
+    pitch, origin, shape = symmetric_grid(vertices, resolution, mirrored=detect_symmetry(vertices, faces, resolution))
+    return voxelize(vertices, faces, pitch=pitch, origin=origin, shape=shape, lean=lean)
+
+
+def points_inside(vertices, faces, points, chunk_pairs=1 << 22):
+    """
+    Inside test of points against a closed triangle surface by ray parity along +z.
+    Triangles and points are bucketed on an xy grid, so only triangles near a point's
+    ray are tested; chunk_pairs bounds the (triangle, point) pairs held at once.
+    Returns a boolean array over points.
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    points = np.asarray(points, dtype=float)
+    triangles = vertices[np.asarray(faces)]
+    inside = np.zeros(len(points), dtype=bool)
+    if len(points) == 0 or len(triangles) == 0:
+        return inside
+    lower = np.minimum(vertices.min(axis=0), points.min(axis=0))[:2]
+    upper = np.maximum(vertices.max(axis=0), points.max(axis=0))[:2]
+    extent = float((upper - lower).max()) or 1.0
+    # Nudge the rays off shared edges and vertices as in voxelize
+    rays = points[:, :2] + extent * np.array([1.31e-7, 1.73e-7])
+
+    lo = triangles[:, :, :2].min(axis=1)
+    hi = triangles[:, :, :2].max(axis=1)
+    bucket = max(float((hi - lo).mean()), extent / 2048)
+    n_buckets = np.floor((upper - lower) / bucket).astype(np.int64) + 1
+    point_buckets = np.floor((rays - lower) / bucket).astype(np.int64)
+    point_keys = point_buckets[:, 0] * n_buckets[1] + point_buckets[:, 1]
+    order = np.argsort(point_keys, kind="stable")
+    counts = np.bincount(point_keys, minlength=int(np.prod(n_buckets)))
+    starts = np.cumsum(counts) - counts
+
+    # Expand every triangle into the buckets under its bounding box
+    b0 = np.floor((lo - lower) / bucket).astype(np.int64)
+    b1 = np.floor((hi - lower) / bucket).astype(np.int64)
+    span = b1 - b0 + 1
+    per_triangle = span[:, 0] * span[:, 1]
+    owner = np.repeat(np.arange(len(triangles)), per_triangle)
+    local = np.arange(per_triangle.sum()) - np.repeat(np.cumsum(per_triangle) - per_triangle, per_triangle)
+    keys = (b0[owner, 0] + local // span[owner, 1]) * n_buckets[1] + b0[owner, 1] + local % span[owner, 1]
+    pair_counts = counts[keys]
+    owner, keys, pair_counts = owner[pair_counts > 0], keys[pair_counts > 0], pair_counts[pair_counts > 0]
+
+    crossings = np.zeros(len(points), dtype=np.int64)
+    ends = np.cumsum(pair_counts)
+    bounds = np.unique(np.concatenate(([0], np.searchsorted(ends, np.arange(chunk_pairs, ends[-1], chunk_pairs)),
+                                       [len(owner)]))) if len(owner) else [0]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        n = pair_counts[start:stop]
+        tri = np.repeat(owner[start:stop], n)
+        offset = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        point = order[np.repeat(starts[keys[start:stop]], n) + offset]
+        a, b, c = (triangles[tri, v] for v in range(3))
+        px, py = rays[point, 0], rays[point, 1]
+        w_a = (b[:, 0] - px) * (c[:, 1] - py) - (c[:, 0] - px) * (b[:, 1] - py)
+        w_b = (c[:, 0] - px) * (a[:, 1] - py) - (a[:, 0] - px) * (c[:, 1] - py)
+        w_c = (a[:, 0] - px) * (b[:, 1] - py) - (b[:, 0] - px) * (a[:, 1] - py)
+        area = w_a + w_b + w_c
+        hit = (area != 0) & (((w_a >= 0) & (w_b >= 0) & (w_c >= 0)) | ((w_a <= 0) & (w_b <= 0) & (w_c <= 0)))
+        z = (w_a * a[:, 2] + w_b * b[:, 2] + w_c * c[:, 2])[hit] / area[hit]
+        above = z > points[point[hit], 2]
+        crossings += np.bincount(point[hit][above], minlength=len(points))
+    return crossings % 2 == 1
+
+
+def sample_surface(vertices, faces, spacing, min_distance=0.7):
+    """
+    Points on a triangle surface about spacing apart: the vertices, points along the
+    edges and inside the triangles, thinned so that no two are closer than
+    min_distance * spacing, with the vertices taking precedence. Returns an (n, 3) array.
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    faces = np.asarray(faces)
+    edges = np.unique(np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1), axis=0)
+    a, b = vertices[edges[:, 0]], vertices[edges[:, 1]]
+    segments = np.ceil(np.linalg.norm(b - a, axis=1) / spacing).astype(np.int64)
+    owner = np.repeat(np.arange(len(edges)), np.maximum(segments - 1, 0))
+    step = np.arange(len(owner)) - np.repeat(np.cumsum(segments - 1) - (segments - 1), np.maximum(segments - 1, 0)) + 1
+    t = (step / segments[owner])[:, None]
+    samples = [vertices, a[owner] * (1.0 - t) + b[owner] * t]
+
+    triangles = vertices[faces]
+    longest = np.linalg.norm(triangles - np.roll(triangles, 1, axis=1), axis=2).max(axis=1)
+    divisions = np.ceil(longest / spacing).astype(np.int64)
+    for n in np.unique(divisions[divisions >= 3]):
+        # Barycentric grid points strictly inside the triangle, shared by all triangles split n times
+        i, j = np.meshgrid(np.arange(1, n), np.arange(1, n), indexing="ij")
+        keep = i + j < n
+        weights = np.stack([i[keep], j[keep], n - i[keep] - j[keep]], axis=1) / n
+        samples.append(np.einsum("pv,tvk->tpk", weights, triangles[divisions == n]).reshape(-1, 3))
+
+    return _thin_points(np.concatenate(samples), min_distance * spacing)
+
+
+def _thin_points(points, radius):
+    """ Greedily drop points closer than radius to an earlier kept point """
+    # At most one point per cell of a radius / sqrt(3) grid first, which leaves only local conflicts
+    cells = np.floor((points - points.min(axis=0)) * (np.sqrt(3.0) / radius)).astype(np.int64)
+    _, first = np.unique(cells, axis=0, return_index=True)
+    points = points[np.sort(first)]
+    pairs = cKDTree(points).query_pairs(radius, output_type="ndarray")
+    if len(pairs) == 0:
+        return points
+    pairs = np.sort(pairs, axis=1)
+    pairs = pairs[np.argsort(pairs[:, 0], kind="stable")]
+    keep = np.ones(len(points), dtype=bool)
+    starts = np.searchsorted(pairs[:, 0], np.arange(len(points) + 1))
+    for i in np.unique(pairs[:, 0]):
+        if keep[i]:
+            keep[pairs[starts[i]:starts[i + 1], 1]] = False
+    return points[keep]
+
+
+class TetMesh:
+    """ Linear tetrahedral mesh; elements are positively oriented (VTK_TETRA node order) """
+
+    def __init__(self, nodes, elements):
+        self.nodes = np.asarray(nodes, dtype=float)
+        self.elements = np.asarray(elements, dtype=np.int64)
+
+    @property
+    def n_elements(self):
+        return len(self.elements)
+
+    @property
+    def n_nodes(self):
+        return len(self.nodes)
+
+    def boundary_faces(self):
+        """ Triangles used by a single element, oriented outwards """
+        return _boundary_faces(self.elements)
+
+    def quality(self):
+        return tet_quality(self.nodes, self.elements)
+
+
+# Faces of a tetrahedron, opposite nodes 0..3 and oriented outwards for positive volume
+TET_FACES = np.array([[1, 3, 2], [0, 2, 3], [0, 3, 1], [0, 1, 2]])
+TET_EDGES = np.array([[0, 1], [0, 2], [0, 3], [1, 2], [1, 3], [2, 3]])
+
+
+def _face_keys(faces):
+    """ One integer per triangle, equal for triangles with the same nodes in any order """
+    faces = np.sort(faces, axis=1)
+    n = int(faces.max()) + 1 if len(faces) else 1
+    if n ** 3 < 2 ** 63:
+        return (faces[:, 0] * n + faces[:, 1]) * n + faces[:, 2]
+    return np.unique(faces, axis=0, return_inverse=True)[1].ravel()
+
+
+def _boundary_faces(elements):
+    faces = elements[:, TET_FACES].reshape(-1, 3)
+    _, inverse, counts = np.unique(_face_keys(faces), return_inverse=True, return_counts=True)
+    return faces[counts[inverse] == 1]
+
+
+def tet_quality(nodes, elements):
+    """
+    Vectorized shape metrics of linear tetrahedra, each an array over elements:
+    - volume: Signed volume (negative for inverted elements).
+    - radius_ratio: 3 * inradius / circumradius; 1 for a regular tetrahedron, 0 when flat.
+    - mean_ratio: 12 * (3 * volume) ** (2 / 3) / sum of squared edge lengths; 1 when regular.
+    - edge_ratio: Longest over shortest edge.
+    - min_dihedral, max_dihedral: Extreme dihedral angles in degrees (70.53 when regular).
+    Slivers have well proportioned edges but a small minimum dihedral angle and radius ratio.
+    """
+    corners = np.asarray(nodes, dtype=float)[np.asarray(elements)]
+    a, b, c = (corners[:, k] - corners[:, 0] for k in (1, 2, 3))
+    triple = np.einsum("ij,ij->i", a, np.cross(b, c))
+    volume = triple / 6.0
+
+    edges = corners[:, TET_EDGES[:, 1]] - corners[:, TET_EDGES[:, 0]]
+    squared = np.einsum("ijk,ijk->ij", edges, edges)
+    lengths = np.sqrt(squared)
+
+    face_corners = corners[:, TET_FACES]
+    normals = np.cross(face_corners[:, :, 1] - face_corners[:, :, 0], face_corners[:, :, 2] - face_corners[:, :, 0])
+    areas = 0.5 * np.linalg.norm(normals, axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inradius = 3.0 * np.abs(volume) / areas.sum(axis=1)
+        center = (squared[:, 0, None] * np.cross(b, c) + squared[:, 1, None] * np.cross(c, a)
+                  + squared[:, 2, None] * np.cross(a, b)) / (2.0 * triple[:, None])
+        circumradius = np.linalg.norm(center, axis=1)
+        radius_ratio = np.nan_to_num(3.0 * inradius / circumradius)
+        mean_ratio = 12.0 * np.cbrt(3.0 * np.abs(volume)) ** 2 / squared.sum(axis=1) * np.sign(volume)
+        edge_ratio = lengths.max(axis=1) / lengths.min(axis=1)
+        unit = normals / (2.0 * areas[:, :, None])
+        # The edge (i, j) joins the faces opposite the other two nodes
+        opposite = np.array([[2, 3], [1, 3], [1, 2], [0, 3], [0, 2], [0, 1]])
+        cosines = -np.einsum("ijk,ijk->ij", unit[:, opposite[:, 0]], unit[:, opposite[:, 1]])
+        dihedral = np.degrees(np.arccos(np.clip(np.nan_to_num(cosines, nan=1.0), -1.0, 1.0)))
+    return {"volume": volume, "radius_ratio": radius_ratio, "mean_ratio": np.nan_to_num(mean_ratio),
+            "edge_ratio": np.nan_to_num(edge_ratio, nan=np.inf), "min_dihedral": dihedral.min(axis=1),
+            "max_dihedral": dihedral.max(axis=1)}
+
+
+def quality_summary(quality, sliver_angle=10.0):
+    """ Min / mean / percentiles of tet_quality() metrics and counts of slivers and inverted elements """
+    summary = {"elements": int(len(quality["volume"])),
+               "inverted": int(np.count_nonzero(quality["volume"] <= 0)),
+               "slivers": int(np.count_nonzero(quality["min_dihedral"] < sliver_angle))}
+    if summary["elements"] == 0:
+        return summary
+    for name in ("radius_ratio", "mean_ratio", "min_dihedral"):
+        values = quality[name]
+        summary[name] = {"min": float(values.min()), "p1": float(np.percentile(values, 1)),
+                         "p5": float(np.percentile(values, 5)), "mean": float(values.mean())}
+    summary["edge_ratio"] = {"max": float(quality["edge_ratio"].max()),
+                             "p99": float(np.percentile(quality["edge_ratio"], 99)),
+                             "mean": float(quality["edge_ratio"].mean())}
+    summary["max_dihedral"] = {"max": float(quality["max_dihedral"].max()),
+                               "p99": float(np.percentile(quality["max_dihedral"], 99))}
+    return summary
+
+
+def _bcc_lattice(lower, upper, spacing):
+    """ Body-centered cubic lattice points covering the box lower..upper """
+    axes = [np.arange(lo - spacing, hi + spacing, spacing) for lo, hi in zip(lower, upper)]
+    corners = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+    return np.concatenate([corners, corners + 0.5 * spacing])
+
+
+def _face_neighbours(elements):
+    """ (n_elements, 4) index of the element across each face, -1 on the boundary """
+    keys = _face_keys(elements[:, TET_FACES].reshape(-1, 3))
+    order = np.argsort(keys, kind="stable")
+    shared = np.flatnonzero(keys[order][1:] == keys[order][:-1])
+    neighbours = np.full(len(keys), -1, dtype=np.int64)
+    neighbours[order[shared]] = order[shared + 1] // 4
+    neighbours[order[shared + 1]] = order[shared] // 4
+    return neighbours.reshape(-1, 4)
+
+
+def _peel_slivers(nodes, elements, min_dihedral, rounds):
+    """ Repeatedly drop elements on the boundary whose minimum dihedral angle is below min_dihedral """
+    for _ in range(rounds):
+        on_boundary = (_face_neighbours(elements) < 0).any(axis=1)
+        peel = on_boundary & (tet_quality(nodes, elements)["min_dihedral"] < min_dihedral)
+        if not peel.any():
+            break
+        elements = elements[~peel]
+    return elements
+
+
+def _largest_component(elements):
+    """ Elements of the largest face-connected set; ones hanging on by an edge or node alone are mechanisms """
+    neighbours = _face_neighbours(elements)
+    rows = np.repeat(np.arange(len(elements)), 4)[neighbours.ravel() >= 0]
+    graph = sp.coo_matrix((np.ones(len(rows)), (rows, neighbours.ravel()[neighbours.ravel() >= 0])),
+                          shape=(len(elements), len(elements)))
+    n_components, labels = sp.csgraph.connected_components(graph, directed=False)
+    if n_components <= 1:
+        return elements
+    sizes = np.bincount(labels)
+    logging.debug(f"Dropped {len(elements) - sizes.max()} elements outside the largest of {n_components} "
+                  "face-connected components")
+    return elements[labels == np.argmax(sizes)]
+
+
+def _smooth_interior(nodes, elements, iterations):
+    """
+    Move nodes off the boundary towards the mean of their neighbours, keeping a node's
+    move only where the worst radius ratio among its elements does not drop.
+    """
+    n = len(nodes)
+    fixed = np.zeros(n, dtype=bool)
+    fixed[_boundary_faces(elements).ravel()] = True
+    pairs = elements[:, TET_EDGES].reshape(-1, 2)
+    adjacency = sp.coo_matrix((np.ones(2 * len(pairs)), (pairs.ravel(), pairs[:, ::-1].ravel())), shape=(n, n)).tocsr()
+    adjacency.data[:] = 1.0
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    flat = elements.ravel()
+
+    def worst(positions):
+        worst_quality = np.full(n, np.inf)
+        np.minimum.at(worst_quality, flat, np.repeat(tet_quality(positions, elements)["radius_ratio"], 4))
+        return worst_quality
+
+    before = worst(nodes)
+    for _ in range(iterations):
+        moved = nodes.copy()
+        movable = ~fixed & (degree > 0)
+        moved[movable] = adjacency[movable] @ nodes / degree[movable, None]
+        after = worst(moved)
+        moved[after < before] = nodes[after < before]
+        after = worst(moved)
+        # Reverted nodes can still leave a neighbour's element worse; undo those moves too
+        while np.any(after < before - 1e-12):
+            worse = np.unique(elements[np.isin(elements, np.flatnonzero(after < before - 1e-12)).any(axis=1)])
+            moved[worse] = nodes[worse]
+            after = worst(moved)
+        if np.array_equal(moved, nodes):
+            break
+        nodes, before = moved, after
+    return nodes
+
+
+def target_edge_length(vertices, resolution):
+    """ Edge length for a mesh with resolution elements along the longest bounding box axis """
+    vertices = np.asarray(vertices, dtype=float)
+    return float((vertices.max(axis=0) - vertices.min(axis=0)).max()) / resolution
+
+
+def surface_measures(vertices, faces):
+    """ Enclosed volume and area of a closed triangle surface; returns (volume, area) """
+    triangles = np.asarray(vertices, dtype=float)[np.asarray(faces)]
+    volume = abs(np.einsum("ij,ij->i", triangles[:, 0], np.cross(triangles[:, 1], triangles[:, 2])).sum()) / 6.0
+    area = 0.5 * np.linalg.norm(np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]),
+                                axis=1).sum()
+    return float(volume), float(area)
+
+
+def _carved_delaunay(vertices, faces, points, n_surface, h):
+    """ Positively oriented Delaunay tetrahedra of points inside the surface; the first n_surface points lie on it """
+    elements = Delaunay(points).simplices.astype(np.int64)
+    corners = points[elements]
+    keep = points_inside(vertices, faces, corners.mean(axis=1))
+    # Elements spanning a concavity between surface samples can have their centroid inside; test their faces too
+    on_surface = np.all(elements < n_surface, axis=1) & keep
+    # Pulled slightly towards the centroid, as a face on the surface itself has its center exactly on it
+    face_centers = (0.9 * corners[on_surface][:, TET_FACES].mean(axis=2)
+                    + 0.1 * corners[on_surface].mean(axis=1)[:, None]).reshape(-1, 3)
+    keep[np.flatnonzero(on_surface)] = points_inside(vertices, faces, face_centers).reshape(-1, 4).all(axis=1)
+    elements = elements[keep]
+
+    volume = tet_quality(points, elements)["volume"]
+    elements[volume < 0] = elements[volume < 0][:, [0, 2, 1, 3]]
+    return elements[np.abs(volume) > 1e-9 * h ** 3]
+
+
+@profiler.timed("tetrahedralize")
+def tetrahedralize(vertices, faces, resolution=32, edge_length=None, peel_angle=10.0, sliver_passes=2,
+                   smoothing_iterations=3, callback=None):
+    """
+    Size-controlled tetrahedral mesh of the volume inside a closed triangle surface.
+
+    Surface samples about edge_length apart and a body-centered cubic lattice of that
+    spacing inside (whose Delaunay tetrahedra are all well shaped) are triangulated
+    together; tetrahedra whose centroid lies outside the surface are carved away, so
+    concavities stay empty, unlike a Delaunay triangulation of the surface vertices alone.
+    The surface triangles themselves are not recovered, so features thinner than about
+    an edge length lose volume; a warning is logged when the meshed volume differs from
+    the enclosed one by more than TET_VOLUME_TOLERANCE. Boundary slivers are peeled and
+    interior nodes smoothed where that improves their worst element.
+    Parameters:
+    - vertices, faces: Closed triangle surface (e.g. from an STL).
+    - resolution: Elements along the longest bounding box axis (ignored if edge_length is given).
+    - edge_length: Target edge length.
+    - peel_angle: Boundary elements with a smaller minimum dihedral angle (degrees) are removed.
+    - sliver_passes: Times to drop a point of every remaining sliver and triangulate again.
+    - smoothing_iterations: Rounds of interior node smoothing.
+    - callback: Called as callback(fraction, message) after each stage, e.g. to report
+      progress or to cancel by raising.
+    Returns a TetMesh. Raises ValueError if the edge length is too coarse to mesh the part at all.
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    faces = np.asarray(faces)
+    h = edge_length or target_edge_length(vertices, resolution)
+    too_coarse = f"Edge length {h:.4g} is too coarse to tetrahedralize this part, use a higher resolution"
+    surface = sample_surface(vertices, faces, h)
+    # Lattice points closer to the surface than its samples' spacing would form slivers with them
+    lower, upper = vertices.min(axis=0), vertices.max(axis=0)
+    lattice = _bcc_lattice(lower, upper, h)
+    lattice = lattice[np.all((lattice > lower) & (lattice < upper), axis=1)]
+    lattice = lattice[points_inside(vertices, faces, lattice)]
+    distance, _ = cKDTree(sample_surface(vertices, faces, h / 4)).query(lattice)
+    points = np.concatenate([surface, lattice[distance > 0.6 * h]])
+    if callback is not None:
+        callback(0.1, f"Triangulating {len(points)} points")
+
+    n_surface = len(surface)
+    for attempt in range(sliver_passes + 1):
+        try:
+            elements = _carved_delaunay(vertices, faces, points, n_surface, h)
+        except QhullError as e:
+            raise ValueError(f"{too_coarse} (its sample points are too few or coplanar)") from e
+        elements = _largest_component(_peel_slivers(points, elements, peel_angle, rounds=3))
+        if len(elements) == 0:
+            raise ValueError(f"{too_coarse} (no well-shaped element lies inside the surface)")
+        slivers = tet_quality(points, elements)["min_dihedral"] < peel_angle
+        if callback is not None:
+            callback(0.1 + 0.8 * (attempt + 1) / (sliver_passes + 1),
+                     f"Pass {attempt + 1}: {len(elements)} elements, {int(slivers.sum())} slivers")
+        if attempt == sliver_passes or not slivers.any():
+            break
+        # Interior slivers come from near-cospherical points; dropping one of each (lattice points,
+        # numbered last, first) and triangulating again resolves most of them
+        drop = np.unique(elements[slivers].max(axis=1))
+        points = np.delete(points, drop, axis=0)
+        n_surface -= int(np.count_nonzero(drop < n_surface))
+        logging.debug(f"Removed {len(drop)} points to break up {int(slivers.sum())} slivers")
+
+    used, elements = np.unique(elements, return_inverse=True)
+    elements = elements.reshape(-1, 4)
+    nodes = _smooth_interior(points[used], elements, smoothing_iterations)
+    mesh = TetMesh(nodes, elements)
+    enclosed, _ = surface_measures(vertices, faces)
+    meshed = float(mesh.quality()["volume"].sum())
+    if abs(meshed - enclosed) > TET_VOLUME_TOLERANCE * enclosed:
+        logging.warning(f"Tetrahedral mesh holds {meshed:.4g} of the {enclosed:.4g} enclosed volume "
+                        f"({meshed / enclosed:.0%}); parts thinner than the edge length {h:.4g} are lost, "
+                        f"use a higher resolution")
+    profiler.gauge("elements", mesh.n_elements)
+    logging.debug(f"Tetrahedralized surface into {mesh.n_elements} elements on {mesh.n_nodes} nodes "
+                  f"(edge length {h:.4g})")
+    return mesh
+
+
+def estimate_tetrahedra(vertices, faces, resolution=32, edge_length=None):
+    """
+    Approximate node and element counts of tetrahedralize() from the enclosed volume and
+    surface area alone, to size a mesh before building it. Returns (nodes, elements).
+    Raises ValueError outside the range the estimate was fitted for (see TET_MIN_THICKNESS).
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    h = edge_length or target_edge_length(vertices, resolution)
+    volume, area = surface_measures(vertices, faces)
+    thickness = 2.0 * volume / area / h
+    if thickness < TET_MIN_THICKNESS or volume / h ** 3 < TET_MIN_VOLUME:
+        raise ValueError(f"No estimate for edge length {h:.4g}: the part is {thickness:.2f} edge lengths thick "
+                         f"and {volume / h ** 3:.0f} cubed ones in volume, the estimate needs at least "
+                         f"{TET_MIN_THICKNESS} and {TET_MIN_VOLUME:.0f}")
+    nodes = TET_NODES_PER_VOLUME * volume / h ** 3 + TET_NODES_PER_AREA * area / h ** 2
+    elements = TET_ELEMENTS_PER_VOLUME * volume / h ** 3 + TET_ELEMENTS_PER_AREA * area / h ** 2
+    return int(nodes), int(elements)
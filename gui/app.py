@@ -1,8 +1,17 @@
 import sys
 import logging
-from PyQt5.QtWidgets import QApplication, QMainWindow, QAction, QFileDialog, QVBoxLayout, QDialog, QLabel, QLineEdit, QComboBox, QHBoxLayout, QPushButton
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication, QMainWindow, QAction, QFileDialog, QVBoxLayout, QDialog, QLabel, QLineEdit, QComboBox, QHBoxLayout, QPushButton, QProgressBar, QMessageBox
 from vtkmodules.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+from vtk_components.interactor import setup_interactor
 from vtk_components.renderer import Renderer
+from gui.profiler_panel import ProfilerPanel
+from gui.workers import JobRunner
+from utils.file_utils import MeshCache
+from fea.material_properties import MaterialProperties
+from fea.loads_and_constraints import FACES, surface_index
+from optimization.pipeline import (DEFAULT_OPTIMIZATION, continuation_depth, continuation_levels, export_stl,
+                                   load_case_names, optimize, optimize_continuation, optimize_symmetric)
 
 class TopologyOptimizationApp(QMainWindow):
     def __init__(self):
@@ -12,12 +21,25 @@ class TopologyOptimizationApp(QMainWindow):
         self.showMaximized()
 
         self.material_properties = {"color": (1.0, 0.0, 0.0), "opacity": 1.0}
+        # Structural material for analysis (PLA, in N / mm / tonne units)
+        self.fea_material = MaterialProperties()
+        self.fea_material.set_properties(3500.0, 0.36, 1.24e-9)
+        self.loads = []
+        self.constraints = []
+        self.picked_region = None
+        self.optimization_result = None
 
         self.vtk_widget = QVTKRenderWindowInteractor(self)
         self.setCentralWidget(self.vtk_widget)
 
-        self.renderer = Renderer(self.vtk_widget)
+        self.renderer = Renderer(self.vtk_widget, cache=MeshCache())
+        setup_interactor(self.renderer.render_window, self.on_pick)
+        self.jobs = JobRunner(self)
+        self.profiler_panel = ProfilerPanel(self)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.profiler_panel)
+        self.profiler_panel.hide()
         self.create_menus()
+        self.create_status_bar()
         logging.debug("UI setup complete")
 
     def create_menus(self):
@@ -27,6 +49,9 @@ class TopologyOptimizationApp(QMainWindow):
         load_action = QAction("&Load STL", self)
         load_action.triggered.connect(self.load_stl)
         file_menu.addAction(load_action)
+        export_action = QAction("&Export Optimized STL...", self)
+        export_action.triggered.connect(self.export_optimized_stl)
+        file_menu.addAction(export_action)
 
         mesh_menu = menu_bar.addMenu("&Mesh")
         mesh_settings_action = QAction("&Settings", self)
@@ -39,9 +64,33 @@ class TopologyOptimizationApp(QMainWindow):
         material_menu.addAction(material_properties_action)
 
         load_menu = menu_bar.addMenu("&Load")
-        load_settings_action = QAction("&Properties", self)
+        load_settings_action = QAction("&Add Load...", self)
         load_settings_action.triggered.connect(self.open_load_properties_dialog)
         load_menu.addAction(load_settings_action)
+        clear_loads_action = QAction("&Clear Loads", self)
+        clear_loads_action.triggered.connect(self.clear_loads)
+        load_menu.addAction(clear_loads_action)
+
+        constraint_menu = menu_bar.addMenu("&Constraints")
+        fix_region_action = QAction("&Fix Picked Region", self)
+        fix_region_action.triggered.connect(self.fix_picked_region)
+        constraint_menu.addAction(fix_region_action)
+        clear_constraints_action = QAction("&Clear Constraints", self)
+        clear_constraints_action.triggered.connect(self.clear_constraints)
+        constraint_menu.addAction(clear_constraints_action)
+
+        optimization_menu = menu_bar.addMenu("&Optimization")
+        run_optimization_action = QAction("&Run", self)
+        run_optimization_action.triggered.connect(self.run_optimization)
+        optimization_menu.addAction(run_optimization_action)
+        self.worst_case_action = QAction("&Worst-Case Load Case Objective", self, checkable=True)
+        optimization_menu.addAction(self.worst_case_action)
+        self.prune_void_action = QAction("&Prune Void Elements", self, checkable=True)
+        optimization_menu.addAction(self.prune_void_action)
+        self.continuation_action = QAction("&Coarse-to-Fine Continuation", self, checkable=True)
+        optimization_menu.addAction(self.continuation_action)
+        self.symmetry_action = QAction("Use &Mirror Symmetry", self, checkable=True)
+        optimization_menu.addAction(self.symmetry_action)
 
         view_menu = menu_bar.addMenu("&View")
         toggle_stl_action = QAction("Toggle &STL Visibility", self)
@@ -56,11 +105,56 @@ class TopologyOptimizationApp(QMainWindow):
         toggle_nodes_action.triggered.connect(self.renderer.toggle_nodes_visibility)
         view_menu.addAction(toggle_nodes_action)
 
+        toggle_density_action = QAction("Toggle &Density Visibility", self)
+        toggle_density_action.triggered.connect(self.renderer.toggle_density_visibility)
+        view_menu.addAction(toggle_density_action)
+
+        toggle_profiler_action = self.profiler_panel.toggleViewAction()
+        toggle_profiler_action.setText("&Profiler")
+        view_menu.addAction(toggle_profiler_action)
+
+        jobs_menu = menu_bar.addMenu("&Jobs")
+        self.cancel_job_action = QAction("&Cancel Running Jobs", self)
+        self.cancel_job_action.setEnabled(False)
+        self.cancel_job_action.triggered.connect(lambda: self.jobs.cancel())
+        jobs_menu.addAction(self.cancel_job_action)
+
+    def create_status_bar(self):
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setMaximumWidth(240)
+        self.progress_bar.hide()
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        self.jobs.job_started.connect(self.on_job_started)
+        self.jobs.job_progress.connect(self.on_job_progress)
+        self.jobs.job_ended.connect(self.on_job_ended)
+
+    def on_job_started(self, name):
+        self.statusBar().showMessage(f"{name}...")
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.cancel_job_action.setEnabled(True)
+
+    def on_job_progress(self, name, fraction, message):
+        self.progress_bar.setValue(int(100 * fraction))
+        self.statusBar().showMessage(f"{name}: {message}" if message else f"{name}...")
+
+    def on_job_ended(self, name):
+        if name == "Optimize":
+            self.renderer.end_density_stream()
+        if not self.jobs.is_running():
+            self.progress_bar.hide()
+            self.cancel_job_action.setEnabled(False)
+            self.statusBar().clearMessage()
+
+    def on_job_error(self, message):
+        QMessageBox.critical(self, "Error", message)
+
     def load_stl(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Open STL File", "", "STL Files (*.stl)")
         if file_path:
-            self.renderer.load_stl(file_path)
-            self.renderer.reset_camera()
+            self.jobs.submit("Load STL", self.renderer.prepare_stl, file_path,
+                             on_finished=self.renderer.apply_stl, on_error=self.on_job_error)
 
     def open_mesh_settings_dialog(self):
         settings = {"algorithm": self.renderer.mesh_algorithm, "resolution": self.renderer.mesh_resolution}
@@ -68,18 +162,116 @@ class TopologyOptimizationApp(QMainWindow):
         if dialog.exec():
             settings = dialog.get_settings()
             self.renderer.set_mesh_settings(settings["algorithm"], settings["resolution"])
-            self.renderer.generate_mesh()
+            self.jobs.submit("Generate mesh", self.renderer.compute_mesh,
+                             on_finished=self.apply_mesh, on_error=self.on_job_error)
+
+    def apply_mesh(self, result):
+        if result is not None:
+            self.renderer.apply_mesh(result)
 
     def open_material_properties_dialog(self):
         dialog = MaterialPropertiesDialog(self.material_properties)
         if dialog.exec():
             self.material_properties = dialog.get_properties()
 
+    def on_pick(self, picker, event):
+        """ 'p' over the STL selects the smooth face region around the triangle under the mouse """
+        face = picker.GetCellId()
+        if picker.GetActor() is not self.renderer.stl_actor or face < 0:
+            return
+        faces = surface_index(*self.renderer.stl_surface).face_region(face)
+        self.picked_region = {"surface_face": {"face": int(face)}}
+        self.renderer.highlight_faces(faces)
+        self.statusBar().showMessage(f"Picked a face region of {len(faces)} triangles", 5000)
+
+    def fix_picked_region(self):
+        if self.picked_region is None:
+            QMessageBox.information(self, "Constraints", "Pick a face region first (press P over the part).")
+            return
+        self.constraints.append({"region": self.picked_region})
+        self.statusBar().showMessage(f"{len(self.constraints)} fixed regions", 5000)
+
+    def clear_constraints(self):
+        self.constraints = []
+        self.statusBar().showMessage("Constraints cleared", 5000)
+
     def open_load_properties_dialog(self):
-        dialog = LoadInputDialog()
+        # Each load starts a new case by default; reuse a name to add to an existing case
+        dialog = LoadInputDialog(default_case=f"Case {len(load_case_names(self.loads)) + 1}",
+                                 picked_region=self.picked_region)
         if dialog.exec():
-            load_properties = dialog.get_load_properties()
-            # Handle load properties
+            self.loads.append(dialog.get_load_properties())
+            cases = load_case_names(self.loads)
+            self.statusBar().showMessage(f"{len(self.loads)} loads in {len(cases)} load cases", 5000)
+
+    def clear_loads(self):
+        self.loads = []
+        self.statusBar().showMessage("Loads cleared", 5000)
+
+    def run_optimization(self):
+        if self.renderer.voxel_mesh is None:
+            QMessageBox.information(self, "Optimization", "Generate a Voxel mesh first.")
+            return
+        loads = [load for load in self.loads if load["type"] == "Force"]
+        if not loads:
+            QMessageBox.information(self, "Optimization", "Add a Force load first.")
+            return
+        if len(loads) < len(self.loads):
+            logging.warning(f"Skipping {len(self.loads) - len(loads)} Pressure/Thermal loads; "
+                            "only forces are analysed")
+        # Without picked constraints, clamp the minimum-x face
+        constraints = self.constraints or [{"region": {"face": "x_min"}}]
+        settings = {"objective": "worst_case" if self.worst_case_action.isChecked() else "weighted",
+                    "prune_void": self.prune_void_action.isChecked()}
+        levels = None
+        if self.continuation_action.isChecked():
+            # As many halvings as keep the coarsest level meshable; a single level is a plain run
+            depth = continuation_depth(self.renderer.mesh_resolution)
+            if depth > 1:
+                levels = continuation_levels(self.renderer.mesh_resolution, depth,
+                                             DEFAULT_OPTIMIZATION["max_iterations"])
+            else:
+                self.statusBar().showMessage(f"Mesh resolution {self.renderer.mesh_resolution} is too coarse for "
+                                             "continuation; running a single level", 10000)
+        if self.symmetry_action.isChecked():
+            # The voxel mesh lies on the grid of the part's mirror planes, so the mirrored result matches it
+            self.renderer.begin_density_stream(self.renderer.voxel_mesh)
+            self.jobs.submit("Optimize", optimize_symmetric, self.renderer.voxel_mesh, self.renderer.stl_surface,
+                             self.renderer.mesh_resolution, self.fea_material, constraints, loads, settings,
+                             levels=levels, on_intermediate=self.renderer.update_density,
+                             on_finished=self.on_optimization_finished, on_error=self.on_job_error)
+            return
+        if levels:
+            # Coarser levels run on their own grids; only the finest streams densities to the view
+            self.renderer.begin_density_stream(self.renderer.voxel_mesh)
+            self.jobs.submit("Optimize", optimize_continuation, self.renderer.stl_surface, levels, self.fea_material,
+                             constraints, loads, settings, voxel_mesh=self.renderer.voxel_mesh,
+                             on_intermediate=self.renderer.update_density,
+                             on_finished=lambda output: self.on_optimization_finished(output[1]),
+                             on_error=self.on_job_error)
+            return
+        self.renderer.begin_density_stream(self.renderer.voxel_mesh)
+        self.jobs.submit("Optimize", optimize, self.renderer.voxel_mesh, self.fea_material, constraints, loads,
+                         settings, surface=self.renderer.stl_surface, on_intermediate=self.renderer.update_density,
+                         on_finished=self.on_optimization_finished, on_error=self.on_job_error)
+
+    def on_optimization_finished(self, result):
+        self.optimization_result = (result, self.renderer.voxel_mesh)
+        self.renderer.update_density(result["physical_densities"])
+        self.statusBar().showMessage(f"Optimization finished after {result['iterations']} iterations, "
+                                     f"compliance {result['compliance']:.4g}", 10000)
+
+    def export_optimized_stl(self):
+        if self.optimization_result is None:
+            QMessageBox.information(self, "Export", "Run an optimization first.")
+            return
+        file_path, _ = QFileDialog.getSaveFileName(self, "Export Optimized STL", "", "STL Files (*.stl)")
+        if file_path:
+            result, voxel_mesh = self.optimization_result
+            self.jobs.submit("Export STL", export_stl, file_path, result["physical_densities"], voxel_mesh,
+                             on_finished=lambda mesh: self.statusBar().showMessage(
+                                 f"Exported {len(mesh.faces)} triangles to {file_path}", 10000),
+                             on_error=self.on_job_error)
 
 class MaterialPropertiesDialog(QDialog):
     def __init__(self, properties, parent=None):
@@ -112,8 +304,12 @@ class MaterialPropertiesDialog(QDialog):
         return self.properties
 
 class LoadInputDialog(QDialog):
-    def __init__(self, parent=None):
+    PICKED_REGION = "picked region"
+
+    def __init__(self, default_case="Case 1", picked_region=None, parent=None):
         super().__init__(parent)
+        self.default_case = default_case
+        self.picked_region = picked_region
         self.init_ui()
 
     def init_ui(self):
@@ -147,6 +343,19 @@ class LoadInputDialog(QDialog):
         layout.addWidget(self.temperature_label)
         layout.addWidget(self.temperature)
 
+        layout.addWidget(QLabel("Applied To:"))
+        self.face = QComboBox(self)
+        self.face.addItems(list(FACES))
+        self.face.setCurrentText("x_max")
+        if self.picked_region is not None:
+            self.face.addItem(self.PICKED_REGION)
+            self.face.setCurrentText(self.PICKED_REGION)
+        layout.addWidget(self.face)
+
+        layout.addWidget(QLabel("Load Case:"))
+        self.case = QLineEdit(self.default_case, self)
+        layout.addWidget(self.case)
+
         submit_button = QPushButton('Submit', self)
         submit_button.clicked.connect(self.submit)
         layout.addWidget(submit_button)
@@ -158,23 +367,21 @@ class LoadInputDialog(QDialog):
         self.accept()
 
     def update_load_type(self):
-        load_type = self.load_type.currentText()
-        if load_type == "Thermal":
-            self.magnitude_label.hide()
-            self.magnitude.hide()
-            self.direction_layout.hide()
-            self.temperature_label.show()
-            self.temperature.show()
-        else:
-            self.magnitude_label.show()
-            self.magnitude.show()
-            self.direction_layout.show()
-            self.temperature_label.hide()
-            self.temperature.hide()
+        is_thermal = self.load_type.currentText() == "Thermal"
+        self.magnitude_label.setVisible(not is_thermal)
+        self.magnitude.setVisible(not is_thermal)
+        for i in range(self.direction_layout.count()):
+            self.direction_layout.itemAt(i).widget().setVisible(not is_thermal)
+        self.temperature_label.setVisible(is_thermal)
+        self.temperature.setVisible(is_thermal)
 
     def get_load_properties(self):
         load_type = self.load_type.currentText()
-        properties = {"type": load_type}
+        if self.face.currentText() == self.PICKED_REGION:
+            region = dict(self.picked_region)
+        else:
+            region = {"face": self.face.currentText()}
+        properties = {"type": load_type, "region": region, "case": self.case.text().strip() or self.default_case}
         if load_type == "Thermal":
             properties["temperature_change"] = float(self.temperature.text())
         else:
@@ -194,7 +401,7 @@ class MeshSettingsDialog(QDialog):
 
         layout.addWidget(QLabel("Mesh Algorithm:"))
         self.algorithm_input = QComboBox(self)
-        self.algorithm_input.addItems(["Delaunay", "Voronoi", "Tetrahedral"])
+        self.algorithm_input.addItems(["Delaunay", "Voronoi", "Tetrahedral", "Voxel"])
         self.algorithm_input.setCurrentText(self.settings["algorithm"])
         layout.addWidget(self.algorithm_input)
 
@@ -0,0 +1,79 @@
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import (QDockWidget, QFileDialog, QHBoxLayout, QHeaderView, QPushButton, QTableWidget,
+                             QTableWidgetItem, QVBoxLayout, QWidget)
+from utils.profiling import profiler
+
+STAGE_COLUMNS = ("Stage", "Calls", "Total s", "Mean ms", "Max ms")
+
+
+class ProfilerPanel(QDockWidget):
+    """ Dockable view of utils.profiling.profiler: stage timings, counters and gauges, refreshed while visible """
+
+    def __init__(self, parent=None, interval_ms=1000):
+        super().__init__("Profiler", parent)
+        self.setObjectName("ProfilerPanel")
+        self.init_ui()
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.on_visibility_changed)
+
+    def init_ui(self):
+        widget = QWidget(self)
+        layout = QVBoxLayout(widget)
+
+        self.stage_table = QTableWidget(0, len(STAGE_COLUMNS), widget)
+        self.stage_table.setHorizontalHeaderLabels(STAGE_COLUMNS)
+        self.counter_table = QTableWidget(0, 2, widget)
+        self.counter_table.setHorizontalHeaderLabels(("Counter", "Value"))
+        for table in (self.stage_table, self.counter_table):
+            table.verticalHeader().hide()
+            table.setEditTriggers(QTableWidget.NoEditTriggers)
+            table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        layout.addWidget(self.stage_table, 3)
+        layout.addWidget(self.counter_table, 2)
+
+        button_layout = QHBoxLayout()
+        for text, slot in (("Reset", self.reset), ("Save JSON...", self.save_json), ("Save Trace...", self.save_trace)):
+            button = QPushButton(text, widget)
+            button.clicked.connect(slot)
+            button_layout.addWidget(button)
+        layout.addLayout(button_layout)
+        self.setWidget(widget)
+
+    def on_visibility_changed(self, visible):
+        if visible:
+            self.refresh()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def refresh(self):
+        summary = profiler.summary()
+        stages = sorted(summary["stages"].items(), key=lambda item: -item[1]["total_seconds"])
+        self.stage_table.setRowCount(len(stages))
+        for row, (name, stats) in enumerate(stages):
+            values = (name, str(stats["count"]), f"{stats['total_seconds']:.3f}",
+                      f"{1000 * stats['mean_seconds']:.2f}", f"{1000 * stats['max_seconds']:.2f}")
+            for column, value in enumerate(values):
+                self.stage_table.setItem(row, column, QTableWidgetItem(value))
+
+        counters = sorted({**summary["counters"], **summary["gauges"]}.items())
+        self.counter_table.setRowCount(len(counters))
+        for row, (name, value) in enumerate(counters):
+            self.counter_table.setItem(row, 0, QTableWidgetItem(name))
+            self.counter_table.setItem(row, 1, QTableWidgetItem(f"{value:,}" if isinstance(value, int) else str(value)))
+
+    def reset(self):
+        profiler.reset()
+        self.refresh()
+
+    def save_json(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Profile", "profile.json", "JSON Files (*.json)")
+        if file_path:
+            profiler.write_json(file_path)
+
+    def save_trace(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Chrome Trace", "trace.json", "JSON Files (*.json)")
+        if file_path:
+            profiler.write_chrome_trace(file_path)
@@ -11,7 +11,7 @@ class MeshSettingsDialog(QDialog):
 
         # Mesh algorithm selection
         self.algorithmCombo = QComboBox()
-        self.algorithmCombo.addItems(["Delaunay", "Voronoi", "Tetrahedral"])
+        self.algorithmCombo.addItems(["Delaunay", "Voronoi", "Tetrahedral", "Voxel"])
         layout.addWidget(QLabel("Select Mesh Algorithm:"))
         layout.addWidget(self.algorithmCombo)
 
@@ -0,0 +1,132 @@
+# gui/workers.py
+import logging
+import threading
+import traceback
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class JobCancelled(Exception):
+    """ Raised inside a job when the user cancelled it """
+
+
+class JobContext:
+    """
+    Handed to every job function as its `context` argument.
+    Jobs report progress through it and poll it for cancellation.
+    """
+
+    def __init__(self, signals):
+        self._signals = signals
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def progress(self, fraction, message=""):
+        self._signals.progress.emit(float(fraction), message)
+
+    def publish(self, data):
+        """ Send an intermediate result (e.g. the current density field) to the GUI thread """
+        self._signals.intermediate.emit(data)
+
+
+class WorkerSignals(QObject):
+    # Created on the GUI thread, so connected slots run there (queued connections)
+    progress = pyqtSignal(float, str)
+    intermediate = pyqtSignal(object)
+    finished = pyqtSignal(object)
+    error = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class Worker(QRunnable):
+    def __init__(self, name, fn, *args, **kwargs):
+        super().__init__()
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.context = JobContext(self.signals)
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, context=self.context, **self.kwargs)
+        except JobCancelled:
+            logging.debug(f"Job '{self.name}' cancelled")
+            self.signals.cancelled.emit()
+            return
+        except Exception as e:
+            logging.error(f"Job '{self.name}' failed: {e}\n{traceback.format_exc()}")
+            self.signals.error.emit(str(e))
+            return
+        if self.context.cancelled:
+            self.signals.cancelled.emit()
+        else:
+            self.signals.finished.emit(result)
+
+
+class JobRunner(QObject):
+    """
+    Runs load, mesh, solve and optimize steps on a thread pool.
+
+    Only the final result crosses back to the GUI thread, through the
+    on_finished callback, plus whatever a job explicitly publishes to
+    on_intermediate. Submitting a job with the name of a running job
+    cancels the older one.
+    """
+
+    job_started = pyqtSignal(str)
+    job_progress = pyqtSignal(str, float, str)
+    job_ended = pyqtSignal(str)
+
+    def __init__(self, parent=None, pool=None):
+        super().__init__(parent)
+        self.pool = pool or QThreadPool.globalInstance()
+        self.workers = {}
+
+    def submit(self, name, fn, *args, on_finished=None, on_error=None, on_intermediate=None, **kwargs):
+        if name in self.workers:
+            self.workers[name].context.cancel()
+        worker = Worker(name, fn, *args, **kwargs)
+        signals = worker.signals
+        signals.progress.connect(lambda fraction, message: self.job_progress.emit(name, fraction, message))
+        if on_finished is not None:
+            signals.finished.connect(on_finished)
+        if on_error is not None:
+            signals.error.connect(on_error)
+        if on_intermediate is not None:
+            signals.intermediate.connect(on_intermediate)
+        for signal in (signals.finished, signals.error, signals.cancelled):
+            signal.connect(lambda *_, w=worker: self._ended(w))
+        self.workers[name] = worker
+        self.job_started.emit(name)
+        self.pool.start(worker)
+        logging.debug(f"Job '{name}' submitted")
+        return worker
+
+    def _ended(self, worker):
+        if self.workers.get(worker.name) is worker:
+            del self.workers[worker.name]
+        self.job_ended.emit(worker.name)
+
+    def cancel(self, name=None):
+        """ Cancel one job, or every running job when no name is given """
+        names = list(self.workers) if name is None else [name]
+        for job_name in names:
+            if job_name in self.workers:
+                self.workers[job_name].context.cancel()
+
+    def is_running(self, name=None):
+        return bool(self.workers) if name is None else name in self.workers
+
+    def wait(self, msecs=-1):
+        return self.pool.waitForDone(msecs)
@@ -1 +1,83 @@
-""""""
+import numpy as np
+
+
+def dot64(a, b):
+    """ a . b accumulated in float64, also for float32 operands """
+    return float(np.einsum('i,i->', a, b, dtype=np.float64))
+
+
+def simp_interpolation(densities, penalty=3.0, e_min=1e-9):
+    """
+    SIMP stiffness factors E(x) / E0 and their derivatives with respect to x.
+    Parameters:
+    - densities: Physical element densities in [0, 1].
+    - penalty: SIMP exponent p.
+    - e_min: Relative stiffness of void, keeps the stiffness matrix non-singular.
+    """
+    powered = densities ** (penalty - 1.0)
+    scale = e_min + (1.0 - e_min) * powered * densities
+    derivative = penalty * (1.0 - e_min) * powered
+    return scale, derivative
+
+
+def compliance_sensitivities(element_energies, derivative):
+    """ dc/dx for compliance c = sum_e E(x_e) u_e^T ke u_e """
+    return -derivative * element_energies
+
+
+def aggregate_compliance(compliances, weights=None, objective="weighted", p=8.0):
+    """
+    Combine the compliances of several load cases into one objective.
+    Parameters:
+    - compliances: Compliance of every load case.
+    - weights: Per-case factors (default 1).
+    - objective: "weighted" for sum_i w_i c_i, or "worst_case" for the p-norm of the
+      weighted compliances, a smooth upper bound of their maximum that the gradient-based
+      update can follow without jumping between cases.
+    Returns the objective and its derivatives with respect to each case compliance.
+    """
+    compliances = np.asarray(compliances, dtype=float)
+    weights = np.ones(len(compliances)) if weights is None else np.asarray(weights, dtype=float)
+    if objective == "weighted":
+        return float(weights.dot(compliances)), weights
+    if objective != "worst_case":
+        raise ValueError(f"Unknown objective: {objective}")
+    weighted = weights * compliances
+    largest = weighted.max()
+    if largest <= 0.0:
+        return 0.0, weights
+    ratios = weighted / largest  # Keeps the powers in range
+    value = largest * np.sum(ratios ** p) ** (1.0 / p)
+    return float(value), weights * (weighted / value) ** (p - 1.0)
+
+
+def optimality_criteria_update(densities, compliance_gradient, volume_gradient, target_volume,
+                               move_limit=0.2, damping=0.5, x_min=0.0, x_max=1.0, tolerance=1e-4):
+    """
+    Optimality-criteria update with the volume Lagrange multiplier found by bisection.
+
+    Every bisection step is a single vectorized pass over all design variables.
+    Parameters:
+    - densities: Current design variables.
+    - compliance_gradient: dc/dx (non-positive).
+    - volume_gradient: dV/dx; the volume is linear in x, so V(x) = volume_gradient . x.
+    - target_volume: Allowed volume.
+    Returns the new design variables and the multiplier.
+    """
+    ratio = np.maximum(-compliance_gradient, 0.0) / np.maximum(volume_gradient, 1e-30)
+    update = ratio ** damping
+    lower = np.maximum(x_min, densities - move_limit)
+    upper = np.minimum(x_max, densities + move_limit)
+
+    # Bisect in log space; the multiplier spans many decades across problem scales
+    log_low, log_high = -40.0, 40.0
+    while log_high - log_low > tolerance:
+        log_mid = 0.5 * (log_low + log_high)
+        candidate = np.clip(densities * update * np.exp(-damping * log_mid), lower, upper)
+        if dot64(volume_gradient, candidate) > target_volume:
+            log_low = log_mid
+        else:
+            log_high = log_mid
+    multiplier = np.exp(0.5 * (log_low + log_high))
+    new_densities = np.clip(densities * update * multiplier ** -damping, lower, upper)
+    return new_densities, multiplier
@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import numpy as np
+import scipy.sparse as sp
+from scipy.ndimage import correlate1d
+from scipy.spatial import cKDTree
+
+from utils.profiling import profiler
+
+
+def hat_weights(radius, spacing):
+    """ 1D weights max(0, r - |d|) sampled at the grid spacing """
+    reach = int(np.ceil(radius / spacing)) - 1
+    offsets = np.arange(-reach, reach + 1) * spacing
+    return np.maximum(0.0, radius - np.abs(offsets))
+
+
+def neighbourhood_matrix(centroids, radius):
+    """ Sparse cone weights H_ij = max(0, r - |c_i - c_j|) from a KD-tree radius query """
+    tree = cKDTree(centroids)
+    pairs = tree.sparse_distance_matrix(tree, radius, output_type='ndarray')
+    weights = radius - pairs['v']
+    keep = weights > 0.0
+    n = len(centroids)
+    return sp.csr_matrix((weights[keep], (pairs['i'][keep], pairs['j'][keep])), shape=(n, n))
+
+
+class DensityFilter:
+    """
+    Linear filter for density-based topology optimization.
+
+    The weights are built once, either as a sparse matrix H from a KD-tree
+    radius query over element centroids (unstructured meshes), or as a
+    separable product of 1D hat kernels for voxel grids. Every iteration is
+    then a sparse mat-vec or three 1D correlations. Weights are rebuilt only
+    when update() sees a different mesh or radius.
+
+    mode="density" filters the densities (and chain-rules the gradients);
+    mode="sensitivity" keeps densities and filters the compliance gradient.
+    On voxel grids, dtype=np.float32 keeps the weight sums and filtered fields in
+    float32; the correlations themselves are computed in float64. mirror_axes lists
+    grid axes whose lower face is a symmetry plane (the grid is the fundamental region
+    of a symmetric part): the neighbourhoods there reach into the mirror image instead
+    of ending at the face, as they would on the whole part.
+    """
+
+    MODES = ("density", "sensitivity")
+
+    def __init__(self, radius, centroids=None, shape=None, spacing=(1.0, 1.0, 1.0), active=None, mode="density",
+                 dtype=np.float64, mirror_axes=()):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown filter mode: {mode}")
+        if mirror_axes and shape is None:
+            raise ValueError("Mirror planes need a voxel grid filter")
+        self.mode = mode
+        self.dtype = np.dtype(dtype)
+        self.mirror_axes = tuple(mirror_axes)
+        self._key = None
+        self.update(radius, centroids=centroids, shape=shape, spacing=spacing, active=active)
+
+    def update(self, radius, centroids=None, shape=None, spacing=(1.0, 1.0, 1.0), active=None):
+        """ Rebuild the weights if the mesh, active set or radius changed; returns True if rebuilt """
+        if (centroids is None) == (shape is None):
+            raise ValueError("DensityFilter needs either element centroids or a voxel grid shape")
+        digest = hashlib.blake2b(digest_size=16)
+        if centroids is not None:
+            centroids = np.ascontiguousarray(centroids, dtype=float)
+            digest.update(centroids.tobytes())
+        if active is not None:
+            active = np.asarray(active, dtype=bool).ravel()
+            digest.update(np.packbits(active).tobytes())
+        key = (float(radius), None if shape is None else tuple(shape), tuple(spacing), digest.hexdigest())
+        if key == self._key:
+            return False
+
+        with profiler.span("filter_setup"):
+            self._build(radius, centroids, shape, spacing, active)
+        self._key = key
+        return True
+
+    def _build(self, radius, centroids, shape, spacing, active):
+        self.radius = float(radius)
+        self.shape = None if shape is None else tuple(int(n) for n in shape)
+        self.spacing = tuple(float(h) for h in spacing)
+        if self.shape is not None:
+            self.matrix = None
+            self.kernels = [hat_weights(self.radius, h) for h in self.spacing]
+            n_elements = int(np.prod(self.shape))
+        else:
+            self.matrix = neighbourhood_matrix(centroids, self.radius)
+            self.kernels = None
+            n_elements = len(centroids)
+        self.active = np.ones(n_elements, dtype=bool) if active is None else active
+        self.weight_sums = self._weigh(self.active.astype(self.dtype))
+        self.weight_sums[~self.active] = 1.0
+        logging.debug(f"Filter weights built for {n_elements} elements, radius {self.radius}")
+
+    def _weigh(self, values):
+        """ H @ values """
+        if self.matrix is not None:
+            return self.matrix @ values
+        field = values.reshape(self.shape)
+        for axis, kernel in enumerate(self.kernels):
+            reach = len(kernel) // 2
+            if axis not in self.mirror_axes or reach == 0:
+                field = correlate1d(field, kernel, axis=axis, mode='constant', cval=0.0)
+                continue
+            padding = [(0, 0)] * 3
+            padding[axis] = (reach, 0)
+            padded = correlate1d(np.pad(field, padding, mode='symmetric'), kernel, axis=axis, mode='constant', cval=0.0)
+            field = padded[tuple(slice(reach, None) if a == axis else slice(None) for a in range(3))]
+        return field.ravel()
+
+    @profiler.timed("filter")
+    def _filter(self, values):
+        return np.where(self.active, self._weigh(np.where(self.active, values, 0.0)) / self.weight_sums, 0.0)
+
+    def filter_densities(self, densities):
+        if self.mode == "sensitivity":
+            return densities
+        return self._filter(densities)
+
+    def filter_sensitivities(self, gradient, densities):
+        """ Filtered compliance gradient with respect to the design variables """
+        if self.mode == "sensitivity":
+            return self._filter(densities * gradient) / np.maximum(1e-3, densities)
+        # H is symmetric, so the chain rule H^T (g / Hs) is another filter pass
+        return self._filter_transpose(gradient)
+
+    def filter_volume_gradient(self, gradient):
+        if self.mode == "sensitivity":
+            return gradient
+        return self._filter_transpose(gradient)
+
+    @profiler.timed("filter")
+    def _filter_transpose(self, gradient):
+        return np.where(self.active, self._weigh(np.where(self.active, gradient / self.weight_sums, 0.0)), 0.0)
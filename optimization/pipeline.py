@@ -0,0 +1,623 @@
+import json
+import logging
+import os
+import time
+import numpy as np
+
+from fea.fea_solver import VoxelFEASolver, dofs_for_nodes
+from fea.loads_and_constraints import (force_vector, fundamental_dofs, is_symmetric, select_nodes,
+                                      symmetry_constraints)
+from fea.material_properties import MaterialProperties
+from fea.mesh_generation import (VoxelMesh, density_surface, detect_symmetry, fundamental_mesh, mirror_cells,
+                                 mirror_mesh, mirror_nodes, resample_cells, resample_nodes, symmetric_grid, voxelize)
+from optimization.filters import DensityFilter
+from optimization.solver import TopologyOptimizer
+from utils.file_utils import read_stl
+from utils.profiling import PeakMemory, profiler
+
+# Mesh -> FEA -> optimize without any GUI or VTK imports, shared by batch.py and the GUI
+
+DEFAULT_MATERIAL = {"youngs_modulus": 3500.0, "poissons_ratio": 0.36, "density": 1.24e-9}  # PLA, N / mm / tonne
+DEFAULT_MESH = {"algorithm": "Voxel", "resolution": 40, "symmetry": []}
+AXES = ("x", "y", "z")
+DEFAULT_OPTIMIZATION = {"volume_fraction": 0.3, "penalty": 3.0, "max_iterations": 50, "tolerance": 0.01,
+                        "move_limit": 0.2, "filter_radius": 1.5, "filter_mode": "density",
+                        "solver": "multigrid", "rtol": 1e-6, "warm_start": True, "checkpoint_interval": 10,
+                        "objective": "weighted", "case_weights": {}, "prune_void": False,
+                        "void_threshold": 1e-3, "freeze_after": 5, "prune_interval": 5,
+                        "continuation_blend": 0.5, "lean_memory": False}
+DEFAULT_EXPORT = {"stl": True, "level": 0.5, "smoothing_iterations": 10, "max_faces": 200000}
+MIN_LEVEL_RESOLUTION = 4
+MIN_LEVEL_ITERATIONS = 5
+LEAN_CHUNK_ELEMENTS = 1 << 15  # Matrix-free slab size with "lean_memory", a quarter of the default
+
+
+def normalize_job(job, base_dir="."):
+    """
+    Fill in job defaults and resolve paths against base_dir.
+
+    A job has an "stl" path, optional "output" directory, "material", "mesh",
+    "optimization" and "export" settings (see the DEFAULT_* dicts), and lists of
+    "constraints" ({"region": ..., "components": [0, 1, 2]}) and "loads"
+    ({"region": ..., "type": "Force", "magnitude": ..., "direction": [...], "case": "name"}).
+    Regions are described as in fea.loads_and_constraints.select_nodes. Loads with
+    the same "case" act together; distinct cases are separate load cases whose
+    compliances combine per the "objective" and "case_weights" optimization settings.
+    An optional "initial_densities" names the densities.npz of an earlier (e.g.
+    coarser) run to start from. Alternatively "continuation" runs the optimization
+    coarse to fine within the job (see continuation_levels). The mesh "symmetry" lists
+    mirror planes ("x", "y", "z": the bounding-box mid-plane normal to that axis) to solve
+    only the fundamental region for, or is "auto" to find them (see resolve_symmetry).
+    """
+    if "stl" not in job:
+        raise ValueError("Job needs an 'stl' path")
+    normalized = dict(job)
+    normalized["material"] = {**DEFAULT_MATERIAL, **job.get("material", {})}
+    normalized["mesh"] = {**DEFAULT_MESH, **job.get("mesh", {})}
+    normalized["optimization"] = {**DEFAULT_OPTIMIZATION, **job.get("optimization", {})}
+    normalized["export"] = {**DEFAULT_EXPORT, **job.get("export", {})}
+    normalized["constraints"] = list(job.get("constraints", []))
+    normalized["loads"] = list(job.get("loads", []))
+    if normalized["mesh"]["symmetry"] != "auto":
+        unknown = set(normalized["mesh"]["symmetry"]) - set(AXES)
+        if unknown:
+            raise ValueError(f"Unknown symmetry planes: {sorted(unknown)}")
+    if normalized["mesh"]["algorithm"] != "Voxel":
+        raise ValueError(f"Only Voxel meshes can be optimized, not {normalized['mesh']['algorithm']}")
+    if not normalized["constraints"] or not normalized["loads"]:
+        raise ValueError("Job needs at least one constraint and one load")
+    normalized["stl"] = os.path.join(base_dir, job["stl"])
+    stem = os.path.splitext(os.path.basename(job["stl"]))[0]
+    normalized["output"] = os.path.join(base_dir, job.get("output", f"{stem}_results"))
+    if job.get("initial_densities") is not None:
+        normalized["initial_densities"] = os.path.join(base_dir, job["initial_densities"])
+    if job.get("continuation"):
+        if job.get("initial_densities") is not None:
+            raise ValueError("A job cannot have both 'initial_densities' and 'continuation'")
+        normalized["continuation"] = continuation_levels(normalized["mesh"]["resolution"], job["continuation"],
+                                                         normalized["optimization"]["max_iterations"])
+    return normalized
+
+
+def continuation_levels(resolution, levels, max_iterations):
+    """
+    Coarse-to-fine levels for optimize_continuation.
+    Parameters:
+    - resolution: Voxel resolution of the finest level.
+    - levels: Either a number of levels, each half the resolution of the next finer one
+      and running twice its max_iterations (the coarsest runs max_iterations), or an
+      explicit list of {"resolution": ..., optimization setting overrides}, coarse to fine.
+    - max_iterations: Iterations of the coarsest level when levels is a number.
+    Returns the list of level dicts.
+    """
+    if isinstance(levels, bool):
+        raise ValueError(f"Continuation needs a number of levels or a list of levels, not {levels}")
+    if isinstance(levels, (int, float, np.number)):
+        if not float(levels).is_integer():
+            raise ValueError(f"Continuation needs a whole number of levels, not {levels}")
+        levels = int(levels)
+        if levels < 1:
+            raise ValueError(f"Continuation needs at least one level, not {levels}")
+        levels = [{"resolution": int(round(resolution / 2 ** (levels - 1 - level))),
+                   "max_iterations": max(max_iterations // 2 ** level, MIN_LEVEL_ITERATIONS)}
+                  for level in range(levels)]
+    levels = [dict(level) for level in levels]
+    if any("resolution" not in level for level in levels):
+        raise ValueError("Every continuation level needs a 'resolution'")
+    resolutions = [level["resolution"] for level in levels]
+    if resolutions[0] < MIN_LEVEL_RESOLUTION:
+        raise ValueError(f"Coarsest continuation level has resolution {resolutions[0]}, "
+                         f"at least {MIN_LEVEL_RESOLUTION} is needed")
+    if resolutions != sorted(resolutions):
+        raise ValueError(f"Continuation levels must go from coarse to fine, got resolutions {resolutions}")
+    return levels
+
+
+def continuation_depth(resolution, max_levels=3):
+    """ Most levels, up to max_levels, that keep the coarsest at or above MIN_LEVEL_RESOLUTION """
+    levels = 1
+    while levels < max_levels and round(resolution / 2 ** levels) >= MIN_LEVEL_RESOLUTION:
+        levels += 1
+    return levels
+
+
+def load_job(file_path):
+    """ Read a JSON job file; relative paths in it are relative to the file """
+    with open(file_path) as f:
+        job = json.load(f)
+    return normalize_job(job, base_dir=os.path.dirname(os.path.abspath(file_path)))
+
+
+def material_from(properties):
+    material = MaterialProperties()
+    material.set_properties(properties["youngs_modulus"], properties["poissons_ratio"], properties.get("density"))
+    return material
+
+
+def mesh_design_space(stl_path, resolution, lean=False):
+    """
+    Voxel mesh of an STL, and its surface (vertices, faces) for surface_face regions.
+    lean stores the mesh in compact dtypes (see fea.mesh_generation.VoxelMesh).
+    """
+    vertices, faces = read_stl(stl_path)
+    return voxelize(vertices, faces, resolution=resolution, lean=lean), (vertices, faces)
+
+
+def mesh_job(job):
+    """
+    Voxel mesh of a normalized job's design space, its surface (vertices, faces) and the
+    symmetry axes from resolve_symmetry; with symmetry the mesh is the fundamental region.
+    """
+    surface = read_stl(job["stl"])
+    symmetry = resolve_symmetry(surface, job["mesh"]["resolution"], job["constraints"], job["loads"],
+                                job["mesh"]["symmetry"])
+    voxel_mesh = voxelize(*surface, resolution=job["mesh"]["resolution"], lean=job["optimization"]["lean_memory"],
+                          symmetry=symmetry)
+    return voxel_mesh, surface, symmetry
+
+
+def element_dtype(settings):
+    """ Storage type of the per-element optimization arrays: float32 with "lean_memory" """
+    return np.float32 if settings["lean_memory"] else np.float64
+
+
+def solver_options(settings):
+    """ VoxelFEASolver keyword arguments for the optimization settings """
+    options = {"method": settings["solver"], "rtol": settings["rtol"]}
+    if settings["lean_memory"]:
+        options["chunk_elements"] = LEAN_CHUNK_ELEMENTS
+    return options
+
+
+def load_case_names(loads):
+    """ Load case names in order of first appearance; loads without a "case" belong to "default" """
+    return list(dict.fromkeys(load.get("case", "default") for load in loads))
+
+
+def case_weights(loads, settings):
+    """ Objective weight of every load case, in load_case_names order """
+    weights = settings.get("case_weights", {})
+    return [float(weights.get(name, 1.0)) for name in load_case_names(loads)]
+
+
+def boundary_conditions(voxel_mesh, constraints, loads, surface=None):
+    """
+    Fixed DOFs and the (n_dofs, n_cases) force matrix, one column per load case, of
+    constraints and loads on the full grid of voxel_mesh.
+    surface is the design surface (vertices, faces) that surface_face regions refer to.
+    """
+    n_dofs = 3 * int(np.prod([n + 1 for n in voxel_mesh.shape]))
+    fixed = [dofs_for_nodes(voxel_mesh.grid_node_ids[select_nodes(voxel_mesh.nodes, constraint["region"], surface)],
+                            constraint.get("components", (0, 1, 2)))
+             for constraint in constraints]
+
+    names = load_case_names(loads)
+    forces = np.zeros((n_dofs, len(names)))
+    for load in loads:
+        if load.get("type", "Force") != "Force":
+            raise ValueError(f"Unsupported load type: {load['type']}")
+        loaded = voxel_mesh.grid_node_ids[select_nodes(voxel_mesh.nodes, load["region"], surface)]
+        case = names.index(load.get("case", "default"))
+        forces[:, case] += force_vector(n_dofs, loaded, load["magnitude"], load["direction"])
+    return np.unique(np.concatenate(fixed)), forces
+
+
+def build_problem(voxel_mesh, material, constraints, loads, settings, surface=None, symmetry=()):
+    """
+    VoxelFEASolver with the constraints applied, and the global force vector, or an
+    (n_dofs, n_cases) matrix with one column per load case if there are several.
+    surface is the design surface (vertices, faces) that surface_face regions refer to.
+
+    With symmetry axes, voxel_mesh is the fundamental region on the upper side of those
+    mirror planes (see fea.mesh_generation.symmetric_grid). Regions are then selected
+    on the mirrored part, and the nodes on a plane keep half their load and only move
+    within it (see fea.loads_and_constraints.symmetry_constraints).
+    """
+    solver = VoxelFEASolver(voxel_mesh.shape, material, voxel_mesh.spacing, active=voxel_mesh.occupancy,
+                            **solver_options(settings))
+    if symmetry:
+        full = mirror_mesh(voxel_mesh, symmetry)
+        planes = symmetry_constraints(voxel_mesh.origin, symmetry, tolerance=0.25 * min(voxel_mesh.spacing))
+        fixed, forces = boundary_conditions(full, constraints + planes, loads, surface)
+        dofs, share = fundamental_dofs(tuple(n + 1 for n in full.shape), symmetry)
+        is_fixed = np.zeros(len(forces), dtype=bool)
+        is_fixed[fixed] = True
+        fixed, forces = np.flatnonzero(is_fixed[dofs]), forces[dofs] * share[:, None]
+    else:
+        fixed, forces = boundary_conditions(voxel_mesh, constraints, loads, surface)
+    solver.set_fixed_dofs(fixed)
+    return solver, forces[:, 0] if forces.shape[1] == 1 else forces
+
+
+def resolve_symmetry(surface, resolution, constraints, loads, planes="auto"):
+    """
+    Symmetry axes to optimize the fundamental region for.
+    Parameters:
+    - surface: Design surface (vertices, faces).
+    - resolution: Voxel resolution the symmetry is checked at.
+    - constraints, loads: Lists as described in normalize_job.
+    - planes: Names of mirror planes ("x", "y", "z"), or "auto" for every plane the part
+      is symmetric about (fea.mesh_generation.detect_symmetry).
+    A plane only qualifies if the constraints and loads are mirror-symmetric about it as
+    well, checked on the voxelized whole part; requested planes that do not raise a ValueError.
+    """
+    if not planes:
+        return ()
+    geometric = detect_symmetry(*surface, resolution=resolution)
+    if planes == "auto":
+        candidates = geometric
+    else:
+        candidates = tuple(sorted(AXES.index(name) for name in set(planes)))
+        asymmetric = [AXES[axis] for axis in candidates if axis not in geometric]
+        if asymmetric:
+            raise ValueError(f"The part is not mirror-symmetric about its {', '.join(asymmetric)} mid-plane")
+    if not candidates:
+        return ()
+
+    pitch, origin, shape = symmetric_grid(surface[0], resolution, mirrored=candidates)
+    whole = voxelize(*surface, pitch=pitch, origin=origin, shape=shape)
+    fixed, forces = boundary_conditions(whole, constraints, loads, surface)
+    node_shape = tuple(n + 1 for n in whole.shape)
+    axes = tuple(axis for axis in candidates if is_symmetric(fixed, forces, node_shape, axis))
+    rejected = [AXES[axis] for axis in candidates if axis not in axes]
+    if rejected and planes != "auto":
+        raise ValueError(f"Constraints and loads are not mirror-symmetric about the {', '.join(rejected)} mid-plane")
+    if rejected:
+        logging.info(f"Constraints or loads break the {', '.join(rejected)} symmetry of the part")
+    if axes:
+        logging.info(f"Optimizing 1/{2 ** len(axes)} of the part, symmetric about {[AXES[axis] for axis in axes]}")
+    return axes
+
+
+def mirror_result(voxel_mesh, result, symmetry):
+    """
+    The mesh and optimize() result of a fundamental region (see build_problem) reflected onto
+    the whole part: densities and displacements are mirrored, and the compliances, which
+    the region carries 1 / 2^k of for k planes, are scaled back up.
+    """
+    if not symmetry:
+        return voxel_mesh, result
+    factor = 2.0 ** len(symmetry)
+    mirrored = dict(result)
+    for key in ("densities", "physical_densities"):
+        mirrored[key] = mirror_cells(result[key], voxel_mesh.shape, symmetry)
+    if result.get("displacements") is not None:
+        u = result["displacements"]
+        nodes = mirror_nodes(u.reshape((-1, 3) + u.shape[1:]), voxel_mesh.shape, symmetry)
+        mirrored["displacements"] = nodes.reshape((-1,) + u.shape[1:])
+    mirrored["compliance"] = factor * result["compliance"]
+    mirrored["case_compliances"] = [factor * c for c in result["case_compliances"]]
+    mirrored["history"] = []
+    for entry in result["history"]:
+        entry = {**entry, "compliance": factor * entry["compliance"]}
+        if "case_compliances" in entry:
+            entry["case_compliances"] = [factor * c for c in entry["case_compliances"]]
+        mirrored["history"].append(entry)
+    if "levels" in result:
+        mirrored["levels"] = [{**level, "compliance": factor * level["compliance"]} for level in result["levels"]]
+    mirrored["symmetry"] = [AXES[axis] for axis in symmetry]
+    return mirror_mesh(voxel_mesh, symmetry), mirrored
+
+
+def load_initial_densities(file_path, voxel_mesh):
+    """ Design densities from an earlier run's densities.npz, resampled onto voxel_mesh """
+    with np.load(file_path) as data:
+        source = VoxelMesh(data["occupancy"], data["origin"], data["spacing"])
+        return np.clip(resample_cells(data["densities"], source, voxel_mesh), 0.0, 1.0)
+
+
+def optimize(voxel_mesh, material, constraints, loads, settings=None, context=None, initial_densities=None,
+             checkpoint_path=None, resume=None, surface=None, initial_displacements=None, symmetry=()):
+    """
+    Run SIMP compliance optimization on a voxel design space.
+    Parameters:
+    - voxel_mesh: fea.mesh_generation.VoxelMesh.
+    - material: MaterialProperties.
+    - constraints, loads: Lists as described in normalize_job.
+    - settings: Optimization settings overriding DEFAULT_OPTIMIZATION.
+    - context: Optional job context (gui.workers.JobContext); receives progress and the
+      physical densities every iteration and can cancel the run.
+    - initial_densities, checkpoint_path, resume: See TopologyOptimizer and its run().
+    - surface: Design surface (vertices, faces) for surface_face regions.
+    - initial_displacements: Start for the first solve, see TopologyOptimizer.run().
+    - symmetry: Axes of mirror planes voxel_mesh is the fundamental region of (see
+      build_problem); the context receives the mirrored densities.
+    Returns the TopologyOptimizer.run() result, for the fundamental region (see mirror_result).
+    """
+    settings = {**DEFAULT_OPTIMIZATION, **(settings or {})}
+    solver, forces = build_problem(voxel_mesh, material, constraints, loads, settings, surface, symmetry)
+    design_filter = DensityFilter(settings["filter_radius"] * min(voxel_mesh.spacing), shape=voxel_mesh.shape,
+                                  spacing=voxel_mesh.spacing, active=voxel_mesh.occupancy,
+                                  mode=settings["filter_mode"], dtype=element_dtype(settings),
+                                  mirror_axes=symmetry)
+    max_iterations = settings["max_iterations"]
+
+    def report(iteration, densities, compliance):
+        if context is not None:
+            context.progress(iteration / max_iterations, f"Iteration {iteration}, compliance {compliance:.4g}")
+            context.publish(mirror_cells(densities, voxel_mesh.shape, symmetry) if symmetry else densities)
+            context.check_cancelled()
+
+    optimizer = TopologyOptimizer(solver, forces, settings["volume_fraction"], penalty=settings["penalty"],
+                                  move_limit=settings["move_limit"], max_iterations=max_iterations,
+                                  tolerance=settings["tolerance"], design_filter=design_filter, callback=report,
+                                  warm_start=settings["warm_start"], checkpoint_path=checkpoint_path,
+                                  checkpoint_interval=settings["checkpoint_interval"],
+                                  case_weights=case_weights(loads, settings), objective=settings["objective"],
+                                  prune_void=settings["prune_void"], void_threshold=settings["void_threshold"],
+                                  freeze_after=settings["freeze_after"], prune_interval=settings["prune_interval"],
+                                  dtype=element_dtype(settings))
+    return optimizer.run(initial_densities, resume=resume, displacements=initial_displacements)
+
+
+class _LevelContext:
+    """ Job context of one continuation level: progress within the level's share, densities of the finest only """
+
+    def __init__(self, context, index, count):
+        self.context = context
+        self.index = index
+        self.count = count
+
+    def progress(self, fraction, message=""):
+        self.context.progress((self.index + fraction) / self.count, f"Level {self.index + 1}/{self.count}: {message}")
+
+    def publish(self, data):
+        if self.index == self.count - 1:
+            self.context.publish(data)
+
+    def check_cancelled(self):
+        self.context.check_cancelled()
+
+
+def optimize_continuation(surface, levels, material, constraints, loads, settings=None, context=None,
+                          checkpoint_dir=None, resume=False, voxel_mesh=None, symmetry=()):
+    """
+    Coarse-to-fine SIMP optimization of a design surface.
+
+    Every level voxelizes the surface at its resolution and runs optimize() with the
+    settings overridden by the level's own (typically fewer max_iterations on finer
+    levels). Each level after the first starts from the previous level's design
+    densities and displacements, trilinearly prolonged onto its grid. filter_radius
+    stays in cells of the level, so the coarse levels settle the layout under a wide
+    filter at little cost and the finer levels only refine it.
+    Parameters:
+    - surface: Design surface (vertices, faces); also used for surface_face regions.
+    - levels: List of {"resolution": ..., setting overrides}, see continuation_levels.
+    - material, constraints, loads, settings, context: As for optimize().
+    - checkpoint_dir: Directory for the checkpoint_level<n>.npz of every level, and for
+      continuation.json with the history and summary of every finished level. With
+      resume, the run continues at the finest level that has a checkpoint, and the
+      earlier levels' history and summaries are read back from continuation.json.
+    - voxel_mesh: Voxel mesh to use for the finest level instead of voxelizing again.
+    - symmetry: Axes of mirror planes; every level then optimizes the fundamental region
+      (see build_problem).
+    Returns the finest level's VoxelMesh and optimize() result, whose history covers all
+    levels run (entries carry "level" and "resolution") and whose "levels" summarize them.
+    """
+    settings = {**DEFAULT_OPTIMIZATION, **(settings or {})}
+    first = 0
+    if resume and checkpoint_dir is not None:
+        for index in range(len(levels)):
+            if os.path.exists(_level_checkpoint(checkpoint_dir, index)):
+                first = index
+
+    history = []
+    summaries = []
+    if first > 0:
+        history, summaries = _load_level_log(checkpoint_dir, first)
+    mesh = result = None
+    for index in range(first, len(levels)):
+        level = levels[index]
+        level_settings = {**settings, **{key: value for key, value in level.items() if key != "resolution"}}
+        start = time.perf_counter()
+        with profiler.span("level", level=index, resolution=level["resolution"]):
+            coarse, previous = mesh, result
+            if index == len(levels) - 1 and voxel_mesh is not None:
+                mesh = voxel_mesh
+            else:
+                mesh = voxelize(*surface, resolution=level["resolution"], lean=level_settings["lean_memory"],
+                                symmetry=symmetry)
+            logging.info(f"Continuation level {index + 1}/{len(levels)}: {mesh.n_elements} voxels on a "
+                         f"{mesh.shape} grid")
+            densities = displacements = None
+            if previous is not None:
+                blend = level_settings["continuation_blend"]
+                densities = np.clip(resample_cells(previous["densities"], coarse, mesh), 0.0, 1.0)
+                densities = (1.0 - blend) * densities + blend * level_settings["volume_fraction"]
+                displacements = _prolong_displacements(previous["displacements"], coarse, mesh)
+
+            checkpoint_path = None
+            level_resume = None
+            if checkpoint_dir is not None and level_settings["checkpoint_interval"]:
+                checkpoint_path = _level_checkpoint(checkpoint_dir, index)
+                if resume and index == first and os.path.exists(checkpoint_path):
+                    logging.info(f"Resuming from {checkpoint_path}")
+                    level_resume = checkpoint_path
+            result = optimize(mesh, material, constraints, loads, level_settings,
+                              None if context is None else _LevelContext(context, index, len(levels)),
+                              densities, checkpoint_path=checkpoint_path, resume=level_resume, surface=surface,
+                              initial_displacements=displacements, symmetry=symmetry)
+
+        history.extend({**entry, "level": index, "resolution": level["resolution"]} for entry in result["history"])
+        summaries.append({"level": index, "resolution": level["resolution"], "shape": list(mesh.shape),
+                          "elements": int(mesh.n_elements), "iterations": result["iterations"],
+                          "compliance": result["compliance"], "seconds": time.perf_counter() - start})
+        if checkpoint_dir is not None:
+            with open(os.path.join(checkpoint_dir, "continuation.json"), "w") as f:
+                json.dump({"history": history, "levels": summaries}, f)
+    return mesh, {**result, "history": history, "levels": summaries}
+
+
+def _level_checkpoint(checkpoint_dir, index):
+    return os.path.join(checkpoint_dir, f"checkpoint_level{index}.npz")
+
+
+def _load_level_log(checkpoint_dir, first):
+    """ History entries and summaries of the levels before first, from continuation.json """
+    file_path = os.path.join(checkpoint_dir, "continuation.json")
+    if not os.path.exists(file_path):
+        logging.warning(f"No {file_path}; the summary will only cover levels from {first + 1} on")
+        return [], []
+    with open(file_path) as f:
+        log = json.load(f)
+    return ([entry for entry in log["history"] if entry["level"] < first],
+            [summary for summary in log["levels"] if summary["level"] < first])
+
+
+def _prolong_displacements(displacements, coarse, fine):
+    """ DOF vector or (n_dofs, n_cases) matrix on the coarse grid, interpolated onto the fine grid's nodes """
+    if displacements is None:
+        return None
+    cases = displacements.shape[1:]
+    nodes = resample_nodes(displacements.reshape((-1, 3) + cases), coarse, fine)
+    return nodes.reshape((-1,) + cases)
+
+
+def optimize_symmetric(voxel_mesh, surface, resolution, material, constraints, loads, settings=None, context=None,
+                       levels=None):
+    """
+    Optimize a whole-part voxel mesh through its fundamental region, for the mirror planes
+    that the part, constraints and loads share (resolve_symmetry with "auto").
+    Parameters:
+    - voxel_mesh: Whole-part VoxelMesh on the symmetric_grid of the part's mirror planes
+      (see fea.mesh_generation.symmetric_voxelize), so that the region's mirror image is the same grid.
+    - surface: Design surface (vertices, faces).
+    - resolution: Voxel resolution voxel_mesh was built at.
+    - material, constraints, loads, settings, context: As for optimize().
+    - levels: Continuation levels; if given, the region runs optimize_continuation().
+    Returns the result mirrored onto voxel_mesh's grid (see mirror_result).
+    """
+    symmetry = resolve_symmetry(surface, resolution, constraints, loads)
+    region = fundamental_mesh(voxel_mesh, symmetry)
+    if levels:
+        region, result = optimize_continuation(surface, levels, material, constraints, loads, settings, context,
+                                               voxel_mesh=region, symmetry=symmetry)
+    else:
+        result = optimize(region, material, constraints, loads, settings, context, surface=surface,
+                          symmetry=symmetry)
+    return mirror_result(region, result, symmetry)[1]
+
+
+def export_stl(file_path, densities, voxel_mesh, settings=None, context=None):
+    """
+    Write the smoothed, decimated iso-surface of physical densities on voxel_mesh as an STL
+    (see fea.mesh_generation.density_surface and DEFAULT_EXPORT). Returns the mesh.
+    """
+    settings = {**DEFAULT_EXPORT, **(settings or {})}
+    if context is not None:
+        context.progress(0.0, "Extracting surface")
+    mesh = density_surface(densities, voxel_mesh, level=settings["level"],
+                           smoothing_iterations=settings["smoothing_iterations"], max_faces=settings["max_faces"])
+    if len(mesh.faces) == 0:
+        raise ValueError(f"No material above density {settings['level']} to export")
+    if context is not None:
+        context.check_cancelled()
+    mesh.export(file_path)
+    logging.debug(f"Exported {file_path}")
+    return mesh
+
+
+def write_results(output_dir, job, voxel_mesh, result, timings, memory=None):
+    """
+    Write densities.npz (design and physical densities on the voxel grid, with its
+    occupancy, origin and spacing) and summary.json (job, scalars, history, timings,
+    and the peak memory of every stage as measured by utils.profiling.PeakMemory).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    np.savez(os.path.join(output_dir, "densities.npz"),
+             densities=result["densities"].reshape(voxel_mesh.shape),
+             physical_densities=result["physical_densities"].reshape(voxel_mesh.shape),
+             occupancy=voxel_mesh.occupancy, origin=voxel_mesh.origin, spacing=voxel_mesh.spacing)
+    summary = {
+        "job": job,
+        "compliance": result["compliance"],
+        "case_compliances": dict(zip(load_case_names(job["loads"]), result["case_compliances"])),
+        "volume": result["volume"],
+        "iterations": result["iterations"],
+        "history": result["history"],
+        "timings": timings,
+    }
+    if memory is not None:
+        summary["memory"] = memory
+    for key in ("levels", "symmetry"):
+        if key in result:
+            summary[key] = result[key]
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def run_job(job, context=None, resume=False):
+    """
+    Mesh, analyse and optimize a normalized job and write its results; returns the summary.
+    Checkpoints go to checkpoint.npz in the output directory (checkpoint_level<n>.npz
+    per level with continuation); with resume, a run continues from there if the file exists.
+    """
+    timings = {}
+    memory = {}
+    if job.get("continuation"):
+        start = time.perf_counter()
+        surface = read_stl(job["stl"])
+        symmetry = resolve_symmetry(surface, job["mesh"]["resolution"], job["constraints"], job["loads"],
+                                    job["mesh"]["symmetry"])
+        timings["load"] = time.perf_counter() - start
+        os.makedirs(job["output"], exist_ok=True)
+        with PeakMemory() as peak:
+            voxel_mesh, result = optimize_continuation(surface, job["continuation"], material_from(job["material"]),
+                                                       job["constraints"], job["loads"], job["optimization"],
+                                                       context, checkpoint_dir=job["output"], resume=resume,
+                                                       symmetry=symmetry)
+            voxel_mesh, result = mirror_result(voxel_mesh, result, symmetry)
+        timings["optimize"] = time.perf_counter() - start - timings["load"]
+        memory["optimize"] = peak.as_dict()
+        logging.info(f"Optimized {len(job['continuation'])} levels, compliance {result['compliance']:.6g}, "
+                     f"peak RSS {memory['optimize']['peak_rss_mb']} MB")
+        return _finish_job(job, voxel_mesh, result, timings, memory)
+
+    start = time.perf_counter()
+    with PeakMemory() as peak:
+        voxel_mesh, surface, symmetry = mesh_job(job)
+    timings["mesh"] = time.perf_counter() - start
+    memory["mesh"] = peak.as_dict()
+    logging.info(f"Meshed {job['stl']}: {voxel_mesh.n_elements} voxels on a {voxel_mesh.shape} grid")
+
+    initial_densities = None
+    if job.get("initial_densities") is not None:
+        initial_densities = load_initial_densities(job["initial_densities"], voxel_mesh)
+        logging.info(f"Starting from densities of {job['initial_densities']}")
+    os.makedirs(job["output"], exist_ok=True)
+    checkpoint_path = os.path.join(job["output"], "checkpoint.npz")
+    if resume and os.path.exists(checkpoint_path):
+        logging.info(f"Resuming from {checkpoint_path}")
+        resume = checkpoint_path
+    else:
+        resume = None
+
+    start = time.perf_counter()
+    interval = job["optimization"]["checkpoint_interval"]
+    with PeakMemory() as peak:
+        result = optimize(voxel_mesh, material_from(job["material"]), job["constraints"], job["loads"],
+                          job["optimization"], context, initial_densities,
+                          checkpoint_path=checkpoint_path if interval else None, resume=resume, surface=surface,
+                          symmetry=symmetry)
+        voxel_mesh, result = mirror_result(voxel_mesh, result, symmetry)
+    timings["optimize"] = time.perf_counter() - start
+    memory["optimize"] = peak.as_dict()
+    logging.info(f"Optimized in {result['iterations']} iterations, compliance {result['compliance']:.6g}, "
+                 f"peak RSS {memory['optimize']['peak_rss_mb']} MB")
+    return _finish_job(job, voxel_mesh, result, timings, memory)
+
+
+def _finish_job(job, voxel_mesh, result, timings, memory):
+    """ Export part.stl if enabled and write the results of a finished job """
+    os.makedirs(job["output"], exist_ok=True)
+    if job["export"]["stl"]:
+        start = time.perf_counter()
+        with PeakMemory() as peak:
+            mesh = export_stl(os.path.join(job["output"], "part.stl"), result["physical_densities"], voxel_mesh,
+                              job["export"])
+        timings["export"] = time.perf_counter() - start
+        memory["export"] = peak.as_dict()
+        logging.info(f"Exported part.stl with {len(mesh.faces)} triangles")
+
+    return write_results(job["output"], job, voxel_mesh, result, timings, memory)
@@ -1 +1,297 @@
-""""""
+import json
+import logging
+import os
+import tempfile
+import numpy as np
+
+from optimization.algorithms import (aggregate_compliance, compliance_sensitivities, dot64,
+                                     optimality_criteria_update, simp_interpolation)
+from utils.profiling import profiler
+
+
+def save_checkpoint(file_path, state):
+    """
+    Write optimizer state to an .npz file atomically: the data goes to a temporary
+    file in the same directory, which then replaces the old checkpoint in one rename.
+    The displacement field is only a warm-start guess, so it is stored as float32.
+    """
+    arrays = {
+        "densities": state["densities"],
+        "iteration": state["iteration"],
+        "change": state["change"],
+        "compliance": state["compliance"],
+        "move_limit": state["move_limit"],
+        "history": json.dumps(state["history"]),
+        "settings": json.dumps(state.get("settings")),
+    }
+    for key in ("case_factors", "void_counts", "frozen"):
+        if state.get(key) is not None:
+            arrays[key] = state[key]
+    if state.get("displacements") is not None:
+        arrays["displacements"] = state["displacements"].astype(np.float32)
+    directory = os.path.dirname(os.path.abspath(file_path))
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as f:
+        try:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, file_path)
+    logging.debug(f"Checkpoint written at iteration {state['iteration']}: {file_path}")
+
+
+def load_checkpoint(file_path):
+    """ Optimizer state written by save_checkpoint() """
+    with np.load(file_path) as data:
+        return {
+            "densities": data["densities"],
+            "iteration": int(data["iteration"]),
+            "change": float(data["change"]),
+            "compliance": float(data["compliance"]),
+            "move_limit": float(data["move_limit"]),
+            "history": json.loads(str(data["history"])),
+            "case_factors": data["case_factors"] if "case_factors" in data else None,
+            "void_counts": data["void_counts"] if "void_counts" in data else None,
+            "frozen": data["frozen"] if "frozen" in data else None,
+            "displacements": data["displacements"].astype(float) if "displacements" in data else None,
+            "settings": json.loads(str(data["settings"])) if "settings" in data else None,
+        }
+
+
+class TopologyOptimizer:
+    """
+    SIMP compliance minimization under a volume-fraction constraint.
+
+    Works with any FEA solver exposing n_elements, solve(forces, scale, x0) and
+    element_energies(u) (fea.fea_solver.FEASolver or VoxelFEASolver). Elements
+    outside the solver's active mask are held at zero density. An optional
+    optimization.filters.DensityFilter regularizes densities or sensitivities.
+
+    forces may be an (n_dofs, n_cases) matrix of load cases, solved together every
+    iteration; the objective then combines their compliances with case_weights
+    (see optimization.algorithms.aggregate_compliance). The per-case sensitivity factors
+    are averaged over iterations; with the worst-case objective the design otherwise
+    swings between whichever cases are critical in turn.
+
+    Each solve starts from the previous displacement field (warm_start), which
+    iterative solvers converge from in far fewer steps once the design settles.
+    With a checkpoint_path, the state needed to resume is written every
+    checkpoint_interval iterations and at the end (see save_checkpoint); an
+    interval of 0 writes it only at the end. A checkpoint records the settings()
+    it was written with, and resuming under different ones is refused.
+
+    With prune_void, elements whose physical density stayed at or below
+    void_threshold for freeze_after iterations are frozen out of the FE system
+    (solvers with set_frozen(), e.g. VoxelFEASolver), so late iterations only solve
+    for the structure. The frozen set is re-checked every prune_interval
+    iterations: elements within prune_margin cells of the structure or whose
+    density rose again are released. The margin defaults to the design filter
+    radius in cells, ceil(radius / spacing), since the filter can grow material
+    that far.
+
+    dtype is the storage type of the per-element arrays (densities, volumes,
+    gradients); with float32 they take half the memory, while volumes and
+    compliances are still summed in float64.
+    """
+
+    CASE_FACTOR_SMOOTHING = 0.9
+
+    def __init__(self, fea_solver, forces, volume_fraction=0.3, penalty=3.0, move_limit=0.2, e_min=1e-9,
+                 max_iterations=100, tolerance=0.01, design_filter=None, callback=None, warm_start=True,
+                 checkpoint_path=None, checkpoint_interval=10, case_weights=None, objective="weighted",
+                 prune_void=False, void_threshold=1e-3, freeze_after=5, prune_interval=5, prune_margin=None,
+                 dtype=np.float64):
+        self.solver = fea_solver
+        self.forces = np.asarray(forces, dtype=float)
+        self.volume_fraction = volume_fraction
+        self.penalty = penalty
+        self.move_limit = move_limit
+        self.e_min = e_min
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.design_filter = design_filter
+        self.callback = callback
+        self.warm_start = warm_start
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.n_cases = 1 if self.forces.ndim == 1 else self.forces.shape[1]
+        self.case_weights = np.ones(self.n_cases) if case_weights is None else np.asarray(case_weights, dtype=float)
+        if len(self.case_weights) != self.n_cases:
+            raise ValueError(f"Got {len(self.case_weights)} case weights for {self.n_cases} load cases")
+        self.objective = objective
+        self.prune_void = prune_void and hasattr(fea_solver, "set_frozen")
+        if prune_void and not self.prune_void:
+            logging.warning(f"{type(fea_solver).__name__} cannot freeze elements; void pruning is off")
+        self.void_threshold = void_threshold
+        self.freeze_after = freeze_after
+        if prune_interval < 1:
+            raise ValueError(f"prune_interval must be at least 1, not {prune_interval}")
+        self.prune_interval = prune_interval
+        if prune_margin is None:
+            radius = getattr(design_filter, "radius", None)
+            spacing = getattr(fea_solver, "spacing", None)
+            prune_margin = 1 if radius is None or spacing is None else max(1, int(np.ceil(radius / min(spacing))))
+        self.prune_margin = prune_margin
+        self.dtype = np.dtype(dtype)
+
+        n_elements = fea_solver.n_elements
+        active = getattr(fea_solver, "active", None)
+        self.active = np.ones(n_elements, dtype=bool) if active is None else np.asarray(active, dtype=bool)
+        volumes = getattr(fea_solver, "volumes", None)
+        volumes = np.ones(n_elements) if volumes is None else np.asarray(volumes, dtype=float)
+        self.element_volumes = np.where(self.active, volumes, 0.0).astype(self.dtype, copy=False)
+        self.design_volume = self.element_volumes.sum(dtype=np.float64)
+
+    def physical_densities(self, densities):
+        if self.design_filter is None:
+            return densities
+        return self.design_filter.filter_densities(densities)
+
+    def compliance_gradient(self, gradient, densities):
+        if self.design_filter is None:
+            return gradient
+        return self.design_filter.filter_sensitivities(gradient, densities)
+
+    def volume_gradient(self):
+        if self.design_filter is None:
+            return self.element_volumes
+        return self.design_filter.filter_volume_gradient(self.element_volumes)
+
+    def update_frozen(self, void_counts):
+        frozen = self.solver.set_frozen(void_counts >= self.freeze_after, margin=self.prune_margin,
+                                        forces=self.forces)
+        profiler.gauge("live_elements", int(np.count_nonzero(self.active & ~frozen)))
+        return frozen
+
+    def settings(self):
+        """ Settings that shape the design; a checkpoint only resumes under the same ones """
+        design_filter = None
+        if self.design_filter is not None:
+            design_filter = {"type": type(self.design_filter).__name__,
+                             "mode": getattr(self.design_filter, "mode", None),
+                             "radius": getattr(self.design_filter, "radius", None),
+                             "mirror_axes": list(getattr(self.design_filter, "mirror_axes", ()))}
+        return {"volume_fraction": float(self.volume_fraction), "penalty": float(self.penalty),
+                "design_filter": design_filter}
+
+    def _checkpoint_due(self, iteration):
+        return bool(self.checkpoint_interval) and iteration % self.checkpoint_interval == 0
+
+    def checkpoint(self, densities, iteration, change, compliance, history, u, case_factors, void_counts):
+        save_checkpoint(self.checkpoint_path, {
+            "densities": densities, "iteration": iteration, "change": change, "compliance": compliance,
+            "move_limit": self.move_limit, "history": history, "displacements": u, "case_factors": case_factors,
+            "void_counts": void_counts, "frozen": self.solver.frozen if self.prune_void else None,
+            "settings": self.settings(),
+        })
+
+    def run(self, densities=None, resume=None, displacements=None):
+        """
+        Run the optimization loop.
+        Parameters:
+        - densities: Initial design variables (e.g. interpolated from a coarser run);
+          defaults to the uniform volume fraction.
+        - resume: Checkpoint state (load_checkpoint() output) or path to continue from.
+        - displacements: Initial guess for the first solve (e.g. interpolated from a
+          coarser run), shaped like the forces; used only with warm_start.
+        Returns a dict with the design and physical densities, final objective
+        ("compliance") and per-case compliances, volume fraction, iteration count,
+        the last displacements and the per-iteration history.
+        """
+        history = []
+        compliance = np.inf
+        case_compliances = np.full(self.n_cases, np.inf)
+        change = np.inf
+        iteration = 0
+        u = None
+        if displacements is not None and np.shape(displacements) == self.forces.shape:
+            u = np.asarray(displacements, dtype=float)
+        case_factors = None
+        void_counts = np.zeros(len(self.active), dtype=np.int32) if self.prune_void else None
+        if resume is not None:
+            state = load_checkpoint(resume) if isinstance(resume, (str, os.PathLike)) else resume
+            if len(state["densities"]) != len(self.active):
+                raise ValueError(f"Checkpoint has {len(state['densities'])} design variables, "
+                                 f"the problem has {len(self.active)}")
+            if state.get("settings") is not None and state["settings"] != self.settings():
+                raise ValueError(f"Checkpoint was written with settings {state['settings']}, "
+                                 f"this run uses {self.settings()}")
+            densities = state["densities"]
+            iteration, change, compliance = state["iteration"], state["change"], state["compliance"]
+            history = list(state["history"])
+            self.move_limit = state["move_limit"]
+            u = state["displacements"]
+            if u is not None and u.shape != self.forces.shape:
+                u = None  # Load cases changed; the old field is no use as a start
+            case_factors = state.get("case_factors")
+            if self.prune_void and state.get("void_counts") is not None:
+                void_counts = state["void_counts"]
+                if state.get("frozen") is not None:
+                    self.solver.set_frozen(state["frozen"], margin=0)
+            if history:
+                case_compliances = np.asarray(history[-1].get("case_compliances", [compliance]))
+            logging.debug(f"Resuming at iteration {iteration}")
+        if densities is None:
+            densities = np.full(len(self.active), self.volume_fraction)
+        densities = np.where(self.active, densities, 0.0).astype(self.dtype, copy=False)
+        target_volume = self.volume_fraction * self.design_volume
+        volume_gradient = self.volume_gradient()
+        physical = self.physical_densities(densities)
+
+        while iteration < self.max_iterations and change > self.tolerance:
+            iteration += 1
+            with profiler.span("iteration", iteration=iteration):
+                scale, derivative = simp_interpolation(physical, self.penalty, self.e_min)
+                u = self.solver.solve(self.forces, scale, x0=u if self.warm_start else None)
+                with profiler.span("sensitivities"):
+                    energies = self.solver.element_energies(u).reshape(len(scale), self.n_cases)
+                    case_compliances = scale @ energies
+                    compliance, factors = aggregate_compliance(case_compliances, self.case_weights, self.objective)
+                    smoothing = self.CASE_FACTOR_SMOOTHING
+                    case_factors = (factors if case_factors is None
+                                    else smoothing * case_factors + (1.0 - smoothing) * factors)
+                    # Sensitivities are linear in the element energies, so the cases combine before filtering
+                    sensitivities = compliance_sensitivities(energies @ case_factors, derivative)
+                    gradient = self.compliance_gradient(sensitivities.astype(self.dtype, copy=False), densities)
+
+                # The filter is linear, so volume_gradient . x is the exact filtered volume
+                with profiler.span("oc_update"):
+                    new_densities, _ = optimality_criteria_update(
+                        densities, gradient, volume_gradient, target_volume, move_limit=self.move_limit)
+                    new_densities = np.where(self.active, new_densities, 0.0).astype(self.dtype, copy=False)
+                change = float(np.max(np.abs(new_densities - densities)))
+                densities = new_densities
+                physical = self.physical_densities(densities)
+                volume = dot64(self.element_volumes, physical) / self.design_volume
+
+            history.append({"iteration": iteration, "compliance": compliance, "volume": volume,
+                            "change": change, "solver_iterations": getattr(self.solver, "last_iterations", 0)})
+            if self.n_cases > 1:
+                history[-1]["case_compliances"] = case_compliances.tolist()
+            if self.prune_void:
+                history[-1]["live_elements"] = int(np.count_nonzero(self.active & ~self.solver.frozen))
+                void_counts = np.where(physical <= self.void_threshold, void_counts + 1, 0).astype(np.int32)
+                if iteration % self.prune_interval == 0:
+                    self.update_frozen(void_counts)
+            logging.debug(f"Iteration {iteration}: compliance={compliance:.6g} volume={volume:.4f} change={change:.4f}")
+            if self.callback is not None:
+                self.callback(iteration, physical, compliance)
+            if self.checkpoint_path is not None and self._checkpoint_due(iteration):
+                self.checkpoint(densities, iteration, change, compliance, history, u, case_factors, void_counts)
+
+        if self.checkpoint_path is not None and not self._checkpoint_due(iteration):
+            self.checkpoint(densities, iteration, change, compliance, history, u, case_factors, void_counts)
+        if self.prune_void:
+            self.solver.set_frozen(None)
+        return {
+            "densities": densities,
+            "physical_densities": physical,
+            "compliance": compliance,
+            "case_compliances": [float(c) for c in case_compliances],
+            "volume": dot64(self.element_volumes, physical) / self.design_volume,
+            "iterations": iteration,
+            "displacements": u,
+            "history": history,
+        }
@@ -0,0 +1,170 @@
+import csv
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context, shared_memory
+import numpy as np
+
+from fea.fea_solver import VoxelFEASolver
+from fea.mesh_generation import VoxelMesh
+from optimization.filters import DensityFilter
+from optimization.pipeline import (DEFAULT_OPTIMIZATION, build_problem, case_weights, element_dtype, material_from,
+                                   mesh_job, mirror_result, solver_options)
+from optimization.solver import TopologyOptimizer
+from utils.profiling import PeakMemory, profiler
+
+SWEEP_COLUMNS = ("run", "compliance", "volume", "iterations", "solver_iterations", "seconds", "peak_rss_mb", "error")
+
+# Problem arrays attached from shared memory, one set per worker process
+_shared = {}
+
+
+def expand_sweep(grid):
+    """ Cartesian product of {setting: [values]} as a list of {setting: value} dicts """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def share_arrays(arrays):
+    """
+    Copy arrays into new shared memory blocks.
+    Returns (blocks, descriptors); descriptors are small picklable (name, shape, dtype)
+    records for attach_arrays(), and the caller owns (closes and unlinks) the blocks.
+    """
+    blocks, descriptors = [], {}
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        descriptors[key] = (block.name, array.shape, array.dtype.str)
+    return blocks, descriptors
+
+
+def attach_arrays(descriptors):
+    """ Read-only NumPy views of shared memory blocks; returns (blocks, arrays) """
+    blocks, arrays = [], {}
+    for key, (name, shape, dtype) in descriptors.items():
+        block = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        array.flags.writeable = False
+        blocks.append(block)
+        arrays[key] = array
+    return blocks, arrays
+
+
+def _attach_problem(descriptors, material, base_settings, loads, symmetry):
+    blocks, arrays = attach_arrays(descriptors)
+    _shared.update(blocks=blocks, arrays=arrays, material=material_from(material), settings=base_settings,
+                   loads=loads, symmetry=symmetry)
+
+
+def _run_configuration(index, overrides, output_dir):
+    """
+    One sweep run in a worker process. Returns its summary row (errors are reported, not
+    raised) and the profiler snapshot of the run, for the parent to merge.
+    """
+    profiler.reset()
+    arrays = _shared["arrays"]
+    settings = {**_shared["settings"], **overrides}
+    row = {"run": index, **overrides}
+    start = time.perf_counter()
+    try:
+        with PeakMemory() as peak:
+            voxel_mesh = VoxelMesh.from_arrays(arrays)
+            solver = VoxelFEASolver(voxel_mesh.shape, _shared["material"], voxel_mesh.spacing,
+                                    active=voxel_mesh.occupancy, **solver_options(settings))
+            solver.set_fixed_dofs(arrays["fixed_dofs"])
+            design_filter = DensityFilter(settings["filter_radius"] * min(voxel_mesh.spacing),
+                                          shape=voxel_mesh.shape, spacing=voxel_mesh.spacing,
+                                          active=voxel_mesh.occupancy, mode=settings["filter_mode"],
+                                          dtype=element_dtype(settings), mirror_axes=_shared["symmetry"])
+            optimizer = TopologyOptimizer(solver, arrays["forces"], settings["volume_fraction"],
+                                          penalty=settings["penalty"], move_limit=settings["move_limit"],
+                                          max_iterations=settings["max_iterations"], tolerance=settings["tolerance"],
+                                          design_filter=design_filter, warm_start=settings["warm_start"],
+                                          case_weights=case_weights(_shared["loads"], settings),
+                                          objective=settings["objective"], prune_void=settings["prune_void"],
+                                          void_threshold=settings["void_threshold"],
+                                          freeze_after=settings["freeze_after"],
+                                          prune_interval=settings["prune_interval"], dtype=element_dtype(settings))
+            voxel_mesh, result = mirror_result(voxel_mesh, optimizer.run(), _shared["symmetry"])
+    except Exception as e:
+        logging.error(f"Sweep run {index} failed: {e}")
+        row.update(seconds=time.perf_counter() - start, error=str(e))
+        return row, profiler.snapshot()
+
+    if output_dir is not None:
+        np.savez(os.path.join(output_dir, f"run_{index:03d}.npz"),
+                 physical_densities=result["physical_densities"].reshape(voxel_mesh.shape))
+    row.update(compliance=result["compliance"], volume=result["volume"], iterations=result["iterations"],
+               solver_iterations=sum(entry["solver_iterations"] for entry in result["history"]),
+               seconds=time.perf_counter() - start, peak_rss_mb=peak.as_dict()["peak_rss_mb"], error="")
+    return row, profiler.snapshot()
+
+
+def run_sweep(job, grid, workers=None, context=None):
+    """
+    Optimize one design space for every combination of the optimization settings in grid,
+    e.g. {"volume_fraction": [0.2, 0.3], "filter_radius": [1.5, 2.5]}, on a process pool.
+
+    The design space (or its fundamental region, see pipeline.mesh_job) is meshed and
+    constrained once. The voxel mesh, fixed DOFs and
+    force vector are placed in shared memory that every worker attaches to once, so a
+    task only carries its settings. Writes run_NNN.npz densities plus sweep.csv and
+    sweep.json summary tables (including every run's peak RSS) to the job's output
+    directory; returns the rows. The workers' stage timings and counters are merged into
+    utils.profiling.profiler, so sweeps profile like single runs.
+    """
+    configurations = expand_sweep(grid)
+    unknown = set(grid) - set(DEFAULT_OPTIMIZATION)
+    if unknown:
+        raise ValueError(f"Unknown sweep settings: {sorted(unknown)}")
+    output_dir = job["output"]
+    os.makedirs(output_dir, exist_ok=True)
+
+    voxel_mesh, surface, symmetry = mesh_job(job)
+    solver, forces = build_problem(voxel_mesh, material_from(job["material"]), job["constraints"], job["loads"],
+                                   job["optimization"], surface, symmetry)
+    blocks, descriptors = share_arrays({**voxel_mesh.to_arrays(), "fixed_dofs": solver.fixed_dofs, "forces": forces})
+    logging.info(f"Sweeping {len(configurations)} configurations over {voxel_mesh.n_elements} voxels")
+
+    rows = []
+    try:
+        # Spawned workers import only the pipeline modules, never the GUI's Qt state
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"), initializer=_attach_problem,
+                                 initargs=(descriptors, job["material"], job["optimization"], job["loads"],
+                                           symmetry)) as pool:
+            futures = [pool.submit(_run_configuration, index, overrides, output_dir)
+                       for index, overrides in enumerate(configurations)]
+            for future in as_completed(futures):
+                row, profile = future.result()
+                rows.append(row)
+                profiler.merge(profile)
+                if context is not None:
+                    context.progress(len(rows) / len(futures), f"{len(rows)} of {len(futures)} runs done")
+                    if context.cancelled:
+                        for pending in futures:
+                            pending.cancel()
+                        context.check_cancelled()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    rows.sort(key=lambda row: row["run"])
+    write_sweep_table(output_dir, rows, sorted(grid))
+    return rows
+
+
+def write_sweep_table(output_dir, rows, settings):
+    columns = ["run", *settings, *SWEEP_COLUMNS[1:]]
+    with open(os.path.join(output_dir, "sweep.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(output_dir, "sweep.json"), "w") as f:
+        json.dump(rows, f, indent=2)
@@ -1 +1,214 @@
-""""""
+# utils/file_utils.py
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import numpy as np
+
+from utils.profiling import profiler
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "topology_optimization_app")
+
+# Binary STL: 80-byte header, uint32 triangle count, then packed 50-byte records
+STL_HEADER_BYTES = 84
+STL_RECORD = np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")])
+_ASCII_VERTEX = re.compile(rb"vertex([^\n]*)", re.IGNORECASE)
+
+# Odd 64-bit multipliers for hashing coordinate bit patterns
+_HASH_MULTIPLIERS = (np.uint64(0x9E3779B97F4A7C15), np.uint64(0xC2B2AE3D27D4EB4F), np.uint64(0x165667B19E3779F9))
+
+
+def file_digest(file_path, chunk_size=1 << 22):
+    """ Hex BLAKE2b digest of a file's contents """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def weld_vertices(corners):
+    """
+    Merge bitwise-identical points.
+
+    Points are hashed from their coordinate bits and sorted by hash, which is
+    much faster than a row-wise np.unique; an exact comparison guards against
+    hash collisions. Returns (vertices, inverse) with vertices in order of
+    first appearance and corners == vertices[inverse].
+    """
+    corners = np.ascontiguousarray(corners)
+    corners = corners + corners.dtype.type(0)  # Turns -0.0 into 0.0 so both weld
+    bits = corners.view(np.uint32 if corners.dtype.itemsize == 4 else np.uint64)
+    n = len(corners)
+    if n == 0:
+        return corners, np.zeros(0, dtype=np.int64)
+
+    key = np.zeros(n, dtype=np.uint64)
+    for axis, multiplier in enumerate(_HASH_MULTIPLIERS):
+        column = bits[:, axis].astype(np.uint64)
+        column *= multiplier
+        key ^= column
+    order = np.argsort(key)
+    sorted_key = key[order]
+    starts = np.empty(n, dtype=bool)
+    starts[0] = True
+    np.not_equal(sorted_key[1:], sorted_key[:-1], out=starts[1:])
+    # Every point's owner is the first point with the same hash
+    first = np.minimum.reduceat(order, np.flatnonzero(starts))
+    owner = np.empty(n, dtype=np.int64)
+    owner[order] = first[np.cumsum(starts) - 1]
+    if not np.array_equal(bits, bits[owner]):
+        logging.debug("Vertex hash collision, welding by exact sort")
+        rows = bits.view(np.dtype((np.void, bits.itemsize * 3))).ravel()
+        _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+        owner = first[inverse.ravel()]
+
+    kept = np.flatnonzero(owner == np.arange(n))
+    new_ids = np.empty(n, dtype=np.int64)
+    new_ids[kept] = np.arange(len(kept))
+    return corners[kept], new_ids[owner]
+
+
+def _ascii_stl_corners(text):
+    """ Coordinates on the 'vertex' lines of an ASCII STL fragment """
+    coordinates = b" ".join(_ASCII_VERTEX.findall(text)).split()
+    return np.array(coordinates, dtype=np.float32).reshape(-1, 3)
+
+
+@profiler.timed("load_stl")
+def read_stl(file_path, chunk_size=1 << 24):
+    """
+    Read an STL file into a welded triangle mesh.
+
+    Binary files are memory-mapped and decoded as an array of 50-byte records;
+    ASCII files are parsed in chunks of chunk_size bytes. Returns (vertices, faces)
+    as float64 (n, 3) and int64 (m, 3) arrays, which trimesh, the voxelizer and
+    VTK (through vtk_components.vtk_utilities) can all wrap without copying.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        header = f.read(STL_HEADER_BYTES)
+    n_triangles = int(np.frombuffer(header[80:84], dtype="<u4")[0]) if len(header) == STL_HEADER_BYTES else -1
+    if size == STL_HEADER_BYTES + n_triangles * STL_RECORD.itemsize:
+        if n_triangles == 0:
+            corners = np.zeros((0, 3), dtype=np.float32)
+        else:
+            records = np.memmap(file_path, dtype=STL_RECORD, mode="r", offset=STL_HEADER_BYTES, shape=(n_triangles,))
+            corners = records["vertices"].reshape(-1, 3)
+    elif header.lstrip().lower().startswith(b"solid"):
+        blocks = []
+        tail = b""
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                text = tail + chunk
+                cut = text.rfind(b"\n") + 1  # Keep the partial last line for the next chunk
+                tail = text[cut:]
+                blocks.append(_ascii_stl_corners(text[:cut]))
+        blocks.append(_ascii_stl_corners(tail))
+        corners = np.concatenate(blocks)
+        if len(corners) % 3:
+            raise ValueError(f"Truncated ASCII STL: {file_path}")
+    else:
+        raise ValueError(f"Not a valid STL file: {file_path}")
+
+    vertices, inverse = weld_vertices(corners)
+    logging.debug(f"Read {len(corners) // 3} triangles with {len(vertices)} unique vertices from {file_path}")
+    return vertices.astype(np.float64), inverse.reshape(-1, 3)
+
+
+class MeshCache:
+    """
+    Content-addressed on-disk cache of NumPy arrays.
+
+    Entries are keyed by a content digest plus the parameters that produced
+    them (mesher algorithm, resolution, detail level, ...). Each entry is a
+    directory of .npy files, which get() memory-maps copy-on-write, so a hit
+    costs a few page faults instead of a parse or a remesh. Entries are
+    written to a temporary directory and renamed into place, and the least
+    recently used ones are evicted once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=2 << 30):
+        self.directory = directory or os.environ.get("TOPOPT_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_bytes = int(max_bytes)
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(digest, **params):
+        """ Entry key for content with the given digest, processed with the given parameters """
+        text = digest + "".join(f"|{name}={params[name]!r}" for name in sorted(params))
+        return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.isdir(self._path(key))
+
+    def get(self, key):
+        """ Dict of memory-mapped arrays stored under key, or None on a miss """
+        path = self._path(key)
+        try:
+            names = [name for name in os.listdir(path) if name.endswith(".npy")]
+            arrays = {name[:-4]: np.load(os.path.join(path, name), mmap_mode="c") for name in names}
+            os.utime(path)  # Directory mtime records the last use
+        except (OSError, ValueError) as e:
+            if os.path.exists(path):
+                logging.error(f"Discarding unreadable cache entry {key}: {e}")
+                shutil.rmtree(path, ignore_errors=True)
+            profiler.count("cache_misses")
+            return None
+        profiler.count("cache_hits")
+        logging.debug(f"Cache hit {key}")
+        return arrays
+
+    def put(self, key, arrays):
+        """ Store a dict of arrays under key, then evict old entries over the size budget """
+        if key in self:
+            return
+        staging = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(staging, f"{name}.npy"), np.asarray(array))
+            os.replace(staging, self._path(key))
+        except OSError as e:
+            # Another process may have stored the same entry first
+            shutil.rmtree(staging, ignore_errors=True)
+            if key not in self:
+                logging.error(f"Could not write cache entry {key}: {e}")
+            return
+        logging.debug(f"Cache stored {key}")
+        self.evict(keep=key)
+
+    def entries(self):
+        """ (last used time, bytes, key) for every entry, oldest first """
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((os.stat(path).st_mtime, size, key))
+            except OSError:
+                continue  # Evicted concurrently
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """ Drop least recently used entries until the cache fits max_bytes """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+            logging.debug(f"Cache evicted {key}")
+
+    def clear(self):
+        for _, _, key in self.entries():
+            shutil.rmtree(self._path(key), ignore_errors=True)
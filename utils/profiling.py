@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+
+class Profiler:
+    """
+    Stage timings and counters for the whole application.
+
+    span(name) times a block and keeps count, total and maximum per stage name, plus
+    the individual spans (the last max_events of them) for Chrome traces. count()
+    accumulates counters such as CG iterations or cache hits; gauge() records the
+    latest value of a size such as the DOF count. Safe to use from worker threads;
+    worker processes send their snapshot() back to be merge()d into the parent's.
+    """
+
+    def __init__(self, max_events=100000):
+        self.enabled = True
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.origin = time.perf_counter()
+            self.pid = os.getpid()
+            self.stages = {}
+            self.counters = {}
+            self.gauges = {}
+            self.events = deque(maxlen=self.max_events)
+
+    @contextmanager
+    def span(self, name, **args):
+        """
+        Time the enclosed block as stage name. Yields a dict of span arguments that
+        the block can fill in (e.g. iterations), shown in the trace.
+        """
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.record(name, start, time.perf_counter() - start, **args)
+
+    def record(self, name, start, duration, **args):
+        """ Add a span measured elsewhere (e.g. between two VTK events); start is a perf_counter() time """
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                self.stages[name] = [1, duration, duration]
+            else:
+                stats[0] += 1
+                stats[1] += duration
+                stats[2] = max(stats[2], duration)
+            self.events.append(("X", name, start - self.origin, duration, threading.get_ident(), args, self.pid))
+
+    def timed(self, name=None):
+        """ Decorator running a function inside span(name or its qualified name) """
+        def decorate(function):
+            stage = name or function.__qualname__
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def count(self, name, value=1):
+        """ Add value to counter name """
+        if not self.enabled:
+            return
+        with self._lock:
+            total = self.counters.get(name, 0) + value
+            self.counters[name] = total
+            self.events.append(("C", name, time.perf_counter() - self.origin, 0.0, threading.get_ident(),
+                                {name: total}, self.pid))
+
+    def gauge(self, name, value):
+        """ Record the current value of name """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[name] = value
+            self.events.append(("C", name, time.perf_counter() - self.origin, 0.0, threading.get_ident(),
+                                {name: value}, self.pid))
+
+    def snapshot(self):
+        """ Picklable copy of everything recorded, for merge() into another process's profiler """
+        with self._lock:
+            return {"origin": self.origin, "stages": {name: list(stats) for name, stats in self.stages.items()},
+                    "counters": dict(self.counters), "gauges": dict(self.gauges), "events": list(self.events)}
+
+    def merge(self, snapshot):
+        """
+        Add a snapshot() taken in another process (e.g. a sweep worker): stage statistics
+        and counters are summed, gauges take its values and its events join the trace,
+        shifted onto this profiler's clock (perf_counter is system-wide on one machine).
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            for name, (count, total, longest) in snapshot["stages"].items():
+                stats = self.stages.setdefault(name, [0, 0.0, 0.0])
+                stats[0] += count
+                stats[1] += total
+                stats[2] = max(stats[2], longest)
+            for name, value in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.gauges.update(snapshot["gauges"])
+            shift = snapshot["origin"] - self.origin
+            self.events.extend((phase, name, start + shift, *rest) for phase, name, start, *rest in snapshot["events"])
+
+    def summary(self):
+        """ {"stages": {name: count, total, mean and max seconds}, "counters": ..., "gauges": ...} """
+        with self._lock:
+            stages = {name: {"count": count, "total_seconds": total, "mean_seconds": total / count,
+                             "max_seconds": longest}
+                      for name, (count, total, longest) in self.stages.items()}
+            return {"stages": stages, "counters": dict(self.counters), "gauges": dict(self.gauges)}
+
+    def chrome_trace(self):
+        """ Trace Event Format dict for chrome://tracing or Perfetto """
+        with self._lock:
+            events = list(self.events)
+        trace = []
+        for phase, name, start, duration, thread, args, pid in events:
+            event = {"name": name, "ph": phase, "ts": start * 1e6, "pid": pid, "tid": thread,
+                     "args": {key: _jsonable(value) for key, value in args.items()}}
+            if phase == "X":
+                event["dur"] = duration * 1e6
+            trace.append(event)
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def write_json(self, file_path):
+        with open(file_path, "w") as f:
+            json.dump(self.summary(), f, indent=2, default=_jsonable)
+        logging.debug(f"Profile written to {file_path}")
+
+    def write_chrome_trace(self, file_path):
+        with open(file_path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        logging.debug(f"Chrome trace written to {file_path}")
+
+
+def _jsonable(value):
+    if hasattr(value, "item"):
+        return value.item()  # NumPy scalars
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return value
+    return str(value)
+
+
+# Process-wide profiler every stage reports to
+profiler = Profiler()
+
+
+class PeakMemory:
+    """
+    Peak resident memory of a block of code, in MB, as "peak_rss_mb" and the growth
+    over the RSS at entry as "peak_delta_mb". On Linux the kernel's high-water mark is
+    reset on entry (/proc/self/clear_refs), so the peak is that of the block alone and
+    includes native allocations (VTK, solvers) that tracemalloc cannot see. Elsewhere
+    only the process-lifetime peak is available.
+    """
+
+    def __enter__(self):
+        self.resettable = _reset_peak_rss()
+        self.start_mb = _status_mb("VmRSS") if self.resettable else _max_rss_mb()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.peak_mb = _status_mb("VmHWM") if self.resettable else _max_rss_mb()
+        return False
+
+    def as_dict(self):
+        return {"peak_rss_mb": round(self.peak_mb, 1), "peak_delta_mb": round(max(self.peak_mb - self.start_mb, 0.0), 1)}
+
+
+def _reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _status_mb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024.0
+    raise KeyError(field)
+
+
+def _max_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024.0  # Bytes on macOS, KiB elsewhere
@@ -2,7 +2,14 @@
 import vtk
 
 def setup_interactor(render_window, highlight_selection_callback):
+    """
+    Install a cell picker on the render window's interactor. Pressing 'p' picks the
+    cell under the mouse; the callback receives (picker, event) and can read the
+    picked actor and cell id from the picker. Returns the picker.
+    """
     picker = vtk.vtkCellPicker()
+    picker.SetTolerance(0.0005)
     picker.AddObserver("EndPickEvent", highlight_selection_callback)
     render_window.GetInteractor().SetPicker(picker)
+    return picker
 
@@ -1,16 +1,58 @@
 import logging
+import time
 import numpy as np
-from vtkmodules.vtkFiltersCore import vtkDelaunay3D, vtkVoronoi2D
-from vtkmodules.vtkFiltersSources import vtkSphereSource
-from vtkmodules.vtkCommonDataModel import vtkPolyData
-from vtkmodules.vtkRenderingCore import vtkActor, vtkPolyDataMapper, vtkRenderer, vtkRenderWindow
-from vtkmodules.vtkCommonCore import vtkPoints
-from vtkmodules.util import numpy_support
+from vtkmodules.vtkFiltersCore import vtkDelaunay3D, vtkThreshold, vtkVoronoi2D
+from vtkmodules.vtkFiltersGeometry import vtkGeometryFilter
+from vtkmodules.vtkCommonDataModel import vtkDataObject, vtkImageData, vtkPolyData, VTK_HEXAHEDRON, VTK_TETRA
+from vtkmodules.vtkRenderingCore import (vtkActor, vtkDataSetMapper, vtkPointGaussianMapper, vtkPolyDataMapper,
+                                         vtkRenderer, vtkRenderWindow)
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QFrame
+from fea.mesh_generation import (VoxelMesh, estimate_tetrahedra, quality_summary, symmetric_voxelize,
+                                 tetrahedralize)
+from utils.file_utils import file_digest, read_stl
+from utils.profiling import profiler
+from vtk_components.vtk_utilities import (decimate_polydata, numpy_to_polydata, numpy_to_polygons,
+                                          numpy_to_unstructured_grid, numpy_to_vtk_points, numpy_to_vtk_scalars,
+                                          observe_progress, points_to_numpy, polydata_to_numpy, polygons_to_numpy,
+                                          subsample_points)
+
+# Shades point sprites as small spheres instead of Gaussian blobs
+SPHERE_SPLAT_SHADER = (
+    "//VTK::Color::Impl\n"
+    "float dist = dot(offsetVCVSOutput.xy, offsetVCVSOutput.xy);\n"
+    "if (dist > 1.0) {\n"
+    "  discard;\n"
+    "} else {\n"
+    "  float scale = (1.0 - dist);\n"
+    "  ambientColor *= scale;\n"
+    "  diffuseColor *= scale;\n"
+    "}\n"
+)
+
+
+def surface_arrays(polydata, prefix):
+    """ Cacheable arrays of a polygon surface, or None if it holds other cell kinds """
+    if polydata is None:
+        return {}
+    if polydata.GetPoints() is None or polydata.GetNumberOfCells() != polydata.GetNumberOfPolys():
+        return None
+    points, offsets, connectivity = polygons_to_numpy(polydata)
+    return {f"{prefix}_points": points, f"{prefix}_offsets": offsets, f"{prefix}_connectivity": connectivity}
+
+
+def surface_from_arrays(arrays, prefix):
+    if f"{prefix}_points" not in arrays:
+        return None
+    return numpy_to_polygons(arrays[f"{prefix}_points"], arrays[f"{prefix}_offsets"], arrays[f"{prefix}_connectivity"])
+
 
 class Renderer:
-    def __init__(self, render_widget):
+    def __init__(self, render_widget, cache=None):
         self.render_widget = render_widget
+        # Optional utils.file_utils.MeshCache for parsed STLs and generated meshes
+        self.cache = cache
+        self.stl_digest = None
         self.renderer = vtkRenderer()
         self.render_window = self.render_widget.GetRenderWindow()
         self.render_window.AddRenderer(self.renderer)
@@ -19,6 +61,25 @@ class Renderer:
         self.stl_actor = vtkActor()
         self.wireframe_actor = vtkActor()
         self.glyph_actor = vtkActor()
+        self.density_actor = vtkActor()
+        self.selection_actor = vtkActor()
+        self.stl_surface = None
+
+        self.mesh_algorithm = "Delaunay"
+        self.mesh_resolution = 10
+        self.voxel_mesh = None
+        self.node_radius = 0.1
+        # Above these sizes, reduced proxies are drawn while the camera moves. They are
+        # sized for software rendering: ~20k triangles plus ~10k sprites keep a few fps
+        self.lod_cell_budget = 100000
+        self.lod_proxy_cells = 20000
+        self.lod_node_budget = 10000
+        self.lod_proxies = {}
+        self.density_view = None
+        self.density_dirty = False
+        self.last_density_render = 0.0
+        self.density_timer = QTimer()
+        self.density_timer.timeout.connect(self.render_density_if_dirty)
 
         self.setup_vtk_components()
         self.setup_render_window()
@@ -28,8 +89,26 @@ class Renderer:
         self.setup_stl_actor()
         self.setup_wireframe_actor()
         self.setup_glyph_actor()
+        self.setup_density_actor()
+        self.setup_selection_actor()
+        self.setup_lod()
+        self.setup_render_timing()
         self.set_background_color("#252524")
 
+    def setup_render_timing(self):
+        # Every frame, including interactor-driven ones, is reported as a "render" stage
+        self.render_start = None
+        self.renderer.AddObserver("StartEvent", self.on_render_start)
+        self.renderer.AddObserver("EndEvent", self.on_render_end)
+
+    def on_render_start(self, caller, event):
+        self.render_start = time.perf_counter()
+
+    def on_render_end(self, caller, event):
+        if self.render_start is not None:
+            profiler.record("render", self.render_start, time.perf_counter() - self.render_start)
+            self.render_start = None
+
     def setup_render_window(self):
         self.iren.SetRenderWindow(self.render_window)
         self.render_window.Render()
@@ -38,6 +117,7 @@ class Renderer:
 
     def setup_stl_actor(self):
         self.stl_mapper = vtkPolyDataMapper()
+        self.stl_proxy_mapper = vtkPolyDataMapper()
         self.stl_actor.SetMapper(self.stl_mapper)
         self.apply_material_properties(self.stl_actor)
         self.renderer.AddActor(self.stl_actor)
@@ -45,19 +125,92 @@ class Renderer:
 
     def setup_wireframe_actor(self):
         self.wireframe_mapper = vtkPolyDataMapper()
+        self.wireframe_proxy_mapper = vtkPolyDataMapper()
         self.wireframe_actor.SetMapper(self.wireframe_mapper)
         self.wireframe_actor.GetProperty().SetRepresentationToWireframe()
         self.renderer.AddActor(self.wireframe_actor)
         logging.debug("Wireframe actor and mapper set up")
 
     def setup_glyph_actor(self):
-        self.sphere_source = vtkSphereSource()
-        self.sphere_source.SetRadius(0.1)
-        self.glyph_mapper = vtkPolyDataMapper()
+        # Nodes are point sprites: one quad per node instead of a tessellated sphere
+        self.glyph_mapper = self.create_node_mapper()
+        self.glyph_proxy_mapper = self.create_node_mapper()
         self.glyph_actor.SetMapper(self.glyph_mapper)
         self.renderer.AddActor(self.glyph_actor)
         logging.debug("Glyph actor and mapper set up")
 
+    def create_node_mapper(self):
+        mapper = vtkPointGaussianMapper()
+        mapper.SetScaleFactor(self.node_radius)
+        mapper.SetSplatShaderCode(SPHERE_SPLAT_SHADER)
+        mapper.EmissiveOff()
+        return mapper
+
+    def setup_density_actor(self):
+        self.density_grid = vtkImageData()
+        self.density_threshold = vtkThreshold()
+        self.density_threshold.SetInputData(self.density_grid)
+        self.density_threshold.SetThresholdFunction(vtkThreshold.THRESHOLD_UPPER)
+        self.density_threshold.SetInputArrayToProcess(0, 0, 0, vtkDataObject.FIELD_ASSOCIATION_CELLS, "density")
+        self.density_mapper = vtkDataSetMapper()
+        self.density_mapper.SetInputConnection(self.density_threshold.GetOutputPort())
+        self.density_mapper.SetScalarModeToUseCellData()
+        self.density_mapper.SetScalarRange(0.0, 1.0)
+        self.density_actor.SetMapper(self.density_mapper)
+        self.density_actor.SetVisibility(False)
+        self.renderer.AddActor(self.density_actor)
+        logging.debug("Density actor and mapper set up")
+
+    def setup_selection_actor(self):
+        # Highlights picked surface regions; drawn slightly in front of the coincident STL faces
+        self.selection_mapper = vtkPolyDataMapper()
+        self.selection_mapper.SetResolveCoincidentTopologyToPolygonOffset()
+        self.selection_actor.SetMapper(self.selection_mapper)
+        self.selection_actor.GetProperty().SetColor(1.0, 0.85, 0.0)
+        self.selection_actor.SetPickable(False)
+        self.selection_actor.SetVisibility(False)
+        self.renderer.AddActor(self.selection_actor)
+        logging.debug("Selection actor and mapper set up")
+
+    def highlight_faces(self, face_ids):
+        """ Highlight STL triangles (e.g. a picked face region); None or empty clears the highlight """
+        if face_ids is None or len(face_ids) == 0 or self.stl_surface is None:
+            self.selection_actor.SetVisibility(False)
+        else:
+            vertices, faces = self.stl_surface
+            self.selection_mapper.SetInputData(numpy_to_polydata(vertices, np.ascontiguousarray(faces[face_ids])))
+            self.selection_actor.SetVisibility(True)
+        self.render_window.Render()
+
+    def setup_lod(self):
+        # The interaction style renders at still quality right after EndInteractionEvent
+        self.iren.AddObserver("StartInteractionEvent", self.on_start_interaction)
+        self.iren.AddObserver("EndInteractionEvent", self.on_end_interaction)
+        logging.debug("Level-of-detail observers set up")
+
+    def set_lod_proxy(self, actor, mapper, proxy_mapper, proxy):
+        """ Register (or with proxy=None, drop) the reduced data an actor shows while the camera moves """
+        actor.SetMapper(mapper)
+        if proxy is None:
+            self.lod_proxies.pop(actor, None)
+            return
+        proxy_mapper.SetInputData(proxy)
+        self.lod_proxies[actor] = (mapper, proxy_mapper)
+
+    def on_start_interaction(self, caller, event):
+        for actor, (mapper, proxy_mapper) in self.lod_proxies.items():
+            actor.SetMapper(proxy_mapper)
+
+    def on_end_interaction(self, caller, event):
+        for actor, (mapper, proxy_mapper) in self.lod_proxies.items():
+            actor.SetMapper(mapper)
+
+    def build_proxy(self, polydata, context=None):
+        """ Decimated copy of a surface above the LOD budget, else None """
+        if polydata.GetNumberOfCells() <= self.lod_cell_budget:
+            return None
+        return decimate_polydata(polydata, self.lod_proxy_cells, context)
+
     def apply_material_properties(self, actor):
         prop = actor.GetProperty()
         prop.SetColor(0.75, 0.75, 0.75)  # Silver color
@@ -75,17 +228,62 @@ class Renderer:
         return tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
 
     def load_stl(self, file_path):
-        from vtkmodules.vtkIOGeometry import vtkSTLReader
-
-        reader = vtkSTLReader()
-        reader.SetFileName(file_path)
-        reader.Update()
-        self.stl_polydata = reader.GetOutput()
-
+        self.apply_stl(self.prepare_stl(file_path))
+
+    def prepare_stl(self, file_path, context=None):
+        """
+        read_stl() plus the interaction proxy, served from the cache when the file
+        content was seen before. Returns (polydata, proxy or None, content digest or None).
+        """
+        if self.cache is None:
+            polydata = self.read_stl(file_path, context)
+            return polydata, self.build_proxy(polydata, context), None
+
+        digest = file_digest(file_path)
+        key = self.cache.key(digest, kind="stl", lod=(self.lod_cell_budget, self.lod_proxy_cells))
+        arrays = self.cache.get(key)
+        if arrays is not None:
+            logging.debug(f"STL file loaded from cache: {file_path}")
+            return surface_from_arrays(arrays, "surface"), surface_from_arrays(arrays, "proxy"), digest
+
+        polydata = self.read_stl(file_path, context)
+        proxy = self.build_proxy(polydata, context)
+        surface, proxy_surface = surface_arrays(polydata, "surface"), surface_arrays(proxy, "proxy")
+        if surface is not None and proxy_surface is not None:
+            self.cache.put(key, {**surface, **proxy_surface})
+        return polydata, proxy, digest
+
+    def apply_stl(self, result):
+        polydata, proxy, digest = result
+        self.set_stl(polydata, proxy)
+        self.stl_digest = digest
+
+    def read_stl(self, file_path, context=None):
+        """
+        Parse an STL file into polydata wrapping the loader's NumPy buffers, which
+        the voxel mesher reads back without copies. Does not touch the render
+        pipeline, so it can run off the GUI thread.
+        """
+        if context is not None:
+            context.progress(0.0, "Loading STL")
+        vertices, faces = read_stl(file_path)
+        if context is not None:
+            context.check_cancelled()
+        logging.debug(f"STL file loaded successfully: {file_path}")
+        return numpy_to_polydata(vertices, faces)
+
+    def set_stl(self, polydata, proxy=None):
+        self.stl_polydata = polydata
+        # Kept as one (vertices, faces) pair so spatial indexes over it are built once
+        self.stl_surface = polydata_to_numpy(polydata)
+        self.stl_digest = None
+        self.selection_actor.SetVisibility(False)
         self.stl_mapper.SetInputData(self.stl_polydata)
+        if proxy is None:
+            proxy = self.build_proxy(polydata)
+        self.set_lod_proxy(self.stl_actor, self.stl_mapper, self.stl_proxy_mapper, proxy)
         self.render_window.Render()
         self.reset_camera()
-        logging.debug(f"STL file loaded successfully: {file_path}")
         logging.debug(f"Number of cells in STL: {self.stl_polydata.GetNumberOfCells()}")
 
     def reset_camera(self):
@@ -116,56 +314,141 @@ class Renderer:
         logging.debug(f"Mesh settings updated: algorithm={algorithm}, resolution={resolution}")
 
     def generate_mesh(self):
+        result = self.compute_mesh()
+        if result is not None:
+            self.apply_mesh(result)
+
+    @profiler.timed("mesh")
+    def compute_mesh(self, context=None):
+        """
+        Build the mesh for the current settings without touching the render pipeline,
+        so it can run off the GUI thread. Returns (surface polydata, voxel mesh or None, surface proxy or None).
+        """
         if not hasattr(self, 'stl_polydata'):
             logging.error("STL polydata not loaded")
-            return
+            return None
 
         points = self.stl_polydata.GetPoints()
         if points is None:
             logging.error("STL polydata has no points")
-            return
+            return None
 
         num_points = points.GetNumberOfPoints()
         if num_points == 0:
             logging.error("STL polydata has no points")
-            return
-
-        logging.debug(f"Generating mesh using algorithm: {self.mesh_algorithm}")
-
-        if self.mesh_algorithm == "Delaunay":
-            self.generate_delaunay_mesh()
-        elif self.mesh_algorithm == "Voronoi":
-            self.generate_voronoi_mesh()
-        elif self.mesh_algorithm == "Tetrahedral":
-            self.generate_tetrahedral_mesh()
-
-    def generate_delaunay_mesh(self):
+            return None
+
+        algorithm = self.mesh_algorithm
+        key = None
+        if self.cache is not None and self.stl_digest is not None:
+            key = self.cache.key(self.stl_digest, kind="mesh", algorithm=algorithm, resolution=self.mesh_resolution,
+                                 lod=(self.lod_cell_budget, self.lod_proxy_cells), grid="symmetric")
+            arrays = self.cache.get(key)
+            if arrays is not None:
+                logging.debug(f"Mesh loaded from cache: algorithm={algorithm}")
+                voxel_mesh = VoxelMesh.from_arrays(arrays) if "occupancy" in arrays else None
+                return surface_from_arrays(arrays, "surface"), voxel_mesh, surface_from_arrays(arrays, "proxy")
+
+        logging.debug(f"Generating mesh using algorithm: {algorithm}")
+
+        voxel_mesh = None
+        if algorithm == "Delaunay":
+            mesh = self.generate_delaunay_mesh(context)
+        elif algorithm == "Voronoi":
+            mesh = self.generate_voronoi_mesh(context)
+        elif algorithm == "Tetrahedral":
+            mesh = self.generate_tetrahedral_mesh(context)
+        elif algorithm == "Voxel":
+            voxel_mesh = self.generate_voxel_mesh(context)
+            mesh = numpy_to_unstructured_grid(voxel_mesh.nodes, voxel_mesh.elements, VTK_HEXAHEDRON)
+        else:
+            logging.error(f"Unknown mesh algorithm: {algorithm}")
+            return None
+
+        if context is not None:
+            context.check_cancelled()
+        surface = self.surface_of(mesh, context)
+        proxy = self.build_proxy(surface, context)
+        if key is not None:
+            arrays, proxy_arrays = surface_arrays(surface, "surface"), surface_arrays(proxy, "proxy")
+            if arrays is not None and proxy_arrays is not None:
+                if voxel_mesh is not None:
+                    arrays.update(voxel_mesh.to_arrays())
+                self.cache.put(key, {**arrays, **proxy_arrays})
+        return surface, voxel_mesh, proxy
+
+    def apply_mesh(self, result):
+        surface, self.voxel_mesh, proxy = result
+        self.update_mesh(surface, proxy)
+
+    def generate_delaunay_mesh(self, context=None):
         delaunay = vtkDelaunay3D()
         delaunay.SetInputData(self.stl_polydata)
+        observe_progress(delaunay, context, "Delaunay meshing")
         delaunay.Update()
-        self.update_mesh(delaunay.GetOutput())
         logging.debug("Delaunay mesh generated successfully")
+        return delaunay.GetOutput()
 
-    def generate_voronoi_mesh(self):
+    def generate_voronoi_mesh(self, context=None):
         delaunay = vtkDelaunay3D()
         delaunay.SetInputData(self.stl_polydata)
+        observe_progress(delaunay, context, "Delaunay meshing")
         delaunay.Update()
         logging.debug(f"Delaunay2D output has {delaunay.GetOutput().GetNumberOfPoints()} points and {delaunay.GetOutput().GetNumberOfCells()} cells")
         voronoi = vtkVoronoi2D()
         voronoi.SetInputData(delaunay.GetOutput())
+        observe_progress(voronoi, context, "Voronoi meshing")
         voronoi.Update()
-        self.update_mesh(voronoi.GetOutput())
         logging.debug("Voronoi mesh generated successfully")
-
-    def generate_tetrahedral_mesh(self):
-        delaunay = vtkDelaunay3D()
-        delaunay.SetInputData(self.stl_polydata)
-        delaunay.Update()
-        self.update_mesh(delaunay.GetOutput())
-        logging.debug(f"Tetrahedral mesh generated successfully with {delaunay.GetOutput().GetNumberOfPoints()} points and {delaunay.GetOutput().GetNumberOfCells()} cells")
-
-    def update_mesh(self, polydata):
+        return voronoi.GetOutput()
+
+    def generate_tetrahedral_mesh(self, context=None):
+        vertices, faces = self.stl_surface
+        callback = None
+        if context is not None:
+            try:
+                _, elements = estimate_tetrahedra(vertices, faces, resolution=self.mesh_resolution)
+                context.progress(0.0, f"Tetrahedral meshing (about {elements} elements)")
+            except ValueError as e:
+                # Too coarse for the estimate; tetrahedralize() warns about the volume it loses
+                logging.debug(str(e))
+                context.progress(0.0, "Tetrahedral meshing")
+
+            def callback(fraction, message):
+                context.progress(fraction, message)
+                context.check_cancelled()
+        tet_mesh = tetrahedralize(vertices, faces, resolution=self.mesh_resolution, callback=callback)
+        summary = quality_summary(tet_mesh.quality())
+        if summary["elements"]:
+            logging.info(f"Tetrahedral mesh: {tet_mesh.n_nodes} nodes, {tet_mesh.n_elements} elements, "
+                         f"minimum dihedral angle {summary['min_dihedral']['min']:.1f} deg, "
+                         f"mean radius ratio {summary['radius_ratio']['mean']:.2f}, {summary['slivers']} slivers")
+        return numpy_to_unstructured_grid(tet_mesh.nodes, tet_mesh.elements, VTK_TETRA)
+
+    def generate_voxel_mesh(self, context=None):
+        vertices, faces = self.stl_surface
+        if context is not None:
+            context.progress(0.0, "Voxelizing")
+        # On the grid of the part's mirror planes, so an optimization can run on a fundamental region
+        voxel_mesh = symmetric_voxelize(vertices, faces, self.mesh_resolution)
+        logging.debug(f"Voxel mesh generated successfully with {voxel_mesh.n_nodes} nodes and {voxel_mesh.n_elements} cells")
+        return voxel_mesh
+
+    def surface_of(self, dataset, context=None):
+        """ Outer surface polydata of a volume mesh (polydata passes through) """
+        if isinstance(dataset, vtkPolyData):
+            return dataset
+        surface = vtkGeometryFilter()
+        surface.SetInputData(dataset)
+        observe_progress(surface, context, "Extracting surface")
+        surface.Update()
+        return surface.GetOutput()
+
+    def update_mesh(self, polydata, proxy=None):
         self.wireframe_mapper.SetInputData(polydata)
+        if proxy is None:
+            proxy = self.build_proxy(polydata)
+        self.set_lod_proxy(self.wireframe_actor, self.wireframe_mapper, self.wireframe_proxy_mapper, proxy)
         self.wireframe_actor.SetVisibility(True)
         self.render_window.Render()
         logging.debug(f"Updating mesh with {polydata.GetNumberOfPoints()} points and {polydata.GetNumberOfCells()} cells")
@@ -174,33 +457,78 @@ class Renderer:
         if points:
             self.update_glyphs(points)
 
+    def begin_density_stream(self, voxel_mesh, threshold=0.5, frame_rate=10.0):
+        """
+        Allocate the density grid once for a run; update_density() then only
+        rewrites its cell-scalar buffer in place. Renders are throttled to frame_rate
+        by a timer, independent of how often the solver publishes densities.
+        """
+        nx, ny, nz = voxel_mesh.shape
+        self.density_grid.SetDimensions(nx + 1, ny + 1, nz + 1)
+        self.density_grid.SetSpacing(*voxel_mesh.spacing)
+        self.density_grid.SetOrigin(*voxel_mesh.origin)
+        values = np.full(nx * ny * nz, -1.0, dtype=np.float32)  # Cells outside the design space stay hidden
+        self.density_array = numpy_to_vtk_scalars(values, "density")
+        self.density_grid.GetCellData().SetScalars(self.density_array)
+        # vtkImageData numbers cells x-fastest; this view indexes them like the solver's (i, j, k) elements
+        self.density_view = values.reshape(nz, ny, nx).transpose(2, 1, 0)
+        self.density_active = voxel_mesh.occupancy
+        self.density_threshold.SetUpperThreshold(threshold)  # THRESHOLD_UPPER keeps values >= UpperThreshold
+        self.density_actor.SetVisibility(True)
+        self.density_interval = 1.0 / frame_rate
+        self.density_timer.start(int(1000 * self.density_interval))
+        logging.debug(f"Density stream started on {voxel_mesh.shape} grid")
+
+    def update_density(self, densities):
+        """ Copy new element densities into the live grid; cheap enough to call every iteration """
+        if self.density_view is None:
+            return
+        densities = np.asarray(densities).reshape(self.density_view.shape)
+        np.copyto(self.density_view, np.where(self.density_active, densities, -1.0))
+        self.density_array.Modified()
+        self.density_dirty = True
+
+    def render_density_if_dirty(self):
+        now = time.monotonic()
+        if self.density_dirty and now - self.last_density_render >= self.density_interval:
+            self.density_dirty = False
+            self.last_density_render = now
+            self.render_window.Render()
+
+    def end_density_stream(self):
+        self.density_timer.stop()
+        self.density_dirty = False
+        self.render_window.Render()
+        logging.debug("Density stream ended")
+
+    def toggle_density_visibility(self):
+        is_visible = self.density_actor.GetVisibility()
+        self.density_actor.SetVisibility(not is_visible)
+        self.render_window.Render()
+        logging.debug(f"Density visibility toggled to {not is_visible}")
+
     def update_glyphs(self, points):
         if points is None:
             logging.error("No points provided to update_glyphs method.")
             return
 
-        num_points = points.GetNumberOfPoints()
-        numpy_points = self.convert_points_to_numpy(points, num_points)
-        vtk_points = self.convert_numpy_to_vtk_points(numpy_points)
-
+        # Share the mesh's point buffer instead of copying it
         polydata = vtkPolyData()
-        polydata.SetPoints(vtk_points)
-
-        self.sphere_source.SetRadius(0.1)
-        self.sphere_source.Update()
+        polydata.SetPoints(points)
 
         self.glyph_mapper.SetInputData(polydata)
+        proxy = None
+        if points.GetNumberOfPoints() > self.lod_node_budget:
+            proxy = vtkPolyData()
+            proxy.SetPoints(subsample_points(points, self.lod_node_budget))
+        self.set_lod_proxy(self.glyph_actor, self.glyph_mapper, self.glyph_proxy_mapper, proxy)
+
         self.glyph_actor.SetVisibility(True)
         self.render_window.Render()
         logging.debug("Glyphs updated")
 
-    def convert_points_to_numpy(self, points, num_points):
-        numpy_points = np.zeros((num_points, 3))
-        for i in range(num_points):
-            numpy_points[i, :] = points.GetPoint(i)
-        return numpy_points
+    def convert_points_to_numpy(self, points, num_points=None):
+        return points_to_numpy(points)
 
     def convert_numpy_to_vtk_points(self, numpy_points):
-        vtk_points = vtkPoints()
-        vtk_points.SetData(numpy_support.numpy_to_vtk(numpy_points))
-        return vtk_points
+        return numpy_to_vtk_points(numpy_points)
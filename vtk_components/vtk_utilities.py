@@ -1 +1,158 @@
-""""""
+# vtk_components/vtk_utilities.py
+import logging
+import numpy as np
+from vtkmodules.util import numpy_support
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData, vtkUnstructuredGrid
+from vtkmodules.vtkFiltersCore import vtkQuadricClustering
+
+# NumPy dtype matching vtkIdType, so connectivity can be wrapped without conversion
+_ID_DTYPE = np.dtype(numpy_support.get_vtk_to_numpy_typemap()[numpy_support.VTK_ID_TYPE])
+
+
+def points_to_numpy(points):
+    """ (n, 3) NumPy view of a vtkPoints buffer (no copy) """
+    return numpy_support.vtk_to_numpy(points.GetData())
+
+
+def numpy_to_vtk_points(array):
+    """
+    vtkPoints backed by the given (n, 3) array (no copy for contiguous float32/float64).
+    The array is kept alive by the VTK object; writes to it show up in VTK after Modified().
+    """
+    array = np.asarray(array)
+    if array.dtype not in (np.float32, np.float64):
+        array = array.astype(np.float64)
+    array = np.ascontiguousarray(array)
+    points = vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(array, deep=0))
+    return points
+
+
+def _id_array(array):
+    array = np.ascontiguousarray(array, dtype=_ID_DTYPE).ravel()
+    return numpy_support.numpy_to_vtkIdTypeArray(array, deep=0)
+
+
+def numpy_to_vtk_cells(elements):
+    """ vtkCellArray over a uniform (n_cells, nodes_per_cell) connectivity array """
+    elements = np.asarray(elements)
+    offsets = np.arange(0, elements.size + 1, elements.shape[1], dtype=_ID_DTYPE)
+    cells = vtkCellArray()
+    cells.SetData(_id_array(offsets), _id_array(elements))
+    return cells
+
+
+def cells_to_numpy(cells):
+    """ (offsets, connectivity) NumPy views of a vtkCellArray (no copy) """
+    return (numpy_support.vtk_to_numpy(cells.GetOffsetsArray()),
+            numpy_support.vtk_to_numpy(cells.GetConnectivityArray()))
+
+
+def uniform_cells_to_numpy(cells, nodes_per_cell):
+    """ (n_cells, nodes_per_cell) view of a vtkCellArray holding cells of a single size """
+    offsets, connectivity = cells_to_numpy(cells)
+    if len(offsets) > 1 and np.any(np.diff(offsets) != nodes_per_cell):
+        raise ValueError(f"Cell array does not hold uniform {nodes_per_cell}-node cells")
+    return connectivity.reshape(-1, nodes_per_cell)
+
+
+def numpy_to_polydata(vertices, faces):
+    """ Triangle vtkPolyData sharing the vertex and face buffers """
+    polydata = vtkPolyData()
+    polydata.SetPoints(numpy_to_vtk_points(vertices))
+    polydata.SetPolys(numpy_to_vtk_cells(faces))
+    return polydata
+
+
+def polydata_to_numpy(polydata):
+    """ (vertices, faces) views of a triangle vtkPolyData """
+    if polydata.GetNumberOfPoints() == 0:
+        return np.empty((0, 3)), np.empty((0, 3), dtype=_ID_DTYPE)
+    return points_to_numpy(polydata.GetPoints()), uniform_cells_to_numpy(polydata.GetPolys(), 3)
+
+
+def polygons_to_numpy(polydata):
+    """ (points, offsets, connectivity) views of a vtkPolyData's points and polygons """
+    offsets, connectivity = cells_to_numpy(polydata.GetPolys())
+    return points_to_numpy(polydata.GetPoints()), offsets, connectivity
+
+
+def numpy_to_polygons(points, offsets, connectivity):
+    """ Inverse of polygons_to_numpy(); shares the buffers """
+    cells = vtkCellArray()
+    cells.SetData(_id_array(offsets), _id_array(connectivity))
+    polydata = vtkPolyData()
+    polydata.SetPoints(numpy_to_vtk_points(points))
+    polydata.SetPolys(cells)
+    return polydata
+
+
+def numpy_to_unstructured_grid(nodes, elements, cell_type):
+    """ vtkUnstructuredGrid of a single cell type sharing the node and connectivity buffers """
+    grid = vtkUnstructuredGrid()
+    grid.SetPoints(numpy_to_vtk_points(nodes))
+    grid.SetCells(cell_type, numpy_to_vtk_cells(elements))
+    return grid
+
+
+def numpy_to_vtk_scalars(values, name):
+    """ Named VTK data array backed by a contiguous NumPy array (no copy) """
+    values = np.ascontiguousarray(values)
+    array = numpy_support.numpy_to_vtk(values, deep=0)
+    array.SetName(name)
+    return array
+
+
+def scalars_to_numpy(attributes, name):
+    """ NumPy view of a named point or cell data array, or None """
+    array = attributes.GetArray(name)
+    if array is None:
+        return None
+    return numpy_support.vtk_to_numpy(array)
+
+
+def subsample_points(points, max_points):
+    """ vtkPoints holding every k-th point, so at most max_points remain """
+    stride = -(-points.GetNumberOfPoints() // max_points)
+    return numpy_to_vtk_points(points_to_numpy(points)[::stride])
+
+
+def decimate_polydata(polydata, target_cells, context=None):
+    """
+    Coarse stand-in for a large surface by vertex clustering, which is linear in the
+    input size (quadric decimation is far too slow for multi-million-triangle parts).
+    The clustering grid is sized from the target and corrected once from the result.
+    """
+    n_cells = polydata.GetNumberOfCells()
+    divisions = max(16, int(np.sqrt(target_cells / 8.0)))
+    clustering = vtkQuadricClustering()
+    clustering.SetInputData(polydata)
+    clustering.AutoAdjustNumberOfDivisionsOff()
+    observe_progress(clustering, context, "Building preview")
+    for attempt in range(2):
+        clustering.SetNumberOfDivisions(divisions, divisions, divisions)
+        clustering.Update()
+        n_proxy = clustering.GetOutput().GetNumberOfCells()
+        if n_proxy <= 1.5 * target_cells or attempt == 1:
+            break
+        # Clustered surfaces have roughly divisions^2 cells
+        divisions = max(16, int(divisions * np.sqrt(target_cells / n_proxy)))
+    logging.debug(f"Decimated {n_cells} cells to {n_proxy} with {divisions}^3 clusters")
+    return clustering.GetOutput()
+
+
+def observe_progress(algorithm, context, message=""):
+    """
+    Forward a VTK algorithm's progress to a job context and abort it on cancellation.
+    The context needs progress(fraction, message) and a cancelled flag; None is a no-op.
+    """
+    if context is None:
+        return
+
+    def on_progress(caller, event):
+        context.progress(caller.GetProgress(), message)
+        if context.cancelled:
+            caller.SetAbortExecute(1)
+
+    algorithm.AddObserver("ProgressEvent", on_progress)